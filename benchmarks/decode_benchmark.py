@@ -0,0 +1,67 @@
+"""
+Compares the typed JSON decoding of raw files with the untyped (json + Python objects) one.
+
+Usage (from the repository root):
+    python -m benchmarks.decode_benchmark [--races 24] [--repeat 5]
+
+A season of each category is generated from tests/ingestion_test_data (see
+benchmarks.flatten_benchmark) and written as raw files, one API page per race. Both
+decoders must produce the same flat table.
+"""
+import argparse
+import tempfile
+from pathlib import Path
+from benchmarks.flatten_benchmark import best_time, season_races
+from utils.prep import flatten_table, read_object_into_table, read_untyped_table
+from utils.raw_format import PageWriter
+
+
+def write_season(folder: str, category: str, races: int, extension: str) -> str:
+    """
+    Writes a generated season as a raw file.
+
+    Args:
+        folder (str): The folder receiving the raw/ tree.
+        category (str): The category of the data.
+        races (int): Number of races of the season.
+        extension (str): The raw format (".ndjson", ".ndjson.gz", ...).
+
+    Returns:
+        str: The path of the raw file.
+    """
+    path = f"{folder}/raw/{category}/2024_{category}{extension}"
+    pages = [
+        {"MRData": {"total": "1", "RaceTable": {"season": "2024", "Races": [race]}}}
+        for race in season_races(category, races)
+    ]
+    with PageWriter(path) as writer:
+        for page in pages:
+            writer.write(page)
+        writer.commit()
+    return path
+
+
+def main(races: int, repeat: int) -> None:
+    print(f"{'category':<12}{'format':<12}{'MB':>7}{'untyped s':>11}{'typed s':>9}{'speedup':>9}")
+    with tempfile.TemporaryDirectory() as folder:
+        for category in ("laps", "pitstops", "results", "qualifying", "sprint"):
+            for extension in (".ndjson", ".ndjson.gz"):
+                path = write_season(folder, category, races, extension)
+                typed = flatten_table(read_object_into_table(path)[0], path)
+                assert flatten_table(read_untyped_table(path), path).equals(typed), f"{path}: outputs differ"
+
+                untyped_seconds = best_time(lambda: read_untyped_table(path), repeat)
+                typed_seconds = best_time(lambda: read_object_into_table(path), repeat)
+                size = Path(path).stat().st_size / 1024 / 1024
+                print(
+                    f"{category:<12}{extension:<12}{size:>7.2f}{untyped_seconds:>11.3f}"
+                    f"{typed_seconds:>9.3f}{untyped_seconds / typed_seconds:>8.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--races", type=int, default=24, help="races in the generated season")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per decoder (best time is kept)")
+    args = parser.parse_args()
+    main(args.races, args.repeat)
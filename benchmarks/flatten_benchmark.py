@@ -0,0 +1,85 @@
+"""
+Compares the schema-driven flattening plan with `recursive_unnest_explode`.
+
+Usage (from the repository root):
+    python -m benchmarks.flatten_benchmark [--races 24] [--repeat 5]
+
+The input replicates the races of tests/ingestion_test_data to a full season
+(laps: 60 laps x 20 drivers per race) and both methods must return the same rows.
+"""
+import argparse
+import copy
+import json
+from time import perf_counter
+import polars as pl
+from utils.flatten import FlattenPlanner
+from utils.prep import SCHEMA_PATH, recursive_unnest_explode
+
+TEST_DATA = "tests/ingestion_test_data"
+
+
+def season_races(category: str, races: int) -> list:
+    """
+    Builds a season of races of a category from the test data.
+
+    Args:
+        category (str): The category of the test file.
+        races (int): Number of races to generate.
+
+    Returns:
+        list: The races (laps are extended to 60 laps of 20 timings).
+    """
+    with open(f"{TEST_DATA}/{category}.json") as file:
+        race = json.load(file)["MRData"]["RaceTable"]["Races"][0]
+    if category == "laps":
+        timing = race["Laps"][0]["Timings"][0]
+        race["Laps"] = [
+            {"number": str(lap), "Timings": [dict(timing, position=str(p)) for p in range(1, 21)]}
+            for lap in range(1, 61)
+        ]
+    return [copy.deepcopy(race) | {"round": str(race_round)} for race_round in range(1, races + 1)]
+
+
+def best_time(function, repeat: int) -> float:
+    """
+    Returns the best wall time of several runs of a function.
+
+    Args:
+        function (callable): The function to time.
+        repeat (int): Number of runs.
+
+    Returns:
+        float: The best time (in seconds).
+    """
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def main(races: int, repeat: int) -> None:
+    planner = FlattenPlanner.from_file(SCHEMA_PATH)
+    print(f"{'category':<12}{'rows':>9}{'recursive rows/s':>20}{'planned rows/s':>18}{'speedup':>9}")
+    for category in ("laps", "pitstops", "results", "qualifying", "sprint"):
+        df = pl.DataFrame(season_races(category, races))
+        expected = recursive_unnest_explode(df)
+        flat = planner.flatten(df, category)
+        assert expected.select(flat.columns).equals(flat), f"{category}: outputs differ"
+
+        recursive = best_time(lambda: recursive_unnest_explode(df), repeat)
+        planned = best_time(lambda: planner.flatten(df, category), repeat)
+        rows = flat.height
+        print(
+            f"{category:<12}{rows:>9}{rows / recursive:>20,.0f}{rows / planned:>18,.0f}"
+            f"{recursive / planned:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--races", type=int, default=24, help="races in the generated season")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per method (best time is kept)")
+    args = parser.parse_args()
+    main(args.races, args.repeat)
@@ -0,0 +1,53 @@
+"""
+Compares the size of the wide and normalized prep tables.
+
+Usage (from the repository root):
+    python -m benchmarks.normalize_benchmark [--races 24]
+
+A generated season of each race table (benchmarks.flatten_benchmark) is flattened
+wide, then normalized (slim table plus the `races` header). Each table is encoded as
+one zstd Parquet file per season, as after compaction, and its in-memory (Arrow) size
+is reported, as loaded by pandas or BigQuery (normalized ids read as Categorical).
+"""
+import argparse
+import io
+import polars as pl
+from benchmarks.flatten_benchmark import season_races
+from utils.dataset import PARQUET_OPTIONS
+from utils.flatten import FlattenPlanner, RACES_TABLE, encode_ids, normalized_schema, widen
+from utils.prep import SCHEMA_PATH
+
+
+def parquet_size(table: pl.DataFrame) -> int:
+    """Size of a table encoded with the prep Parquet options."""
+    buffer = io.BytesIO()
+    table.write_parquet(buffer, **PARQUET_OPTIONS)
+    return buffer.tell()
+
+
+def main(races: int) -> None:
+    wide_planner = FlattenPlanner.from_file(SCHEMA_PATH)
+    planner = FlattenPlanner(normalized_schema(wide_planner.schema))
+    print(f"{'table':<12}{'rows':>9}{'wide KB':>10}{'slim KB':>10}{'ratio':>8}{'wide MB mem':>13}{'slim MB mem':>13}")
+    headers = []
+    for category in ("laps", "pitstops", "results", "qualifying", "sprint"):
+        df = pl.DataFrame(season_races(category, races))
+        wide = wide_planner.flatten(df, category)
+        slim = planner.flatten(df, category)
+        headers.append(planner.flatten(df, RACES_TABLE))
+        assert widen(slim, headers[-1], wide.columns).with_columns(pl.all().cast(pl.String)).equals(wide)
+
+        wide_size, slim_size = parquet_size(wide), parquet_size(slim)
+        print(
+            f"{category:<12}{wide.height:>9}{wide_size / 1024:>10.1f}{slim_size / 1024:>10.1f}"
+            f"{slim_size / wide_size:>8.2f}{wide.estimated_size('mb'):>13.2f}{encode_ids(slim).estimated_size('mb'):>13.2f}"
+        )
+    races_table = pl.concat(headers).unique(["season", "round"], maintain_order=True)
+    print(f"{RACES_TABLE:<12}{races_table.height:>9}{'':>10}{parquet_size(races_table) / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--races", type=int, default=24, help="races in the generated season")
+    args = parser.parse_args()
+    main(args.races)
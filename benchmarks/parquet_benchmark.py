@@ -0,0 +1,77 @@
+"""
+Reports Parquet encode time and output size per codec on the prep laps tables.
+
+Usage (from the repository root):
+    python -m benchmarks.parquet_benchmark [--files "raw/laps/*"] [--repeat 3]
+
+The raw laps files are flattened once (as in data_prep), then each table is encoded
+with every codec and level below. Without raw files, a generated season of laps
+(benchmarks.flatten_benchmark) is used instead.
+"""
+import argparse
+import glob
+import io
+import polars as pl
+from benchmarks.flatten_benchmark import best_time, season_races
+from utils.prep import flatten_table, read_object_into_table
+
+CODECS = [
+    ("gzip", None),
+    ("gzip", 9),
+    ("snappy", None),
+    ("lz4", None),
+    ("zstd", 1),
+    ("zstd", 3),
+    ("zstd", 9),
+    ("uncompressed", None),
+]
+
+
+def laps_tables(pattern: str) -> list:
+    """
+    Flattens the raw laps files matching a pattern.
+
+    Args:
+        pattern (str): Glob pattern of the raw files.
+
+    Returns:
+        list: The flat tables (a generated season when no file matches).
+    """
+    tables = [flatten_table(read_object_into_table(path)[0], path) for path in sorted(glob.glob(pattern))]
+    if not tables:
+        print(f"No raw file matches {pattern}, using a generated season of laps.")
+        tables = [flatten_table(pl.DataFrame(season_races("laps", 24)), "raw/laps/2024_laps.json")]
+    return tables
+
+
+def main(pattern: str, repeat: int, row_group_size: int | None) -> None:
+    tables = laps_tables(pattern)
+    rows = sum(table.height for table in tables)
+    print(f"{len(tables)} tables, {rows} rows")
+    print(f"{'codec':<14}{'level':>6}{'encode s':>10}{'KB':>10}{'ratio':>8}")
+    baseline = None
+    for codec, level in CODECS:
+        sizes = []
+
+        def encode():
+            sizes.clear()
+            for table in tables:
+                buffer = io.BytesIO()
+                table.write_parquet(
+                    buffer, compression=codec, compression_level=level, row_group_size=row_group_size
+                )
+                sizes.append(buffer.tell())
+
+        seconds = best_time(encode, repeat)
+        size = sum(sizes)
+        baseline = baseline or size
+        print(f"{codec:<14}{level if level is not None else '-':>6}{seconds:>10.3f}{size / 1024:>10.1f}{size / baseline:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", default="raw/laps/*", help="glob pattern of the raw laps files")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per codec (best time is kept)")
+    parser.add_argument("--row-group-size", type=int, default=None, help="rows per row group")
+    args = parser.parse_args()
+    main(args.files, args.repeat, args.row_group_size)
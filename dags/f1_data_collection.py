@@ -4,7 +4,9 @@ from airflow.operators.bash import BashOperator
 from airflow.operators.dummy import DummyOperator
 from datetime import datetime, timedelta
 from pathlib import Path
+import json
 import os
+from utils.config import load_settings
 
 # bash_command
 cwd = os.getcwd()
@@ -15,11 +17,23 @@ data_ingest_command = f"{poetry_run_command} data_ingestion.main"
 data_load_command = f"{poetry_run_command} data_load_into_bigquery.main"
 dbt_command = f"{poetry_shell_command} && dbt build --project-dir dbt_projects"
 
+# ingestion manifest (local copy written by data_ingestion, at the path of its settings)
+settings = load_settings(f"{cwd}/config/settings.yaml")
+manifest_path = Path(cwd) / settings["manifest"]["local_path"]
+
 
 # Step 2: Define Python function to check output and decide the next step
 def check_data_collected():
-    """checking if there are file to upload"""
-    json_to_prep = list(Path(f"{cwd}/raw").rglob("*.json"))
+    """checking if the last ingestion run wrote files to prep (from the manifest, or by scanning raw/)"""
+    if manifest_path.exists():
+        last_run = json.loads(manifest_path.read_text()).get("last_run", {})
+        json_to_prep = last_run.get("files", [])
+    else:
+        json_to_prep = [
+            path
+            for pattern in ("*.json", "*.ndjson", "*.ndjson.gz", "*.ndjson.zst")
+            for path in Path(f"{cwd}/raw").rglob(pattern)
+        ]
 
     # Check if the script printed "SUCCESS"
     if len(json_to_prep) > 0:
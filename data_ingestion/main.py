@@ -1,8 +1,11 @@
+import argparse
 import logging
 from dotenv import dotenv_values
 from data_ingestion.src.f1_api import F1API  # Absolute import
-from utils.s3_utils import connect_s3, upload_results
+from data_ingestion.src.manifest import IngestionManifest
+from utils.s3_utils import connect_storage, upload_results
 from utils.ingestion import fetch_f1_schedule, process_race_data
+from utils.config import load_settings
 
 # Set up logging
 logging.basicConfig(
@@ -11,19 +14,39 @@ logging.basicConfig(
 
 # Constants
 CONFIG_PATH = "config/.env"
-LOOKBACK_DAYS = 5
+SETTINGS_PATH = "config/settings.yaml"
 
 
 # main function
-def main():
-    """Main execution function."""
+def main(dry_run: bool = False):
+    """Main execution function. With `dry_run`, prints the request plan and stops before fetching."""
     config = dotenv_values(CONFIG_PATH)
-    s3_client = connect_s3(config)
-    f1_api = F1API()
+    s3_client = connect_storage(config, load_settings(SETTINGS_PATH))
+    f1_api = F1API(SETTINGS_PATH)
+    manifest = IngestionManifest(**f1_api.settings["manifest"])
+    manifest.load(s3_client)
     fetch_f1_schedule(s3_client, config, f1_api)
-    process_race_data(f1_api, LOOKBACK_DAYS, get_all=False)
-    upload_results(s3_client, f1_api.folder_name)
+    if not manifest.entries:
+        # a first run (or a lost manifest) must not refetch the history already in the bucket
+        manifest.seed(s3_client, f1_api.f1_schedule, f1_api.folder_name)
+    process_race_data(f1_api, manifest, get_all=False, dry_run=dry_run)
+    if dry_run:
+        f1_api.close()
+        return
+    summary = upload_results(s3_client, f1_api.folder_name)
+    # rounds are recorded only once their raw file is in the bucket
+    manifest.confirm_uploads(summary.get("failures", []))
+    manifest.save(s3_client)
+    f1_api.close()
+    logging.info(s3_client.transfer_summary())
+    if f1_api.fetcher.cache:
+        logging.info(f1_api.fetcher.cache.summary())
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fetch the pending F1 data and upload it to S3.")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print the request plan and budget without fetching"
+    )
+    args = parser.parse_args()
+    main(dry_run=args.dry_run)
\ No newline at end of file
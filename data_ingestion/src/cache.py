@@ -0,0 +1,154 @@
+import re
+from datetime import date, timedelta
+from time import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from utils.disk_cache import DiskCache
+
+
+class ResponseCache:
+
+    def __init__(
+        self,
+        directory: str = ".cache/f1_api",
+        max_size_mb: float = 512,
+        current_season_ttl: float = 3600,
+        settle_days: int = 3,
+    ) -> None:
+        """
+        Initializes the on-disk cache of API responses.
+
+        Freshness depends on the age of the data:
+        - a race (or a whole season) is cached forever once `settle_days` have 
+          passed since it took place (see `set_schedule`), as the manifest does,
+        - other seasons and rounds are reused for `current_season_ttl` seconds,
+        - the schedule (no season in the URL) is always revalidated.
+        Stale entries keep their ETag/Last-Modified so they can be revalidated
+        with a conditional request.
+
+        :param directory: Folder holding the cached responses
+        :param max_size_mb: Maximum size of the cache before LRU eviction (in MB)
+        :param current_season_ttl: Time the responses of unsettled seasons stay fresh (in seconds)
+        :param settle_days: Days after a race during which its responses can still change
+        """
+        self.store = DiskCache(directory, max_size_mb)
+        self.current_season_ttl = current_season_ttl
+        self.settle_days = settle_days
+        self.settled_on = {}  # (season, round or None for the whole season) -> date the data stops changing
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    @staticmethod
+    def normalize_url(url: str) -> str:
+        """
+        Normalizes a URL so that equivalent requests share the same cache key
+        (lowercase host, no trailing slash, sorted query parameters such as `limit`/`offset`).
+
+        :param url: The requested URL
+        :return: The normalized URL
+        """
+        parts = urlsplit(url)
+        query = urlencode(sorted(parse_qsl(parts.query)))
+        return urlunsplit(
+            (parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), query, "")
+        )
+
+    def set_schedule(self, schedule: list) -> None:
+        """
+        Records the race dates deciding when the responses of a round or a season settle.
+
+        A season settles with its last race; seasons and rounds missing from the 
+        schedule never settle (they keep `current_season_ttl`).
+
+        :param schedule: The F1 schedule (list of races with their season, round and date)
+        """
+        settled_on = {}
+        for race in schedule:
+            day = date.fromisoformat(race["date"]) + timedelta(days=self.settle_days)
+            settled_on[(race["season"], race["round"])] = day
+            settled_on[(race["season"], None)] = max(day, settled_on.get((race["season"], None), day))
+        self.settled_on = settled_on
+
+    def ttl(self, url: str) -> float | None:
+        """
+        Returns how long the response of a URL stays fresh.
+
+        :param url: The requested URL
+        :return: The TTL in seconds (None for responses cached forever)
+        """
+        season = re.search(r"/(\d{4})(?:/(\d{1,2}))?(?=/|$)", urlsplit(url).path)
+        if season is None:
+            return 0
+        settled_on = self.settled_on.get(season.groups())
+        if settled_on is not None and settled_on <= date.today():
+            return None
+        return self.current_season_ttl
+
+    def lookup(self, url: str) -> tuple | None:
+        """
+        Looks up the cached response of a URL.
+
+        :param url: The requested URL
+        :return: The cached body, its metadata and whether it is still fresh (or None on a miss)
+        """
+        entry = self.store.get(self.normalize_url(url))
+        if entry is None:
+            return None
+        body, metadata = entry
+        ttl = self.ttl(url)
+        fresh = ttl is None or time() - metadata["stored_at"] < ttl
+        return body, metadata, fresh
+
+    @staticmethod
+    def conditional_headers(metadata: dict) -> dict:
+        """
+        Builds the headers of a conditional request from the stored validators.
+
+        :param metadata: The metadata of a cached response
+        :return: The If-None-Match/If-Modified-Since headers available for this response
+        """
+        headers = {}
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+        return headers
+
+    def save(self, url: str, body: bytes, headers: dict) -> None:
+        """
+        Stores a response along with its validators.
+
+        :param url: The requested URL
+        :param body: The raw response body
+        :param headers: The response headers
+        """
+        self.store.put(
+            self.normalize_url(url),
+            body,
+            {
+                "url": url,
+                "stored_at": time(),
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+            },
+        )
+
+    def refresh(self, url: str, metadata: dict) -> None:
+        """
+        Marks a cached response as fresh again after a 304 Not Modified.
+
+        :param url: The requested URL
+        :param metadata: The metadata of the cached response
+        """
+        self.store.update_metadata(self.normalize_url(url), {**metadata, "stored_at": time()})
+
+    def summary(self) -> str:
+        """
+        Summarizes the cache activity of the run.
+
+        :return: A one-line report of hits, misses and revalidations
+        """
+        return (
+            f"API cache: {self.hits} hits, {self.misses} misses, "
+            f"{self.revalidated} revalidated (304)"
+        )
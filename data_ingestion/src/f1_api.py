@@ -1,19 +1,27 @@
+import asyncio
 import requests
 import yaml
-from time import sleep
 from math import ceil
 import logging
 from tqdm import tqdm
 import json
 from pathlib import Path
+from datetime import date
+from data_ingestion.src.fetcher import AsyncFetcher, RetryPolicy, FetchError, CircuitOpenError
+from data_ingestion.src.cache import ResponseCache
+from data_ingestion.src.planner import RequestPlanner
+from data_ingestion.src.manifest import FetchRecord
+from utils.raw_format import PageWriter
 
 class F1API:
 
-    def __init__(self, config_file="config/settings.yaml"):
+    def __init__(self, config_file="config/settings.yaml", session=None, cache_dir=None):
         """
         Initializes the F1API instance by loading configuration settings.
 
         :param config_file: Path to the configuration file (default is 'config/settings.yaml')
+        :param session: HTTP session to use instead of the pooled one (e.g. a stub in tests)
+        :param cache_dir: Folder of the response cache, instead of the one of the settings (e.g. a temporary folder in tests)
         """
         with open(config_file) as file:
             self.settings = yaml.safe_load(file)
@@ -23,39 +31,76 @@ class F1API:
         self.round_category = self.settings["f1_api"]["round_category"]
         self.f1_schedule = None
         self.pending_races = None
+        self.pending_work = None
+        self.manifest = None
+        self.planner = RequestPlanner(
+            round_category=self.round_category,
+            snapshot_category=self.settings["f1_api"]["planner"]["snapshot_category"],
+            rows_per_round=self.settings["f1_api"]["planner"]["rows_per_round"],
+            max_page_size=self.settings["f1_api"]["planner"]["max_page_size"],
+        )
         self.f1_seasons_results = None
         self.f1_races_data = None
         self.folder_name = "raw"
+        self.raw_format = self.settings["f1_api"].get("raw_format", "json")
+        self.max_open_files = self.settings["f1_api"].get("max_open_files", 64)
+        cache_settings = self.settings["f1_api"].get("cache", {})
+        cache = (
+            ResponseCache(
+                directory=cache_dir or cache_settings["directory"],
+                max_size_mb=cache_settings["max_size_mb"],
+                current_season_ttl=cache_settings["current_season_ttl"],
+                settle_days=self.settings["manifest"]["settle_days"],
+            )
+            if cache_settings.get("enabled")
+            else None
+        )
+        self.fetcher = AsyncFetcher(
+            timeout=self.settings["f1_api"].get("timeout", 10),
+            max_concurrency=self.settings["f1_api"].get("max_concurrency", 4),
+            requests_per_second=self.settings["f1_api"]["rate_limit"]["requests_per_second"],
+            burst=self.settings["f1_api"]["rate_limit"]["burst"],
+            pool_size=self.settings["f1_api"]["session"]["pool_size"],
+            per_host_limit=self.settings["f1_api"]["session"]["per_host_limit"],
+            keepalive_timeout=self.settings["f1_api"]["session"]["keepalive_timeout"],
+            session=session,
+            cache=cache,
+            retry=RetryPolicy(**self.settings["f1_api"]["retry"]),
+            throttle_settings=self.settings["f1_api"]["throttle"],
+            failure_threshold=self.settings["f1_api"]["circuit_breaker"]["failure_threshold"],
+        )
     
     @staticmethod
-    def get_pagination_offsets(total:str) -> list:
+    def get_pagination_offsets(total:str, limit: int = 100) -> list:
         """
         Calculates the pagination offsets based on the total number of items.
         This is useful for fetching large datasets from paginated API responses.
 
         :param total: Total number of items (as a string) to fetch
-        :return: List of offsets (each offset is a multiple of 100)
+        :param limit: Number of items per page (default is 100)
+        :return: List of offsets of the pages following the first one (multiples of `limit`)
         """
 
         total_races = int(total)
         if total_races > 0:
-            query_numbers = max(1, ceil(total_races / 100))
-            offsets = [x * 100 for x in range(1, query_numbers)]
+            query_numbers = max(1, ceil(total_races / limit))
+            offsets = [x * limit for x in range(1, query_numbers)]
         else:
             offsets = []
         return offsets
     
-    def build_param_url(self, url: str, total: str) -> list:
+    def build_param_url(self, url: str, total: str, limit: int = 100) -> list:
         """
         Generates paginated URLs for fetching data from the API.
 
         :param url: Base URL for the API request
         :param total: Total number of items to retrieve (used for pagination)
+        :param limit: Number of items per page (default is 100)
         :return: List of paginated URLs
         """
         try : 
-            offsets = self.get_pagination_offsets(total)
-            url_list = [f"{url}?limit=100&offset={offset}" for offset in offsets]
+            offsets = self.get_pagination_offsets(total, limit)
+            url_list = [f"{url}?limit={limit}&offset={offset}" for offset in offsets]
             return url_list
         except requests.RequestException as e:
             logging.error(f"Failed to fetch data from {url}: {e}")
@@ -66,38 +111,87 @@ class F1API:
         Fetches the F1 circuit schedule (year and round) for a specific offset.
         The offset helps paginate through multiple requests.
 
+        :param offset: The pagination offset
+        :return: List of races at a given offset (or an empty list in case of an error)
+        """
+        return self.fetcher.run(self.fetch_circuit_schedule_async(offset))
+
+    async def fetch_circuit_schedule_async(self, offset: int) -> list:
+        """
+        Asynchronous version of `fetch_circuit_schedule`, run by the fetch engine.
+
         :param offset: The pagination offset
         :return: List of races at a given offset (or an empty list in case of an error)
         """
         url = f"{self.base_url}?offset={offset}&limit=100"
+        data = (await self.fetcher.fetch_all([url]))[0]
         try:
-            sleep(0.3)
-            with requests.get(url, timeout=10) as response:
-                response.raise_for_status()  # Raises an HTTP error for bad responses (4xx or 5xx)
-                data = response.json()
-                return data["MRData"]["RaceTable"]["Races"]
+            return data["MRData"]["RaceTable"]["Races"]
         except KeyError:
             print(f"Unexpected response format for offset {offset}")
-        except Exception as e:
-            print(f"An unexpected error occurred for offset {offset}: {e}")
-        return []  # Return an empty dict if there's an error
+        return []  # Return an empty list if there's an error
 
     def fetch_f1_seasons_schedule(self) -> list:
         """
         Fetches the F1 circuit schedule for the entire season, handling pagination.
 
-        This method fetches the initial response and then makes additional requests 
-        for paginated data.
+        This method fetches the initial response and, once the total is known, 
+        requests every remaining page concurrently.
 
         :return: A list of races from the F1 season
         """
-        first_response = requests.get(self.base_url, timeout=10).json()
+        self.fetcher.run(self.fetch_f1_seasons_schedule_async())
+
+    async def fetch_f1_seasons_schedule_async(self) -> None:
+        """
+        Asynchronous version of `fetch_f1_seasons_schedule`, run by the fetch engine.
+
+        :raises FetchError: If a page cannot be fetched (once every page request has settled)
+        """
+        first_response = (await self.fetcher.fetch_all([f"{self.base_url}?offset=0&limit=100"]))[0]
         total = first_response['MRData']['total']
         offsets = self.get_pagination_offsets(total)
-        f1_list = [self.fetch_circuit_schedule(offset) for offset in offsets]
+        # wait for every page to settle before reporting a failure, so none is left running
+        f1_list = await asyncio.gather(
+            *[self.fetch_circuit_schedule_async(offset) for offset in offsets], return_exceptions=True
+        )
+        for races in f1_list:
+            if isinstance(races, BaseException):
+                raise races
         f1_list.append(first_response["MRData"]["RaceTable"]["Races"])
         self.f1_schedule = [race for races in f1_list for race in races]
 
+    def refresh_f1_schedule(self, stored_schedule: list, seasons: list) -> None:
+        """
+        Refreshes only some seasons of a stored F1 schedule (e.g. the current and next one)
+        instead of fetching the full history.
+
+        The races of the refreshed seasons are replaced by the fetched ones, and the 
+        merged schedule is sorted by season and round.
+
+        :param stored_schedule: The schedule previously fetched (list of races)
+        :param seasons: The seasons to refresh
+        """
+        fresh_schedule = self.fetcher.run(self.fetch_seasons_schedule_async(seasons))
+        refreshed = {str(season) for season in seasons}
+        merged = [race for race in stored_schedule if race["season"] not in refreshed]
+        merged.extend(fresh_schedule)
+        self.f1_schedule = sorted(merged, key=lambda race: (int(race["season"]), int(race["round"])))
+
+    async def fetch_seasons_schedule_async(self, seasons: list) -> list:
+        """
+        Fetches the schedule of the given seasons concurrently, handling pagination.
+
+        :param seasons: The seasons to fetch
+        :return: A list of races of these seasons
+        """
+        urls = [f"{self.base_url}{season}?limit=100" for season in seasons]
+        first_responses = await self.fetch_initial_responses_async(urls)
+        pages = first_responses + await self.fetch_additional_data_async(
+            self.get_additional_urls(first_responses)
+        )
+        return [race for page in pages for race in page["MRData"]["RaceTable"]["Races"]]
+
     def base_url_data(self, category, season, race_round=None) -> str:
         """
         Builds a full URL based on category, season, and (optionally) race round.
@@ -109,80 +203,260 @@ class F1API:
         """
         return f"{self.base_url}{season}/{race_round + '/' if race_round else ''}{category}"
     
+    def get_pending_work(self) -> list:
+        """
+        Lists the (season, round, category) fetches to perform.
+
+        The pending work is either set by the ingestion planner (`pending_work`) 
+        or derived from `pending_races`, in which case every category is fetched 
+        for every pending race.
+
+        :return: List of dictionaries containing the season, round and category of each fetch
+        """
+        if self.pending_work is not None:
+            return self.pending_work
+        categories = (self.round_category or []) + (self.season_category or [])
+        return [
+            {"season": race["season"], "round": race["round"], "category": category}
+            for race in self.pending_races
+            for category in categories
+        ]
+
     def build_base_url_data(self) -> list:
         """
         Builds the URLs for both race-based and season-based data.
 
-        This method organizes races into groups by season and builds URLs 
-        for each race or season's data.
+        This method groups the pending work by category and season, lets the 
+        request planner choose between one URL per round and a single 
+        season-wide URL, and sets the page size of the first request. 
+        Round-scoped plans are split into one fetch per round, each landing in 
+        its own raw file (see `raw_filename`).
 
-        :return: List of dictionaries containing category, season, and URLs
+        :return: List of dictionaries containing category, season, rounds, URLs and the planned budget
         """
-        data_source = [(fone["season"], fone["round"]) for fone in self.pending_races]
-        seasons = list(set(fone["season"] for fone in self.pending_races))
-        
         grouped_race_data = {}
-        for season, race_round in data_source:
-            grouped_race_data.setdefault(season, []).append(race_round)
-        
+        for work in self.get_pending_work():
+            grouped_race_data.setdefault((work["category"], work["season"]), []).append(work["round"])
+
+        today = date.today().strftime("%Y-%m-%d")
+        season_rounds = {}
+        for race in self.f1_schedule or []:
+            if race["date"] <= today:
+                season_rounds[race["season"]] = season_rounds.get(race["season"], 0) + 1
+
+        self.planner.manifest = self.manifest
         results_url = []
-        
-        # Build race-based URLs
-        if self.round_category:
-            for season, race_rounds in grouped_race_data.items():
-                for category in self.round_category:
-                    results_url.append({
-                        "category": category,
-                        "season": season,
-                        "rounds": race_rounds,
-                        "urls": [self.base_url_data(category, season, r) for r in race_rounds],
-                    })
-        # Build season-based URLs
-        if self.season_category: 
-            for season in seasons:
-                for category in self.season_category:
-                    results_url.append({
+        for (category, season), race_rounds in grouped_race_data.items():
+            if category not in (self.round_category or []) + (self.season_category or []):
+                continue
+            plan = self.planner.choose(category, race_rounds, season_rounds.get(season, 0))
+            # Build race-based URLs, one fetch per round
+            if plan["scope"] == "round":
+                results_url += [
+                    {
                         "category": category,
                         "season": season,
-                        "urls": [self.base_url_data(category, season)],
-                    })
+                        "rounds": [r],
+                        "urls": [f"{self.base_url_data(category, season, r)}?limit={plan['limit']}"],
+                        **plan,
+                        "estimated_rows": round(plan["estimated_rows"] / len(race_rounds)),
+                        "estimated_requests": plan["estimated_requests"] // len(race_rounds),
+                    }
+                    for r in race_rounds
+                ]
+            # Build season-based URLs
+            else:
+                results_url.append({
+                    "category": category,
+                    "season": season,
+                    "rounds": race_rounds,
+                    "urls": [f"{self.base_url_data(category, season)}?limit={plan['limit']}"],
+                    **plan,
+                })
         
         return results_url
+
+    def print_request_plan(self) -> list:
+        """
+        Prints the request plan and its budget without fetching anything (dry run).
+
+        :return: The planned fetches
+        """
+        params = self.build_base_url_data()
+        print(self.planner.format_plan(params))
+        return params
     
     def fetch_data(self) -> None:
         """
         Fetches race data for all required categories and seasons.
         
-        This method iterates over all parameters and fetches the necessary data 
-        using the `build_race_data` method for each set of parameters.
+        This method builds the parameters of every file to fetch and runs 
+        `build_race_data_async` for all of them concurrently; the fetch engine 
+        bounds the number of requests in flight and the request rate. The 
+        schedule tells the response cache which races have settled.
         """
         params = self.build_base_url_data()
-        data = [self.build_race_data(param)
-                for param in tqdm(params, desc="fetching races data")
-        ]
+        if self.fetcher.cache is not None:
+            self.fetcher.cache.set_schedule(self.f1_schedule or [])
+        self.fetcher.run(self.fetch_data_async(params))
+
+    async def fetch_data_async(self, params: list) -> None:
+        """
+        Builds the race data of every set of parameters concurrently.
+
+        A file whose pages cannot all be fetched is not written (and stays pending 
+        in the manifest); the other files are still built. If the circuit breaker 
+        opens, the run is aborted once the requests in flight have settled. At most 
+        `max_open_files` files are built at once, so that a full backfill does not 
+        hold a raw file open per fetch.
+
+        :param params: A list of dictionaries containing the category, season, and URLs to fetch data
+        :raises CircuitOpenError: If the API looks down
+        """
+        open_files = asyncio.Semaphore(self.max_open_files)
+        with tqdm(total=len(params), desc="fetching races data") as pbar:
+            async def build(param: dict) -> None:
+                try:
+                    async with open_files:
+                        await self.build_race_data_async(param)
+                except CircuitOpenError:
+                    raise
+                except FetchError as e:
+                    logging.error(f"Skipping {param['category']} {param['season']}: {e}")
+                finally:
+                    pbar.update(1)
+
+            results = await asyncio.gather(*[build(param) for param in params], return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
     
     def build_race_data(self, params: dict) -> None:
         """
         Builds and saves race data based on the provided parameters.
 
+        :param params: A dictionary containing the category, season, and URLs to fetch data
+        """
+        self.fetcher.run(self.build_race_data_async(params))
+
+    async def build_race_data_async(self, params: dict) -> None:
+        """
+        Asynchronous version of `build_race_data`, run by the fetch engine.
+
+        With the "json" raw format, every page is gathered before a single JSON 
+        array is written; newline-delimited formats are streamed page by page.
+
         :param params: A dictionary containing the category, season, and URLs to fetch data
         """
         urls = params["urls"]
         season = params["season"]
         category = params["category"]
-        filename = f"{self.folder_name}/{category}/{season}_{category}.json"
+        filename = self.raw_filename(params)
 
-        first_responses = self.fetch_initial_responses(urls)
-        if not first_responses:
+        if self.raw_format != "json":
+            await self.stream_race_data(params, filename)
             return
 
+        first_responses = await self.fetch_initial_responses_async(urls)
+
         merged_data = first_responses.copy()
         url_params = self.get_additional_urls(first_responses)
         
         if url_params:
-            merged_data.extend(self.fetch_additional_data(url_params))
+            merged_data.extend(await self.fetch_additional_data_async(url_params))
+
+        fetch = FetchRecord(category, season, params.get("rounds", []), params.get("scope", "round"))
+        for response in merged_data:
+            fetch.add(response)
+
+        # Rounds whose content did not change since the last fetch are not written again
+        changed = self.manifest is None or self.manifest.changed(fetch)
+        if merged_data and changed:
+            self.save_data_to_file(filename, merged_data)
+            if self.manifest is not None:
+                self.manifest.stage(fetch, filename)
+        elif self.manifest is not None:
+            self.manifest.commit(fetch)
+
+    def raw_filename(self, params: dict) -> str:
+        """
+        Builds the path of the raw file of a fetch.
+
+        A season-scoped fetch returns every round that took place and lands in the 
+        season file; a round-scoped fetch lands in a file of its own, so that a daily 
+        run fetching the latest round never overwrites the rounds fetched before it.
 
-        self.save_data_to_file(filename, merged_data)
+        :param params: A dictionary containing the category, season, rounds, and scope of the fetch
+        :return: '<folder>/<category>/<season>_<category>.<format>', or 
+            '<folder>/<category>/<season>_<round>_<category>.<format>' for a round-scoped fetch
+        """
+        category, season, rounds = params["category"], params["season"], params.get("rounds", [])
+        if params.get("scope") == "round" and len(rounds) == 1:
+            return f"{self.folder_name}/{category}/{season}_{rounds[0]}_{category}.{self.raw_format}"
+        return f"{self.folder_name}/{category}/{season}_{category}.{self.raw_format}"
+
+    async def stream_race_data(self, params: dict, filename: str) -> None:
+        """
+        Fetches the pages of a file concurrently and appends them to it in request order 
+        (URL by URL, then by offset), so that rounds are never interleaved and the same 
+        data always gives the same bytes. Pages arriving before an earlier one wait in 
+        memory until it is written.
+
+        The file is written under a temporary name, opened once the first pages are 
+        in, and renamed once every page is fetched; it is discarded if nothing changed since the last fetch. Its rounds are 
+        recorded in the manifest once the file is uploaded (`IngestionManifest.confirm_uploads`).
+
+        :param params: A dictionary containing the category, season, rounds, and URLs to fetch data
+        :param filename: The path of the newline-delimited raw file
+        :raises FetchError: If a page cannot be fetched (once every other page has settled)
+        """
+        fetch = FetchRecord(
+            params["category"], params["season"], params.get("rounds", []), params.get("scope", "round")
+        )
+        requests = [asyncio.ensure_future(self.request_pages(url)) for url in params["urls"]]
+        first_pages = await asyncio.gather(*requests, return_exceptions=True)
+        errors = []
+        with PageWriter(filename) as writer:
+            for pages in first_pages:
+                if isinstance(pages, BaseException):
+                    errors.append(pages)
+                    continue
+                for page in pages:
+                    try:
+                        page = await page if asyncio.isfuture(page) else page
+                    except Exception as e:
+                        errors.append(e)
+                        continue
+                    if not errors:
+                        writer.write(page)
+                        fetch.add(page)
+            if errors:
+                raise next((e for e in errors if isinstance(e, CircuitOpenError)), errors[0])
+
+            changed = self.manifest is None or self.manifest.changed(fetch)
+            if writer.pages and changed:
+                writer.commit()
+                if self.manifest is not None:
+                    self.manifest.stage(fetch, filename)
+            elif self.manifest is not None:
+                self.manifest.commit(fetch)
+
+    async def request_pages(self, url: str) -> list:
+        """
+        Fetches the first page of a URL, then schedules the requests of its additional pages.
+
+        :param url: The URL of the first page
+        :return: The first page followed by the tasks fetching the next pages, in offset 
+            order (empty if the URL holds no rows)
+        :raises FetchError: If the first page cannot be fetched
+        """
+        first_responses = await self.fetch_initial_responses_async([url])
+        if not first_responses:
+            return []
+        return [first_responses[0]] + [
+            asyncio.ensure_future(self.fetcher.fetch_json(page_url))
+            for page_url in self.get_additional_urls(first_responses)
+        ]
 
     def fetch_initial_responses(self, urls: list) -> list:
         """
@@ -191,21 +465,24 @@ class F1API:
         :param urls: A list of URLs to fetch data from
         :return: List of successful responses
         """
-        responses = []
-        for url in urls:
-            try:
-                response = requests.get(url, timeout=10)
-                response.raise_for_status()
-                response_json = response.json()
-                if response_json['MRData']['total'] != '0':
-                    responses.append(response_json)
-            except requests.RequestException as e:
-                logging.error(f"Failed to fetch data from {url}: {e}")
-        return responses
+        return self.fetcher.run(self.fetch_initial_responses_async(urls))
+
+    async def fetch_initial_responses_async(self, urls: list) -> list:
+        """
+        Asynchronous version of `fetch_initial_responses`, run by the fetch engine.
+
+        :param urls: A list of URLs to fetch data from
+        :return: List of non-empty responses, in the same order as `urls`
+        :raises FetchError: If a page cannot be fetched
+        """
+        responses = await self.fetcher.fetch_all(urls)
+        return [response for response in responses if response['MRData']['total'] != '0']
 
     def get_additional_urls(self, first_responses:list) -> list:
         """
         Generates additional paginated URLs based on the initial responses.
+        Pages follow the page size reported by the API, so no rows are skipped 
+        when the first request used the API's default limit.
 
         :param first_responses: A list of the first responses from the API
         :return: A list of URLs for additional pages of data
@@ -214,7 +491,9 @@ class F1API:
             offset
             for response in first_responses
             for offset in self.build_param_url(
-                response['MRData']['url'], response['MRData']['total']
+                response['MRData']['url'],
+                response['MRData']['total'],
+                int(response['MRData'].get('limit', 100)),
                 )
         ]
 
@@ -225,53 +504,26 @@ class F1API:
         :param url_params: A list of paginated URLs to fetch additional data from
         :return: A list of additional data fetched from the URLs
         """
-        additional_data = []
-        for url in url_params:
-            sleep(0.3)
-            try:
-                response = requests.get(url, timeout=10)
-                response.raise_for_status()
-                additional_data.append(response.json())
-            except requests.RequestException as e:
-                logging.error(f"Failed to fetch data from {url}: {e}")
-        return additional_data
+        return self.fetcher.run(self.fetch_additional_data_async(url_params))
+
+    async def fetch_additional_data_async(self, url_params: list) -> list:
+        """
+        Asynchronous version of `fetch_additional_data`, run by the fetch engine.
+
+        :param url_params: A list of paginated URLs to fetch additional data from
+        :return: A list of additional data fetched from the URLs, in the same order as `url_params`
+        :raises FetchError: If a page cannot be fetched
+        """
+        return await self.fetcher.fetch_all(url_params)
 
     def save_data_to_file(self, filename, data):
         folder = "/".join(filename.split("/")[:-1])
         Path(folder).mkdir(parents=True, exist_ok=True)
         with open(filename, "w") as file:
             json.dump(data, file)
-    
-   
-# -- ASYNC TEST --
-# MAX_CONCURRENT_REQUESTS = 1
-# semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-
-# async def fetch_f1_season_info(session, offset):
-
-#     """Query the API to get all the race year and round
-#     using the offset parameters with async method"""
-
-#     url = f'{base_url}/?offset={offset}&limit=100'
-#     try:
-#         await asyncio.sleep(10)  # Simulating delay without blocking
-#         async with session.get(url, timeout=10) as response:
-#             response.raise_for_status()  # Raises an HTTP error for bad responses (4xx or 5xx)
-#             data = await response.json()
-#             return data["MRData"]["RaceTable"]["Races"]
-
-#     except ClientError as e:
-#         print(f"Network error occurred for offset {offset}: {e}")
-#     except asyncio.TimeoutError:
-#         print(f"Request timed out for offset {offset}")
-#     except KeyError:
-#         print(f"Unexpected response format for offset {offset}")
-#     except Exception as e:
-#         print(f"An unexpected error occurred for offset {offset}: {e}")
-#     return []  # Return an empty list if there's an error
-
-# async def f1_seasons(offsets : list) :
-#     async with aiohttp.ClientSession() as session:
-#         tasks = [fetch_f1_season_info(session, offset) for offset in offsets]
-#         results = await asyncio.gather(*tasks)
-#         return results
+
+    def close(self) -> None:
+        """
+        Releases the resources held by the fetch engine.
+        """
+        self.fetcher.close()
@@ -0,0 +1,397 @@
+import asyncio
+import json
+import logging
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from time import monotonic
+import aiohttp
+from data_ingestion.src.cache import ResponseCache
+
+
+class FetchError(Exception):
+    """Raised when a page cannot be fetched, once retries are exhausted."""
+
+
+class CircuitOpenError(FetchError):
+    """Raised for every request once the circuit breaker has aborted the run."""
+
+
+class TokenBucket:
+
+    def __init__(self, requests_per_second: float, burst: int) -> None:
+        """
+        Initializes a token bucket shared by every request sent to the API.
+
+        :param requests_per_second: Rate at which tokens are added to the bucket
+        :param burst: Maximum number of tokens the bucket can hold (requests allowed back to back)
+        """
+        self.rate = float(requests_per_second)
+        self.capacity = max(1, int(burst))
+        self.tokens = float(self.capacity)
+        self.updated_at = monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        """
+        Adds the tokens earned since the last refill, without exceeding the bucket capacity.
+        """
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        """
+        Waits until a token is available and consumes it.
+        Requests are served in arrival order since waiters queue on the lock.
+        """
+        async with self._lock:
+            while monotonic() < self.paused_until:
+                await asyncio.sleep(self.paused_until - monotonic())
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stops handing out tokens for `seconds` (e.g. when the API sends a Retry-After),
+        and empties the bucket so that requests do not resume in a burst.
+
+        :param seconds: The pause duration
+        """
+        self._refill()
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+
+class RetryPolicy:
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30) -> None:
+        """
+        Initializes the retry policy of failed requests (exponential backoff with full jitter).
+
+        :param max_attempts: Maximum number of attempts per request
+        :param base_delay: Backoff delay after the first failed attempt (in seconds)
+        :param max_delay: Upper bound of the backoff delay (in seconds)
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """
+        Computes the wait before the next attempt. A Retry-After sent by the API takes precedence.
+
+        :param attempt: The number of the attempt that just failed (starting at 1)
+        :param retry_after: The delay requested by the API (in seconds), if any
+        :return: The delay before the next attempt (in seconds)
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    @staticmethod
+    def parse_retry_after(value: str | None) -> float | None:
+        """
+        Parses a Retry-After header, given either in seconds or as an HTTP date.
+
+        :param value: The header value
+        :return: The delay in seconds (or None if the header is missing or invalid)
+        """
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+class AdaptiveThrottle:
+
+    def __init__(
+        self,
+        rate_limiter: TokenBucket,
+        min_requests_per_second: float = 0.5,
+        recovery_step: float = 0.1,
+        success_streak: int = 10,
+    ) -> None:
+        """
+        Initializes the adaptive throttle, which adjusts the token bucket rate to the API's answers.
+
+        The rate is halved on every 429 (additive increase, multiplicative decrease) and
+        raised by `recovery_step` after every `success_streak` successful requests, up to
+        the configured rate, so the fetch engine stays close to the rate the API accepts.
+
+        :param rate_limiter: The token bucket shared by every request
+        :param min_requests_per_second: Lowest rate the throttle can fall to
+        :param recovery_step: Rate added after each streak of successful requests
+        :param success_streak: Number of successful requests between two rate increases
+        """
+        self.rate_limiter = rate_limiter
+        self.max_rate = rate_limiter.rate
+        self.min_rate = min(min_requests_per_second, self.max_rate)
+        self.recovery_step = recovery_step
+        self.success_streak = success_streak
+        self.successes = 0
+        self.throttled = 0
+
+    def on_throttled(self, retry_after: float | None) -> None:
+        """
+        Slows down the global request rate after a 429, and pauses it for the Retry-After delay.
+
+        :param retry_after: The delay requested by the API (in seconds), if any
+        """
+        self.throttled += 1
+        self.successes = 0
+        self.rate_limiter.rate = max(self.min_rate, self.rate_limiter.rate / 2)
+        if retry_after:
+            self.rate_limiter.pause(retry_after)
+        logging.warning(f"Rate limited by the API, slowing down to {self.rate_limiter.rate:.2f} req/s")
+
+    def on_success(self) -> None:
+        """
+        Speeds the request rate back up after a streak of successful requests.
+        """
+        self.successes += 1
+        if self.successes >= self.success_streak and self.rate_limiter.rate < self.max_rate:
+            self.successes = 0
+            self.rate_limiter.rate = min(self.max_rate, self.rate_limiter.rate + self.recovery_step)
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold: int = 10) -> None:
+        """
+        Initializes the circuit breaker of the run.
+
+        After `failure_threshold` consecutive failed attempts (server errors, timeouts,
+        connection errors), the host is considered down and every further request fails
+        immediately, so the run aborts instead of hammering the API.
+
+        :param failure_threshold: Number of consecutive failed attempts opening the circuit
+        """
+        self.failure_threshold = failure_threshold
+        self.failures = 0
+        self.open = False
+
+    def check(self) -> None:
+        """
+        Raises a CircuitOpenError if the circuit is open.
+        """
+        if self.open:
+            raise CircuitOpenError("Circuit breaker open: the API looks down, aborting the run")
+
+    def on_success(self) -> None:
+        """
+        Resets the count of consecutive failures.
+        """
+        self.failures = 0
+
+    def on_failure(self) -> None:
+        """
+        Counts a failed attempt, and opens the circuit once the threshold is reached.
+        """
+        self.failures += 1
+        if self.failures >= self.failure_threshold and not self.open:
+            self.open = True
+            logging.error(f"{self.failures} consecutive failed requests, opening the circuit breaker")
+
+
+class AsyncFetcher:
+
+    def __init__(
+        self,
+        timeout: float = 10,
+        max_concurrency: int = 4,
+        requests_per_second: float = 4,
+        burst: int = 4,
+        pool_size: int = 8,
+        per_host_limit: int = 4,
+        keepalive_timeout: float = 30,
+        session: aiohttp.ClientSession | None = None,
+        cache: ResponseCache | None = None,
+        retry: RetryPolicy | None = None,
+        throttle_settings: dict | None = None,
+        failure_threshold: int = 10,
+    ) -> None:
+        """
+        Initializes the asyncio fetch engine used by F1API.
+
+        The engine owns its event loop so that the synchronous F1API methods can
+        drive it, keeps at most `max_concurrency` requests in flight and spaces
+        them with a token bucket instead of fixed sleeps.
+
+        :param timeout: Total timeout of a single request (in seconds)
+        :param max_concurrency: Maximum number of requests in flight
+        :param requests_per_second: Sustained request rate allowed by the API
+        :param burst: Number of requests that can be sent back to back
+        :param pool_size: Maximum number of pooled connections
+        :param per_host_limit: Maximum number of pooled connections to a single host
+        :param keepalive_timeout: Time an idle connection is kept open for reuse (in seconds)
+        :param session: Session to use instead of the pooled one (e.g. a stub in tests)
+        :param cache: On-disk response cache consulted before sending a request (optional)
+        :param retry: Retry policy of failed requests (default policy if None)
+        :param throttle_settings: Keyword arguments of the adaptive throttle (optional)
+        :param failure_threshold: Consecutive failed attempts opening the circuit breaker
+        """
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.per_host_limit = per_host_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.session = session
+        self.cache = cache
+        self.request_count = 0
+        self.request_time = 0.0
+        self.loop = asyncio.new_event_loop()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
+        self.retry = retry or RetryPolicy()
+        self.throttle = AdaptiveThrottle(self.rate_limiter, **(throttle_settings or {}))
+        self.breaker = CircuitBreaker(failure_threshold)
+
+    def run(self, coro):
+        """
+        Runs a coroutine to completion on the engine's event loop.
+
+        :param coro: The coroutine to run
+        :return: The coroutine result
+        """
+        return self.loop.run_until_complete(coro)
+
+    def close(self) -> None:
+        """
+        Closes the pooled session and the engine's event loop, and logs the mean request latency.
+        """
+        if self.loop.is_closed():
+            return
+        if self.session is not None and not self.session.closed:
+            self.loop.run_until_complete(self.session.close())
+        if self.request_count:
+            logging.info(
+                f"{self.request_count} API requests, "
+                f"mean latency {self.request_time / self.request_count * 1000:.0f} ms"
+            )
+        self.loop.close()
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """
+        Returns the session shared by every request, creating it on first use
+        (from a coroutine, so that it is bound to the engine's event loop).
+
+        The session keeps connections alive in a pool bounded globally and per host,
+        so consecutive pages reuse the same TCP (and TLS) connection, and asks for
+        gzip-encoded responses.
+
+        :return: The pooled aiohttp session
+        """
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.per_host_limit,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"Accept-Encoding": "gzip, deflate"},
+            )
+        return self.session
+
+    async def fetch_json(self, url: str) -> dict:
+        """
+        Fetches a single URL once a concurrency slot and a rate limit token are available.
+
+        Fresh cached responses are returned without any request; stale ones are
+        revalidated with a conditional request when validators are available.
+        429s, server errors, timeouts and connection errors are retried with
+        exponential backoff (honoring Retry-After); 429s also slow down the
+        global request rate.
+
+        :param url: The URL to fetch
+        :return: The decoded JSON response
+        :raises FetchError: If the page cannot be fetched once retries are exhausted
+        :raises CircuitOpenError: If the circuit breaker aborted the run
+        """
+        cached = self.cache.lookup(url) if self.cache else None
+        headers = {}
+        if cached is not None:
+            body, metadata, fresh = cached
+            if fresh:
+                self.cache.hits += 1
+                return json.loads(body)
+            headers = self.cache.conditional_headers(metadata)
+
+        session = self.get_session()
+        error = None
+        for attempt in range(1, self.retry.max_attempts + 1):
+            self.breaker.check()
+            retry_after = None
+            async with self.semaphore:
+                await self.rate_limiter.acquire()
+                start = monotonic()
+                try:
+                    async with session.get(url, headers=headers) as response:
+                        if response.status == 304 and cached is not None:
+                            self.cache.revalidated += 1
+                            self.cache.refresh(url, metadata)
+                            self.breaker.on_success()
+                            return json.loads(body)
+                        if response.status == 429 or response.status >= 500:
+                            retry_after = self.retry.parse_retry_after(response.headers.get("Retry-After"))
+                            error = f"HTTP {response.status}"
+                            if response.status == 429:
+                                self.throttle.on_throttled(retry_after)
+                            else:
+                                self.breaker.on_failure()
+                        else:
+                            response.raise_for_status()
+                            content = await response.read()
+                            data = json.loads(content)
+                            self.breaker.on_success()
+                            self.throttle.on_success()
+                            if self.cache:
+                                self.cache.misses += 1
+                                self.cache.save(url, content, response.headers)
+                            return data
+                except aiohttp.ClientResponseError as e:
+                    raise FetchError(f"Failed to fetch data from {url}: {e}") from e
+                except ValueError as e:
+                    raise FetchError(f"Invalid JSON received from {url}: {e}") from e
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+                    self.breaker.on_failure()
+                finally:
+                    self.request_count += 1
+                    self.request_time += monotonic() - start
+
+            if attempt < self.retry.max_attempts:
+                delay = self.retry.delay(attempt, retry_after)
+                logging.warning(f"Attempt {attempt} failed for {url} ({error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+        raise FetchError(f"Failed to fetch data from {url} after {self.retry.max_attempts} attempts: {error}")
+
+    async def fetch_all(self, urls: list) -> list:
+        """
+        Fetches every URL concurrently.
+
+        :param urls: A list of URLs to fetch
+        :return: The decoded responses, in the same order as `urls`
+        :raises FetchError: If any page cannot be fetched
+        """
+        if not urls:
+            return []
+        # wait for every request to settle before reporting a failure, so none is left running
+        responses = await asyncio.gather(*[self.fetch_json(url) for url in urls], return_exceptions=True)
+        for response in responses:
+            if isinstance(response, BaseException):
+                raise response
+        return responses
@@ -0,0 +1,290 @@
+import json
+import hashlib
+import logging
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from utils.raw_format import raw_extension, read_pages
+
+
+class IngestionManifest:
+
+    def __init__(
+        self,
+        local_path: str = ".state/ingestion_manifest.json",
+        object_key: str = "raw/ingestion_manifest.json",
+        settle_days: int = 3,
+    ) -> None:
+        """
+        Initializes the ingestion manifest (watermarks of what has already been fetched).
+
+        The manifest records, per (season, round, category), when the data was fetched,
+        the `MRData.total` and scope (round or season) of the query and a hash of the
+        content. A race stays pending for a category until it has been fetched at least
+        `settle_days` after the race, which leaves time for the API to publish and
+        correct the data. The entries of a fetch that wrote a file are staged until the
+        file is uploaded (see `stage` and `confirm_uploads`).
+
+        :param local_path: Path of the local copy of the manifest
+        :param object_key: S3 key of the manifest (next to raw/f1_schedule.json)
+        :param settle_days: Days after a race during which its data is fetched again
+        """
+        self.local_path = Path(local_path)
+        self.object_key = object_key
+        self.settle_days = settle_days
+        self.entries = {}
+        self.staged = {}  # file written by the run -> fetch recorded once the file is uploaded
+        self.last_run = {"run_at": None, "files": []}
+
+    @staticmethod
+    def entry_key(season: str, race_round: str, category: str) -> str:
+        """
+        Builds the key of a manifest entry.
+
+        :param season: The F1 season
+        :param race_round: The race round
+        :param category: The category of the data (e.g., 'laps', 'results')
+        :return: The entry key ('<season>/<round>/<category>')
+        """
+        return f"{season}/{race_round}/{category}"
+
+    @staticmethod
+    def item_digest(item: dict) -> str:
+        """
+        Hashes a race (or standings list) independently of the key order of the JSON.
+
+        :param item: A race (or standings list) of an API page
+        :return: The SHA-256 of the canonical JSON serialization
+        """
+        return hashlib.sha256(json.dumps(item, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def content_hash(digests: list) -> str:
+        """
+        Hashes the content fetched for a round from the digests of its items.
+        The digests are sorted, so the hash does not depend on the order pages arrived in.
+
+        :param digests: The digests of the races (or standings lists) fetched for a round
+        :return: The SHA-256 of the sorted digests
+        """
+        return hashlib.sha256("".join(sorted(digests)).encode("utf-8")).hexdigest()
+
+    def load(self, s3_client=None) -> None:
+        """
+        Loads the manifest from S3, falling back to the local copy (or an empty manifest).
+
+        :param s3_client: S3 client used to read the manifest (optional)
+        """
+        data = s3_client.read_object(self.object_key) if s3_client else None
+        if data is None and self.local_path.exists():
+            data = self.local_path.read_bytes()
+        if data is None:
+            logging.info("No ingestion manifest found, starting from an empty one.")
+            return
+        manifest = json.loads(data)
+        self.entries = manifest.get("entries", {})
+        self.last_run = manifest.get("last_run", self.last_run)
+
+    def save(self, s3_client=None) -> None:
+        """
+        Writes the manifest locally and to S3.
+
+        :param s3_client: S3 client used to write the manifest (optional)
+        """
+        data = json.dumps({"last_run": self.last_run, "entries": self.entries})
+        self.local_path.parent.mkdir(parents=True, exist_ok=True)
+        self.local_path.write_text(data)
+        if s3_client:
+            s3_client.write_object(object_key=self.object_key, data=data)
+
+    def start_run(self) -> None:
+        """
+        Resets the list of files written by the current run.
+        """
+        self.last_run = {
+            "run_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "files": [],
+        }
+
+    def is_pending(self, race: dict, category: str, today: date) -> bool:
+        """
+        Checks whether a race still has to be fetched for a category.
+
+        :param race: A race of the schedule (with 'season', 'round' and 'date')
+        :param category: The category of the data
+        :param today: The reference date
+        :return: True if the race took place and has not been fetched after its settle window
+        """
+        if race["date"] > today.isoformat():
+            return False
+        entry = self.entries.get(self.entry_key(race["season"], race["round"], category))
+        if entry is None:
+            return True
+        settled_on = date.fromisoformat(race["date"]) + timedelta(days=self.settle_days)
+        return entry["fetched_at"][:10] < settled_on.isoformat()
+
+    def plan(self, schedule: list, categories: list, today: date | None = None) -> list:
+        """
+        Computes the pending work from the schedule and the manifest.
+
+        :param schedule: The F1 schedule (list of races)
+        :param categories: The categories to fetch
+        :param today: The reference date (default is today)
+        :return: A list of dictionaries with the season, round and category of each pending fetch
+        """
+        today = today or date.today()
+        return [
+            {"season": race["season"], "round": race["round"], "category": category}
+            for race in schedule
+            for category in categories
+            if self.is_pending(race, category, today)
+        ]
+
+    def changed(self, fetch: "FetchRecord") -> bool:
+        """
+        Checks whether a fetch brought new content.
+
+        :param fetch: The record of the pages fetched for a category and season
+        :return: True if the content of at least one round changed since the last fetch
+        """
+        for race_round in fetch.rounds:
+            previous = self.entries.get(self.entry_key(fetch.season, race_round, fetch.category))
+            if previous is None or previous["content_hash"] != self.content_hash(fetch.digests[race_round]):
+                return True
+        return False
+
+    def stage(self, fetch: "FetchRecord", filename: str) -> None:
+        """
+        Holds the entries of a fetch until the file it wrote is uploaded.
+
+        :param fetch: The record of the pages fetched for a category and season
+        :param filename: The path of the written file
+        """
+        self.staged[filename] = fetch
+        self.record_file(filename)
+
+    def confirm_uploads(self, failed: list = ()) -> None:
+        """
+        Stores the entries of the staged fetches whose file was uploaded.
+
+        The rounds of a file that failed to upload are not recorded, so they stay pending
+        and are fetched again by the next run.
+
+        :param failed: The files that could not be uploaded
+        """
+        for filename, fetch in self.staged.items():
+            if filename in failed:
+                logging.warning(f"{filename} was not uploaded, its rounds stay pending.")
+                continue
+            self.commit(fetch)
+        self.staged = {}
+
+    def commit(self, fetch: "FetchRecord") -> bool:
+        """
+        Stores the entries of a completed fetch.
+
+        :param fetch: The record of the pages fetched for a category and season
+        :return: True if the content of at least one round changed since the last fetch
+        """
+        fetched_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        changed = self.changed(fetch)
+        for race_round in fetch.rounds:
+            key = self.entry_key(fetch.season, race_round, fetch.category)
+            content_hash = self.content_hash(fetch.digests[race_round])
+            self.entries[key] = {
+                "season": fetch.season,
+                "round": race_round,
+                "category": fetch.category,
+                "fetched_at": fetched_at,
+                "total": fetch.totals.get(race_round, fetch.totals.get(None, "0")),
+                "scope": fetch.scope,
+                "content_hash": content_hash,
+            }
+        return changed
+
+    def seed(self, s3_client, schedule: list, raw_folder: str = "raw", today: date | None = None) -> int:
+        """
+        Seeds an empty manifest from the raw files already stored, instead of planning
+        the whole history again.
+
+        Every raw race file under `raw_folder` is read once: the rounds it holds are
+        recorded with the hash of their content, provided their settle window is over
+        (rounds still settling stay pending). A file that cannot be read raises, rather
+        than silently backfilling its seasons.
+
+        :param s3_client: The storage holding the raw files
+        :param schedule: The F1 schedule (list of races), giving the race dates
+        :param raw_folder: The folder (prefix) of the raw files
+        :param today: The reference date (default is today)
+        :return: The number of entries seeded
+        :raises ValueError: If a raw file cannot be read
+        """
+        today = today or date.today()
+        race_dates = {(race["season"], race["round"]): race["date"] for race in schedule}
+        keys = [
+            key for key in s3_client.list_objects(f"{raw_folder}/")
+            if raw_extension(key) and Path(key).parent.name != Path(raw_folder).name
+        ]
+        for key in keys:
+            data = s3_client.read_object(key)
+            if data is None:
+                raise ValueError(f"Cannot seed the ingestion manifest: {key} could not be read")
+            category = Path(key).parent.name
+            fetch = FetchRecord(category, Path(key).name.split("_")[0], [])
+            with tempfile.TemporaryDirectory() as folder:
+                path = Path(folder) / Path(key).name
+                path.write_bytes(data)
+                for page in read_pages(str(path)):
+                    fetch.add(page)
+            fetch.scope = "season" if None in fetch.totals else "round"
+            fetch.rounds = [
+                race_round
+                for race_round in fetch.digests
+                if (fetch.season, race_round) in race_dates
+                and date.fromisoformat(race_dates[(fetch.season, race_round)]) + timedelta(days=self.settle_days) <= today
+            ]
+            self.commit(fetch)
+        logging.info(f"Seeded the ingestion manifest with {len(self.entries)} rounds from {len(keys)} raw files.")
+        return len(self.entries)
+
+    def record_file(self, filename: str) -> None:
+        """
+        Adds a file to the list of files written by the current run.
+
+        :param filename: The path of the written file
+        """
+        self.last_run["files"].append(filename)
+
+
+class FetchRecord:
+
+    def __init__(self, category: str, season: str, rounds: list, scope: str = "round") -> None:
+        """
+        Initializes the record of the pages fetched for a category and season.
+
+        Only the digests of the pages' items and the query totals are kept, so pages
+        can be recorded one by one as they are streamed to disk.
+
+        :param category: The category of the data
+        :param season: The F1 season
+        :param rounds: The rounds that were requested
+        :param scope: Whether the rounds are fetched one by one ('round') or at once ('season')
+        """
+        self.category = category
+        self.season = season
+        self.rounds = rounds
+        self.scope = scope
+        self.digests = {race_round: [] for race_round in rounds}
+        self.totals = {}
+
+    def add(self, response: dict) -> None:
+        """
+        Records a fetched page.
+
+        :param response: An API page (an `MRData` response)
+        """
+        mr_data = response["MRData"]
+        table = mr_data.get("RaceTable") or mr_data.get("StandingsTable", {})
+        for item in table.get("Races", table.get("StandingsLists", [])):
+            self.digests.setdefault(item["round"], []).append(IngestionManifest.item_digest(item))
+        self.totals.setdefault(table.get("round"), mr_data["total"])
@@ -0,0 +1,136 @@
+from math import ceil
+
+# Margin over the estimated rows of a request when sizing its pages, so that a round a
+# little larger than the estimate does not need one more request
+PAGE_HEADROOM = 1.25
+
+
+class RequestPlanner:
+
+    def __init__(
+        self,
+        round_category: list,
+        snapshot_category: list,
+        rows_per_round: dict,
+        max_page_size: int = 100,
+        manifest=None,
+    ) -> None:
+        """
+        Initializes the request planner, which picks the cheapest way to fetch each category.
+
+        - `round_category` can only be fetched per round (the API requires the round).
+        - `snapshot_category` (standings) are fetched per season: a season query returns
+          the standings after the latest round, which is what the pipeline stores.
+        - Other categories are fetched per round or per season, whichever needs fewer pages.
+
+        Page counts are estimated from the `MRData.total` recorded in the ingestion
+        manifest, falling back to `rows_per_round` for categories never fetched.
+
+        :param round_category: Categories that require the race round
+        :param snapshot_category: Categories whose season query only returns the latest round
+        :param rows_per_round: Default number of rows per round, by category
+        :param max_page_size: Largest `limit` accepted by the API
+        :param manifest: The ingestion manifest holding the totals of previous fetches (optional)
+        """
+        self.round_category = round_category or []
+        self.snapshot_category = snapshot_category or []
+        self.rows_per_round = rows_per_round
+        self.max_page_size = max_page_size
+        self.manifest = manifest
+
+    def estimate_rows_per_round(self, category: str) -> float:
+        """
+        Estimates the number of rows returned for a single round of a category.
+
+        :param category: The category of the data
+        :return: The mean number of rows per round from the manifest, or the configured default
+        """
+        entries = [
+            entry
+            for entry in (self.manifest.entries.values() if self.manifest else [])
+            if entry["category"] == category and int(entry["total"]) > 0
+        ]
+        round_totals = [int(entry["total"]) for entry in entries if entry.get("scope") == "round"]
+        if round_totals:
+            return sum(round_totals) / len(round_totals)
+
+        season_totals = {}
+        for entry in entries:
+            season_totals.setdefault(entry["season"], []).append(int(entry["total"]))
+        if season_totals:
+            # A season-scoped total is shared by every round recorded for that season
+            rows = [totals[0] / len(totals) for totals in season_totals.values()]
+            return sum(rows) / len(rows)
+
+        return self.rows_per_round.get(category, self.max_page_size)
+
+    def pages(self, rows: float) -> int:
+        """
+        Number of requests needed to fetch `rows` rows with the largest page size.
+
+        :param rows: The estimated number of rows
+        :return: The number of pages (at least one request is always sent)
+        """
+        return max(1, ceil(rows / self.max_page_size))
+
+    def page_size(self, rows: float) -> int:
+        """
+        Page size (`limit`) of the requests of a URL returning about `rows` rows.
+
+        The rows are spread evenly over the fewest pages, with `PAGE_HEADROOM` margin: a
+        results round (about 20 rows) is asked with `limit=25`, a laps round (about 1200
+        rows) with the largest page size.
+
+        :param rows: The estimated number of rows returned by the URL
+        :return: The page size, at most `max_page_size`
+        """
+        return min(self.max_page_size, max(1, ceil(rows * PAGE_HEADROOM / self.pages(rows))))
+
+    def choose(self, category: str, rounds: list, season_rounds: int) -> dict:
+        """
+        Picks the scope and page size of a (category, season) group of pending rounds.
+
+        :param category: The category of the data
+        :param rounds: The pending rounds of the season
+        :param season_rounds: The number of rounds that already took place in the season
+        :return: A dictionary with the scope, the page size, and the estimated rows and requests
+        """
+        rows = self.estimate_rows_per_round(category)
+        round_plan = {
+            "scope": "round",
+            "estimated_rows": round(rows * len(rounds)),
+            "estimated_requests": len(rounds) * self.pages(rows),
+            "limit": self.page_size(rows),
+        }
+        # A season query returns every round that already took place, pending or not
+        season_rows = rows * max(season_rounds, len(rounds))
+        season_plan = {
+            "scope": "season",
+            "estimated_rows": round(season_rows),
+            "estimated_requests": self.pages(season_rows),
+            "limit": self.page_size(season_rows),
+        }
+        if category in self.round_category:
+            return round_plan
+        if category in self.snapshot_category:
+            return {**season_plan, "estimated_rows": round(rows), "estimated_requests": self.pages(rows), "limit": self.page_size(rows)}
+        return min(season_plan, round_plan, key=lambda p: p["estimated_requests"])
+
+    @staticmethod
+    def format_plan(params: list) -> str:
+        """
+        Formats a request plan as a table followed by the total request budget.
+
+        :param params: The planned fetches, as built by `F1API.build_base_url_data`
+        :return: The printable plan
+        """
+        lines = [f"{'category':<22}{'season':<8}{'scope':<8}{'rounds':>7}{'limit':>7}{'rows':>9}{'requests':>10}"]
+        for param in params:
+            lines.append(
+                f"{param['category']:<22}{param['season']:<8}{param['scope']:<8}"
+                f"{len(param['rounds']):>7}{param['limit']:>7}"
+                f"{param['estimated_rows']:>9}{param['estimated_requests']:>10}"
+            )
+        budget = sum(param["estimated_requests"] for param in params)
+        lines.append(f"Request budget: {budget} requests for {len(params)} files")
+        return "\n".join(lines)
@@ -1,10 +1,12 @@
 from google.cloud import bigquery
 from dotenv import dotenv_values
 from utils.loading import (
-    load_and_transform_data,
+    scan_tables,
     load_into_bigquery,
     delete_local_files,
 )
+from utils.config import load_settings
+from utils.flatten import normalized_schema
 import json
 
 # === CONFIGURATION ===
@@ -23,11 +25,21 @@ bq_client = bigquery.Client.from_service_account_json(SERVICE_ACCOUNT)
 with open("config/data_schema.json", "r") as schema_file:
     schema_json = json.load(schema_file)
 
+# === Normalized prep tables are loaded as they are, unless the wide tables are asked for ===
+settings = load_settings(SETTINGS_PATH)
+WIDE_TABLES = settings["load"]["wide_tables"]
+WRITE_MODE = settings["load"]["write_mode"]
+REBUILD_TABLES = settings["load"].get("rebuild_tables", False)
+if settings["prep"]["normalize"] and not WIDE_TABLES:
+    schema_json = normalized_schema(schema_json)
+
 
 # === Main function ===
 def main():
-    transformed_data = load_and_transform_data(folder="prep", schema_json=schema_json)
-    load_into_bigquery(transformed_data, BQ_PROJECT, BQ_DATASET, schema_json, bq_client)
+    tables = scan_tables(folder="prep", schema_json=schema_json, wide=WIDE_TABLES)
+    load_into_bigquery(
+        tables, BQ_PROJECT, BQ_DATASET, schema_json, bq_client, write_mode=WRITE_MODE, rebuild_tables=REBUILD_TABLES
+    )
     delete_local_files(folder="prep")
 
 
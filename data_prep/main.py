@@ -1,7 +1,14 @@
-from utils.s3_utils import connect_s3
+from utils.s3_utils import connect_storage
 from dotenv import dotenv_values
-from utils.prep import data_loading_concurrency, file_to_prep
+from utils.prep import data_loading_concurrency, file_to_prep, get_flatten_planner
+from utils.dataset import PartitionedDataset
+from utils.config import load_settings
 from pathlib import Path
+import logging
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
 
 SETTINGS_PATH = "config/settings.yaml"
 CONFIG_PATH = "config/.env"
@@ -9,10 +16,31 @@ CONFIG_PATH = "config/.env"
 
 def main():
     config = dotenv_values(CONFIG_PATH)
-    s3_client = connect_s3(config)
+    settings = load_settings(SETTINGS_PATH)
+    s3_client = connect_storage(config, settings)
     s3_files = file_to_prep("raw/")
-    s3_files.sort()
-    data_loading_concurrency(s3_client=s3_client, files=s3_files)
+    s3_client.load_etags("prep/")
+    data_loading_concurrency(
+        s3_client=s3_client,
+        files=s3_files,
+        lazy_categories=settings["prep"]["lazy_categories"],
+        process_workers=settings["prep"]["process_workers"],
+        upload_workers=settings["prep"]["upload_workers"],
+        parquet_options=settings["prep"]["parquet"],
+        normalize=settings["prep"]["normalize"],
+        chunked_categories=settings["prep"]["chunked_categories"],
+        chunk_mb=settings["prep"]["chunk_mb"],
+    )
+    compaction = settings["prep"]["compaction"]
+    if compaction["enabled"]:
+        PartitionedDataset(
+            s3_client,
+            small_file_mb=compaction["small_file_mb"],
+            target_file_mb=compaction["target_file_mb"],
+            parquet_options=settings["prep"]["parquet"],
+            planner=get_flatten_planner(settings["prep"]["normalize"]),
+        ).compact()
+    logging.info(s3_client.transfer_summary())
 
 if __name__ == "__main__":
     main()
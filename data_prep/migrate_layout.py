@@ -0,0 +1,42 @@
+from utils.s3_utils import connect_storage
+from dotenv import dotenv_values
+from utils.dataset import PartitionedDataset
+from utils.prep import get_flatten_planner
+from utils.config import load_settings
+import argparse
+import logging
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+SETTINGS_PATH = "config/settings.yaml"
+CONFIG_PATH = "config/.env"
+
+
+def main(delete: bool = False, dry_run: bool = False, compact: bool = False):
+    """Rewrites the legacy prep/<category>/ files as round partitions, then optionally compacts them."""
+    config = dotenv_values(CONFIG_PATH)
+    settings = load_settings(SETTINGS_PATH)
+    s3_client = connect_storage(config, settings)
+    s3_client.load_etags("prep/")
+    dataset = PartitionedDataset(
+        s3_client,
+        small_file_mb=settings["prep"]["compaction"]["small_file_mb"],
+        target_file_mb=settings["prep"]["compaction"]["target_file_mb"],
+        parquet_options=settings["prep"]["parquet"],
+        planner=get_flatten_planner(settings["prep"]["normalize"]),
+    )
+    dataset.migrate(delete=delete, dry_run=dry_run)
+    if compact and not dry_run:
+        dataset.compact()
+    logging.info(s3_client.transfer_summary())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the prep files to the partitioned layout.")
+    parser.add_argument("--delete", action="store_true", help="delete the legacy files once migrated")
+    parser.add_argument("--dry-run", action="store_true", help="only list the files to migrate")
+    parser.add_argument("--compact", action="store_true", help="compact the small round files afterwards")
+    args = parser.parse_args()
+    main(delete=args.delete, dry_run=args.dry_run, compact=args.compact)
@@ -0,0 +1,102 @@
+import hashlib
+import shutil
+import threading
+from io import BytesIO
+from pathlib import Path
+import pytest
+from botocore.exceptions import ClientError
+from utils.s3_client import S3Client
+
+
+class FilesystemS3:
+    """
+    Local stand-in for the boto3 S3 client, storing objects as files under a root folder.
+    Only the calls used by S3Client are implemented.
+    """
+
+    def __init__(self, root: Path, upload_delay: float = 0.0):
+        self.root = Path(root)
+        self.headers = {}  # extra arguments (ContentType, ContentEncoding, Metadata...) per key
+        self.upload_delay = upload_delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _path(self, bucket: str, key: str) -> Path:
+        return self.root / bucket / key
+
+    def _etag(self, path: Path) -> str:
+        return f'"{hashlib.md5(path.read_bytes()).hexdigest()}"'
+
+    def _record(self, name: str, key: str, headers: dict):
+        with self._lock:
+            self.calls.append((name, key))
+            self.headers[key] = headers
+
+    def put_object(self, Bucket, Key, Body, **headers):
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(Body if isinstance(Body, bytes) else Body.read())
+        self._record("put_object", Key, headers)
+        return {"ETag": self._etag(path)}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None):
+        if self.upload_delay:
+            threading.Event().wait(self.upload_delay)
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(Filename, path)
+        self._record("upload_file", Key, ExtraArgs or {})
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as file:
+            shutil.copyfileobj(Fileobj, file)
+        self._record("upload_fileobj", Key, ExtraArgs or {})
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        path = self._path(Bucket, Key)
+        if not path.exists():
+            raise KeyError(f"NoSuchKey: {Key}")
+        self.calls.append(("get_object", Key))
+        if IfNoneMatch == self._etag(path):
+            raise ClientError({"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject")
+        return {"Body": BytesIO(path.read_bytes()), "ETag": self._etag(path)}
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not path.exists():
+            raise KeyError(f"NoSuchKey: {Key}")
+        return {"ContentLength": path.stat().st_size, "ETag": self._etag(path), **self.headers.get(Key, {})}
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            self._path(Bucket, obj["Key"]).unlink(missing_ok=True)
+            self._record("delete_objects", obj["Key"], {})
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix=""):
+        bucket = self.root / Bucket
+        contents = [
+            {"Key": str(path.relative_to(bucket)), "Size": path.stat().st_size, "ETag": self._etag(path)}
+            for path in sorted(bucket.rglob("*"))
+            if path.is_file() and str(path.relative_to(bucket)).startswith(Prefix)
+        ]
+        yield {"Contents": contents} if contents else {}
+
+
+@pytest.fixture
+def fake_s3(tmp_path) -> FilesystemS3:
+    """Filesystem-backed stand-in for the boto3 S3 client"""
+    return FilesystemS3(tmp_path / "s3")
+
+
+@pytest.fixture
+def s3_client(fake_s3: FilesystemS3) -> S3Client:
+    """S3Client connected to the filesystem-backed stand-in instead of AWS"""
+    client = S3Client(bucket_name="f1-test-bucket")
+    client.s3_client = fake_s3
+    return client
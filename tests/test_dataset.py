@@ -0,0 +1,168 @@
+from io import BytesIO
+from pathlib import Path
+import polars as pl
+import pyarrow.parquet as pq
+import pytest
+from utils.flatten import FlattenPlanner
+from utils.dataset import PartitionWriter, PartitionedDataset, parse_partition, partition_key, write_partitions
+from utils.s3_client import S3Client
+from utils.storage import LocalStorage
+
+# ---------- Fixtures ----------
+
+def laps(seasons=(2023, 2024), rounds=(1, 2, 3), drivers=("max", "lando")) -> pl.DataFrame:
+    """Flat laps table with one row per driver of each round."""
+    return pl.DataFrame(
+        [
+            {"season": str(season), "round": str(race_round), "driverId": driver, "time": f"1:3{race_round}.0"}
+            for season in seasons
+            for race_round in rounds
+            for driver in drivers
+        ]
+    )
+
+
+@pytest.fixture
+def dataset(s3_client: S3Client, tmp_path, monkeypatch) -> PartitionedDataset:
+    """Partitioned dataset of laps stored in the fake bucket, one file per round."""
+    monkeypatch.chdir(tmp_path)
+    s3_client.upload_files(write_partitions(laps(), "laps"))
+    return PartitionedDataset(s3_client)
+
+
+# ---------- Tests ----------
+
+def test_partition_keys():
+    """Keys carry the partition values; compacted season files have no round folder."""
+    assert partition_key("laps", "2024", "3") == "prep/category=laps/season=2024/round=3/part-0.parquet"
+    assert partition_key("laps", "2024", part=1) == "prep/category=laps/season=2024/part-1.parquet"
+    assert parse_partition("prep/category=laps/season=2024/part-1.parquet") == {"category": "laps", "season": "2024"}
+    assert parse_partition("prep/laps/2024_laps.parquet") == {}
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_write_partitions(tmp_path, monkeypatch, lazy: bool):
+    """Each round is written once, with its partition values kept as columns."""
+    monkeypatch.chdir(tmp_path)
+    table = laps(seasons=(2024,), rounds=(2, 10))
+    filenames = write_partitions(table.lazy() if lazy else table, "laps")
+
+    assert filenames == [
+        "prep/category=laps/season=2024/round=2/part-0.parquet",
+        "prep/category=laps/season=2024/round=10/part-0.parquet",
+    ]
+    assert pl.read_parquet(filenames[1]).equals(table.filter(pl.col("round") == "10"))
+    assert not list(Path("prep/category=laps").glob(".staging*"))
+
+
+def test_unsupported_sink_falls_back_to_collect(tmp_path, monkeypatch):
+    """Plans the streaming sink rejects are collected and written, with the same rows."""
+    monkeypatch.chdir(tmp_path)
+
+    sink, rejected = pl.LazyFrame.sink_parquet, []
+
+    def unsupported(lf, *args, **kwargs):  # rejects the first sink only: DataFrame.write_parquet may sink too
+        if not rejected:
+            rejected.append(lf)
+            raise pl.exceptions.InvalidOperationError("sink_Parquet(...) not yet supported in standard engine")
+        return sink(lf, *args, **kwargs)
+
+    monkeypatch.setattr(pl.LazyFrame, "sink_parquet", unsupported)
+    filenames = write_partitions(laps(seasons=(2024,)).lazy(), "laps")
+    assert rejected and pl.concat(map(pl.read_parquet, filenames)).equals(laps(seasons=(2024,)))
+
+    monkeypatch.setattr(pl.LazyFrame, "sink_parquet", lambda *a, **kw: (_ for _ in ()).throw(OSError("disk full")))
+    with pytest.raises(OSError):
+        write_partitions(laps().lazy(), "laps")
+
+
+def test_partition_writer_appends_chunks(tmp_path, monkeypatch):
+    """Chunks are appended to the file of their round; a round coming back after its file was closed gets a new part."""
+    monkeypatch.chdir(tmp_path)
+    with PartitionWriter("laps") as writer:
+        writer.write(laps(seasons=(2024,), rounds=(1,)))
+        writer.write(laps(seasons=(2024,), rounds=(1,)))
+        writer.write(laps(seasons=(2024,), rounds=(2,)))
+        writer.write(laps(seasons=(2024,), rounds=(1,), drivers=("oscar",)))
+        filenames = writer.close()
+
+    assert filenames == [
+        "prep/category=laps/season=2024/round=1/part-0.parquet",
+        "prep/category=laps/season=2024/round=2/part-0.parquet",
+        "prep/category=laps/season=2024/round=1/part-1.parquet",
+    ]
+    assert pl.read_parquet(filenames[0]).equals(pl.concat([laps(seasons=(2024,), rounds=(1,))] * 2))
+    assert pq.ParquetFile(filenames[0]).num_row_groups == 2
+
+
+def test_reads_only_the_needed_partitions(dataset: PartitionedDataset, fake_s3):
+    """Reading a season and a round only downloads the matching file."""
+    fake_s3.calls.clear()
+    rows = dataset.read("laps", seasons=[2024], rounds=[2])
+
+    assert [key for name, key in fake_s3.calls if name == "get_object"] == [
+        "prep/category=laps/season=2024/round=2/part-0.parquet"
+    ]
+    assert rows.equals(laps().filter((pl.col("season") == "2024") & (pl.col("round") == "2")))
+    assert dataset.read("laps").equals(laps())
+    encoded = dataset.read("laps", categorical_ids=True)
+    assert encoded.schema["driverId"] == pl.Categorical and encoded["driverId"].cast(pl.String).equals(laps()["driverId"])
+
+
+def test_compaction_merges_small_round_files(dataset: PartitionedDataset, fake_s3):
+    """Small round files are merged into one file per season, and reads are unchanged."""
+    summary = dataset.compact()
+
+    assert summary == {"seasons": 2, "merged": 6, "written": 2}
+    assert dataset.storage.list_objects("prep/") == [
+        "prep/category=laps/season=2023/part-0.parquet",
+        "prep/category=laps/season=2024/part-0.parquet",
+    ]
+    assert dataset.read("laps").equals(laps())
+    assert dataset.read("laps", seasons=[2024], rounds=[3]).equals(laps(seasons=(2024,), rounds=(3,)))
+
+
+def test_rewritten_round_overrides_compacted_rows(dataset: PartitionedDataset):
+    """A round prepared again after compaction replaces its rows, and is merged back by the next compaction."""
+    dataset.compact()
+    rewritten = laps(seasons=(2024,), rounds=(3,), drivers=("max", "lando", "oscar"))
+    dataset.storage.upload_files(write_partitions(rewritten, "laps"))
+
+    expected = pl.concat([laps(seasons=(2024,), rounds=(1, 2)), rewritten])
+    assert dataset.read("laps", seasons=[2024]).equals(expected)
+
+    assert dataset.compact() == {"seasons": 1, "merged": 2, "written": 1}
+    assert dataset.read("laps", seasons=[2024]).equals(expected)
+
+
+def test_large_round_files_are_not_compacted(dataset: PartitionedDataset):
+    """Seasons whose round files are already big enough are left as they are."""
+    dataset.small_file_bytes = 0
+    assert dataset.compact()["seasons"] == 0
+
+
+def test_untyped_files_are_cast_when_compacted(dataset: PartitionedDataset):
+    """With a planner, files written before prep typed its output are cast to the schema types."""
+    dataset.planner = FlattenPlanner({"laps": {"season": "INTEGER", "round": "INTEGER", "driverId": "STRING", "time": "STRING"}})
+    typed = laps(seasons=(2024,), rounds=(4,)).with_columns(pl.col("season", "round").cast(pl.Int64))
+    dataset.storage.upload_files(write_partitions(typed, "laps"))
+
+    dataset.compact()
+    season = dataset.read("laps", seasons=[2024])
+    assert season.schema["round"] == pl.Int64 and season["round"].unique().sort().to_list() == [1, 2, 3, 4]
+
+
+def test_migrate_legacy_layout(tmp_path, monkeypatch):
+    """Legacy per-season files are rewritten as round partitions and deleted."""
+    monkeypatch.chdir(tmp_path)
+    storage = LocalStorage("store")
+    for season in (2023, 2024):
+        buffer = BytesIO()
+        laps(seasons=(season,)).write_parquet(buffer)
+        storage.write_object(f"prep/laps/{season}_laps.parquet", buffer.getvalue())
+    dataset = PartitionedDataset(storage)
+
+    assert dataset.migrate(dry_run=True) == {"migrated": 0, "written": 0}
+    assert dataset.migrate(delete=True) == {"migrated": 2, "written": 6}
+    assert all(parse_partition(key)["category"] == "laps" for key in storage.list_objects("prep/"))
+    assert dataset.read("laps").equals(laps())
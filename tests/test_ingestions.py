@@ -1,16 +1,28 @@
 from data_ingestion.src.f1_api import F1API
+import asyncio
+import aiohttp
+from data_ingestion.src.cache import ResponseCache
+from utils.disk_cache import DiskCache
+from data_ingestion.src.fetcher import RetryPolicy, FetchError, CircuitOpenError
+from utils.raw_format import PageWriter, read_pages, upload_headers
+from utils.storage import LocalStorage
+from utils.prep import read_object_into_table
+from data_ingestion.src.manifest import IngestionManifest
+from datetime import date
 import pytest
 import requests
 import json
+from math import ceil
+import os
 from pathlib import Path
 from typing import Tuple, Dict
 
 # ---------- Fixtures ----------
 
 @pytest.fixture(scope="module")
-def f1_api() -> F1API:
+def f1_api(tmp_path_factory) -> F1API:
     """Single instance of F1API that can be used across multiple tests in the module"""
-    api = F1API()  # Initialize F1API class (assumed to be defined elsewhere)
+    api = F1API(cache_dir=str(tmp_path_factory.mktemp("cache")))  # keeps the response cache out of the working tree
     return api  # This instance will be passed to any test requiring it
 
 
@@ -133,3 +145,512 @@ def test_url_generation(api_url: str, category_type: Tuple[str, str]):
     
     elif data_type == "race":
         assert f"{category}" in api_url  # Validate that the category is included in the URL
+
+
+# ---------- Fetch engine ----------
+
+class FakeResponse:
+    """Minimal stand-in for an aiohttp response."""
+
+    def __init__(self, payload: dict, status: int = 200, headers: dict | None = None, delay: float = 0.0):
+        self.payload = payload
+        self.status = status
+        self.headers = headers or {}
+        self.delay = delay
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status=self.status)
+
+    async def read(self):
+        await asyncio.sleep(self.delay)
+        return json.dumps(self.payload).encode()
+
+
+class FakeSession:
+    """
+    Stand-in for the pooled aiohttp session answering from a fake page store.
+    Each page echoes the requested URL so the order of the saved pages can be checked.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self.requested = []
+        self.failures = []  # statuses answered (in order) before the pages
+        self.delays = {}  # answer delay (in seconds) of the URLs containing each key
+
+    def get(self, url, headers=None, **kwargs):
+        self.requested.append(url)
+        if self.failures:
+            return FakeResponse({}, status=self.failures.pop(0), headers={"Retry-After": "0"})
+        if headers and headers.get("If-None-Match") == '"v1"':
+            return FakeResponse({}, status=304)
+        total = "250" if "laps" in url else "0"
+        return FakeResponse(
+            {"MRData": {"url": url.split("?")[0], "total": total, "page": url}},
+            headers={"ETag": '"v1"'},
+            delay=sum(delay for key, delay in self.delays.items() if key in url),
+        )
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def offline_api(tmp_path) -> F1API:
+    """F1API instance whose fetch engine uses a fake session instead of the network."""
+    api = F1API(session=FakeSession(), cache_dir=str(tmp_path / "cache"))
+    api.folder_name = str(tmp_path / "raw")
+    api.fetcher.cache = ResponseCache(directory=str(tmp_path / "cache"), current_season_ttl=0)
+    api.fetcher.retry = RetryPolicy(max_attempts=3, base_delay=0.01)
+    yield api
+    api.close()
+
+
+def test_token_bucket_limits_request_rate():
+    """The token bucket lets `burst` requests through at once, then spaces them at the configured rate."""
+    from time import monotonic
+    from data_ingestion.src.fetcher import TokenBucket
+
+    async def acquire_all():
+        bucket = TokenBucket(requests_per_second=20, burst=2)
+        start = monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return monotonic() - start
+
+    elapsed = asyncio.run(acquire_all())
+    assert elapsed >= 0.09  # two tokens beyond the burst at 20 req/s
+
+
+def test_build_race_data_keeps_file_layout(offline_api: F1API):
+    """Concurrent fetching writes the same bytes as the serial implementation: first pages, then extra pages in order."""
+    offline_api.raw_format = "json"
+    urls = [offline_api.base_url_data("laps", "2024", r) for r in ["1", "2"]]
+    offline_api.build_race_data({"category": "laps", "season": "2024", "urls": urls})
+
+    expected = [{"MRData": {"url": url, "total": "250", "page": url}} for url in urls]
+    expected += [
+        {"MRData": {"url": url, "total": "250", "page": f"{url}?limit=100&offset={offset}"}}
+        for url in urls
+        for offset in (100, 200)
+    ]
+    saved = Path(f"{offline_api.folder_name}/laps/2024_laps.json").read_text()
+    assert saved == json.dumps(expected)
+
+
+def test_session_is_pooled_and_shared(tmp_path):
+    """Every call reuses one keep-alive session with per-host limits and gzip encoding."""
+    api = F1API(cache_dir=str(tmp_path / "cache"))
+
+    async def open_session():
+        return api.fetcher.get_session()
+
+    session = api.fetcher.run(open_session())
+    assert api.fetcher.get_session() is session
+    assert session.connector.limit_per_host == api.settings["f1_api"]["session"]["per_host_limit"]
+    assert "gzip" in session.headers["Accept-Encoding"]
+    api.close()
+    assert session.closed
+
+
+def test_injected_session_serves_all_calls(offline_api: F1API):
+    """An injected session is used by the schedule, initial and additional page fetches alike."""
+    offline_api.fetch_circuit_schedule(100)
+    offline_api.fetch_initial_responses([offline_api.base_url_data("laps", "2024", "1")])
+    offline_api.fetch_additional_data([f"{offline_api.base_url}2024/1/laps?limit=100&offset=100"])
+    assert len(offline_api.fetcher.session.requested) == 3
+
+
+# ---------- Response cache ----------
+
+def test_past_season_is_served_from_cache(offline_api: F1API):
+    """Settled races are cached forever: the second fetch does not reach the API."""
+    offline_api.fetcher.cache.set_schedule([{"season": "2021", "round": "1", "date": "2021-03-28"}])
+    url = offline_api.base_url_data("laps", "2021", "1")
+    first = offline_api.fetch_initial_responses([url])
+    second = offline_api.fetch_initial_responses([url + "/"])  # same normalized key
+    assert first == second
+    assert len(offline_api.fetcher.session.requested) == 1
+    assert (offline_api.fetcher.cache.hits, offline_api.fetcher.cache.misses) == (1, 1)
+
+
+def test_cache_keeps_responses_forever_once_races_settle(tmp_path):
+    """Responses are cached forever only after the settle window of their race (or last race), not by calendar year."""
+    from datetime import timedelta
+
+    cache = ResponseCache(directory=str(tmp_path / "cache"), current_season_ttl=60, settle_days=3)
+    today = date.today()
+    cache.set_schedule([
+        {"season": "2020", "round": "1", "date": "2020-03-01"},
+        {"season": "2021", "round": "1", "date": (today - timedelta(days=10)).isoformat()},
+        {"season": "2021", "round": "2", "date": (today - timedelta(days=1)).isoformat()},
+    ])
+    base = "https://api.jolpi.ca/ergast/f1"
+    assert cache.ttl(f"{base}/2020/results?limit=100") is None
+    assert cache.ttl(f"{base}/2021/1/laps?limit=100") is None
+    assert cache.ttl(f"{base}/2021/2/laps?limit=100") == 60
+    assert cache.ttl(f"{base}/2021/results") == 60  # its last race is still settling
+    assert cache.ttl(f"{base}/2019/results") == 60  # not in the schedule
+    assert cache.ttl(f"{base}?offset=0&limit=100") == 0
+
+
+def test_schedule_is_revalidated_with_etag(offline_api: F1API):
+    """The schedule is always revalidated, and a 304 answer returns the cached page."""
+    first = offline_api.fetch_circuit_schedule(100)
+    second = offline_api.fetch_circuit_schedule(100)
+    assert first == second
+    assert len(offline_api.fetcher.session.requested) == 2
+    assert offline_api.fetcher.cache.revalidated == 1
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    """Once over its size limit, the cache drops the entries that were read least recently."""
+    cache = DiskCache(str(tmp_path), max_size_mb=2.5 / 1024)  # 2.5 KB
+    cache.put("a", b"x" * 1024, {})
+    cache.put("b", b"x" * 1024, {})
+    os.utime(cache._paths("a")[0], (0, 0))
+    os.utime(cache._paths("b")[0], (1, 1))
+    cache.get("a")  # "a" becomes the most recently used entry
+    cache.put("c", b"x" * 1024, {})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+# ---------- Ingestion manifest ----------
+
+@pytest.fixture
+def manifest(tmp_path) -> IngestionManifest:
+    """Empty manifest stored in a temporary folder"""
+    return IngestionManifest(local_path=str(tmp_path / "manifest.json"), settle_days=3)
+
+
+def test_manifest_plans_only_unsettled_races(manifest: IngestionManifest):
+    """Races are pending until fetched after their settle window; future races are never pending."""
+    schedule = [
+        {"season": "2024", "round": "1", "date": "2024-03-02"},
+        {"season": "2024", "round": "2", "date": "2024-03-09"},
+        {"season": "2024", "round": "3", "date": "2024-03-24"},
+    ]
+    manifest.entries[manifest.entry_key("2024", "1", "laps")] = {"fetched_at": "2024-03-10T00:00:00+00:00"}
+    manifest.entries[manifest.entry_key("2024", "2", "laps")] = {"fetched_at": "2024-03-10T00:00:00+00:00"}
+    plan = manifest.plan(schedule, ["laps"], today=date(2024, 3, 11))
+    assert plan == [{"season": "2024", "round": "2", "category": "laps"}]
+
+
+def test_rerun_without_changes_is_a_noop(offline_api: F1API, manifest: IngestionManifest):
+    """A second fetch of identical content updates the manifest but writes no file."""
+    offline_api.manifest = manifest
+    params = {
+        "category": "laps",
+        "season": "2024",
+        "rounds": ["1"],
+        "urls": [offline_api.base_url_data("laps", "2024", "1")],
+    }
+    manifest.start_run()
+    offline_api.build_race_data(params)
+    assert len(manifest.last_run["files"]) == 1
+    manifest.confirm_uploads()
+    assert manifest.entries["2024/1/laps"]["total"] == "250"
+
+    Path(manifest.last_run["files"][0]).unlink()
+    manifest.save()
+    manifest.load()
+    manifest.start_run()
+    offline_api.build_race_data(params)
+    assert manifest.last_run["files"] == []
+    assert not Path(f"{offline_api.folder_name}/laps/2024_laps.json").exists()
+
+
+def test_failed_upload_keeps_rounds_pending(offline_api: F1API, manifest: IngestionManifest):
+    """Rounds are recorded only once their raw file is uploaded: a failed upload leaves them pending."""
+    offline_api.manifest = manifest
+    manifest.start_run()
+    for race_round in ("1", "2"):
+        offline_api.build_race_data({
+            "category": "laps", "season": str(2022 + int(race_round)), "rounds": [race_round],
+            "urls": [offline_api.base_url_data("laps", str(2022 + int(race_round)), race_round)],
+        })
+    assert manifest.entries == {}
+
+    manifest.confirm_uploads(failed=[manifest.last_run["files"][0]])
+    assert list(manifest.entries) == ["2024/2/laps"] and manifest.staged == {}
+
+
+def test_empty_manifest_is_seeded_from_stored_raw_files(tmp_path, manifest: IngestionManifest):
+    """A first run records the settled rounds of the raw files already in the bucket instead of refetching them."""
+    storage = LocalStorage(str(tmp_path / "bucket"))
+    pages = []
+    for race_round in ("1", "2"):
+        page = json.loads(Path("tests/ingestion_test_data/laps.json").read_text())
+        page["MRData"]["RaceTable"]["round"] = race_round
+        page["MRData"]["RaceTable"]["Races"][0]["round"] = race_round
+        pages.append(page)
+    with PageWriter(str(tmp_path / "2024_laps.ndjson.gz")) as writer:
+        for page in pages:
+            writer.write(page)
+        writer.commit()
+    storage.upload_file(str(tmp_path / "2024_laps.ndjson.gz"), "raw/laps/2024_laps.ndjson.gz")
+    storage.write_object("raw/f1_schedule.json", b"[]")
+    schedule = [
+        {"season": "2024", "round": "1", "date": "2024-03-02"},
+        {"season": "2024", "round": "2", "date": "2024-03-09"},
+        {"season": "2024", "round": "3", "date": "2024-03-24"},
+    ]
+
+    assert manifest.seed(storage, schedule, today=date(2024, 3, 11)) == 1
+    assert manifest.entries["2024/1/laps"]["scope"] == "round"
+    plan = manifest.plan(schedule, ["laps"], today=date(2024, 3, 11))
+    assert plan == [{"season": "2024", "round": "2", "category": "laps"}]
+
+    storage.write_object("raw/laps/2023_laps.ndjson", b"{truncated")
+    with pytest.raises(ValueError):
+        manifest.seed(storage, schedule)
+
+
+# ---------- Request planner ----------
+
+@pytest.mark.parametrize("category, pending_rounds, season_rounds, scope, requests, limit", [
+    ("results", ["10"], 10, "round", 1, 25),                           # daily run: one round-scoped page
+    ("results", [str(r) for r in range(1, 25)], 24, "season", 5, 100),  # backfill: 480 rows in 5 season pages
+    ("laps", [str(r) for r in range(1, 25)], 24, "round", 24 * 12, 100),  # the API requires the round
+    ("driverstandings", ["3", "4"], 4, "season", 1, 28),               # standings are season snapshots
+])
+def test_planner_picks_cheapest_scope(f1_api, category, pending_rounds, season_rounds, scope, requests, limit):
+    """The planner picks the scope needing the fewest requests, and a page size fitting the category's rows."""
+    plan = f1_api.planner.choose(category, pending_rounds, season_rounds)
+    assert (plan["scope"], plan["estimated_requests"], plan["limit"]) == (scope, requests, limit)
+
+
+def test_round_scoped_fetches_land_in_round_files(offline_api: F1API):
+    """A round-scoped fetch writes a file of its own instead of replacing the season file with one round."""
+    offline_api.f1_schedule = [
+        {"season": "2024", "round": str(r), "date": f"2024-03-{r:02d}"} for r in range(1, 11)
+    ]
+    offline_api.pending_work = [{"season": "2024", "round": "10", "category": "results"}]
+    (params,) = offline_api.build_base_url_data()
+    assert (params["scope"], params["rounds"], params["urls"]) == (
+        "round", ["10"], [f"{offline_api.base_url_data('results', '2024', '10')}?limit=25"]
+    )
+    assert offline_api.raw_filename(params).endswith("/results/2024_10_results.ndjson.gz")
+    assert offline_api.raw_filename({**params, "scope": "season"}).endswith("/results/2024_results.ndjson.gz")
+
+
+def test_pagination_follows_reported_limit(f1_api: F1API, expected_data: Dict, category_type):
+    """Additional pages start where the first page stopped, even when it used the API's default limit."""
+    urls = f1_api.get_additional_urls([expected_data])
+    limit = int(expected_data["MRData"]["limit"])
+    total = int(expected_data["MRData"]["total"])
+    assert len(urls) == ceil(total / limit) - 1
+    assert urls[0].endswith(f"?limit={limit}&offset={limit}")
+
+
+# ---------- Streaming page writer ----------
+
+@pytest.mark.parametrize("raw_format", ["ndjson", "ndjson.gz", "ndjson.zst"])
+def test_streamed_file_holds_every_page(offline_api: F1API, raw_format: str):
+    """Streamed files hold the same pages as the JSON array, written in request order even when pages arrive out of order."""
+    if raw_format.endswith(".zst"):
+        pytest.importorskip("zstandard")
+    urls = [offline_api.base_url_data("laps", "2024", r) for r in ["1", "2"]]
+    params = {"category": "laps", "season": "2024", "rounds": ["1", "2"], "urls": urls}
+    offline_api.raw_format = "json"
+    offline_api.build_race_data(params)
+    offline_api.raw_format = raw_format
+    offline_api.fetcher.session.delays = {"/1/laps": 0.05, "offset=100": 0.02}  # round 2 and last pages first
+    offline_api.build_race_data(params)
+
+    folder = Path(f"{offline_api.folder_name}/laps")
+    expected = list(read_pages(folder / "2024_laps.json"))
+    streamed = list(read_pages(folder / f"2024_laps.{raw_format}"))
+    key = lambda page: page["MRData"]["page"]
+    assert sorted(streamed, key=key) == sorted(expected, key=key)
+    assert [key(page) for page in streamed] == [
+        f"{url}{offset}" for url in urls for offset in ("", "?limit=100&offset=100", "?limit=100&offset=200")
+    ]
+    assert not list(folder.glob("*.part"))
+
+
+def test_backfill_stays_under_the_open_file_limit(offline_api: F1API):
+    """A backfill of many files builds a bounded number at once, instead of holding a raw file open per fetch."""
+    resource = pytest.importorskip("resource")
+    from data_ingestion.src.fetcher import TokenBucket
+
+    offline_api.raw_format = "ndjson.gz"
+    offline_api.fetcher.cache = None
+    offline_api.fetcher.rate_limiter = TokenBucket(requests_per_second=1e6, burst=10_000)
+    params = [
+        {
+            "category": "laps", "season": str(1950 + i // 20), "rounds": [str(i % 20 + 1)], "scope": "round",
+            "urls": [offline_api.base_url_data("laps", str(1950 + i // 20), str(i % 20 + 1))],
+        }
+        for i in range(400)
+    ]
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(256, soft), hard))
+    try:
+        offline_api.fetcher.run(offline_api.fetch_data_async(params))
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+    assert len(list(Path(offline_api.folder_name).rglob("*.ndjson.gz"))) == 400
+
+
+def test_partial_file_never_reaches_prep(tmp_path):
+    """A failure while streaming leaves neither the final file nor the temporary one."""
+    filename = str(tmp_path / "laps" / "2024_laps.ndjson")
+    with pytest.raises(RuntimeError):
+        with PageWriter(filename) as writer:
+            writer.write({"MRData": {}})
+            raise RuntimeError("connection lost")
+    assert list((tmp_path / "laps").iterdir()) == []
+
+
+# ---------- Retry, throttle and circuit breaker ----------
+
+def test_transient_errors_are_retried(offline_api: F1API):
+    """A 503 then a 429 are retried, and the 429 halves the request rate."""
+    offline_api.fetcher.session.failures = [503, 429]
+    rate = offline_api.fetcher.rate_limiter.rate
+    responses = offline_api.fetch_initial_responses([offline_api.base_url_data("laps", "2024", "1")])
+    assert len(responses) == 1
+    assert len(offline_api.fetcher.session.requested) == 3
+    assert offline_api.fetcher.rate_limiter.rate == rate / 2
+
+
+def test_failed_page_leaves_no_file(offline_api: F1API, manifest: IngestionManifest):
+    """A page failing after every retry fails its file: nothing is written and the rounds stay pending."""
+    offline_api.manifest = manifest
+    offline_api.fetcher.session.failures = [500, 500, 500]
+    params = {"category": "laps", "season": "2024", "rounds": ["1"], "urls": [offline_api.base_url_data("laps", "2024", "1")]}
+    with pytest.raises(FetchError):
+        offline_api.build_race_data(params)
+    assert not [path for path in Path(offline_api.folder_name).rglob("*") if path.is_file()]
+    assert manifest.entries == {}
+
+
+def test_circuit_breaker_aborts_the_run(offline_api: F1API):
+    """Once the failure threshold is reached, the run is aborted without further requests."""
+    offline_api.fetcher.breaker.failure_threshold = 3
+    offline_api.fetcher.session.failures = [500] * 3
+    params = [
+        {"category": "laps", "season": "2024", "rounds": ["1"], "urls": [offline_api.base_url_data("laps", "2024", "1")]},
+        {"category": "laps", "season": "2023", "rounds": ["1"], "urls": [offline_api.base_url_data("laps", "2023", "1")]},
+    ]
+    with pytest.raises(CircuitOpenError):
+        offline_api.fetcher.run(offline_api.fetch_data_async(params))
+    assert len(offline_api.fetcher.session.requested) == 3
+
+
+# ---------- Schedule refresh ----------
+
+class ScheduleSession(FakeSession):
+    """Fake session serving a 250-race schedule of 10 seasons (25 rounds each) with the "v2" dates."""
+
+    races = [
+        {"season": str(2015 + i // 25), "round": str(i % 25 + 1), "date": f"v2-{i}"}
+        for i in range(250)
+    ]
+
+    def get(self, url, headers=None, **kwargs):
+        self.requested.append(url)
+        path, _, query = url.partition("?")
+        params = dict(p.split("=") for p in query.split("&") if p)
+        season = path.rstrip("/").rsplit("/", 1)[-1]
+        races = [r for r in self.races if r["season"] == season] if season.isdigit() else self.races
+        offset, limit = int(params.get("offset", 0)), int(params.get("limit", 30))
+        return FakeResponse({"MRData": {
+            "url": path, "limit": str(limit), "offset": str(offset), "total": str(len(races)),
+            "RaceTable": {"Races": races[offset:offset + limit]},
+        }})
+
+
+def test_full_schedule_fetches_every_page(tmp_path):
+    """The full history is fetched with 100-race pages, the remaining offsets concurrently."""
+    api = F1API(session=ScheduleSession(), cache_dir=str(tmp_path / "cache"))
+    api.fetcher.cache = None
+    api.fetch_f1_seasons_schedule()
+    api.close()
+    assert len(api.f1_schedule) == 250
+    assert len(api.fetcher.session.requested) == 3
+
+
+def test_schedule_failure_waits_for_every_page(tmp_path):
+    """A failing schedule page is raised only once the other page requests have settled."""
+
+    class FailingScheduleSession(ScheduleSession):
+        settled = []
+
+        def get(self, url, headers=None, **kwargs):
+            response = super().get(url, headers, **kwargs)
+            if "offset=100" in url:
+
+                async def broken_read():
+                    return b"{"  # invalid JSON: not retried
+
+                response.read = broken_read
+            elif "offset=200" in url:
+                response.delay = 0.2
+                read = response.read
+
+                async def slow_read():
+                    payload = await read()
+                    self.settled.append(url)
+                    return payload
+
+                response.read = slow_read
+            return response
+
+    api = F1API(session=FailingScheduleSession(), cache_dir=str(tmp_path / "cache"))
+    api.fetcher.cache = None
+    with pytest.raises(FetchError):
+        api.fetch_f1_seasons_schedule()
+    settled = list(FailingScheduleSession.settled)
+    api.close()
+    assert len(settled) == 1 and "offset=200" in settled[0]
+
+
+def test_incremental_schedule_refresh_merges_seasons(tmp_path):
+    """Only the refreshed seasons are fetched; the other stored races are kept as they were."""
+    api = F1API(session=ScheduleSession(), cache_dir=str(tmp_path / "cache"))
+    api.fetcher.cache = None
+    stored = [dict(race, date="v1") for race in ScheduleSession.races if race["season"] != "2024"]
+    api.refresh_f1_schedule(stored, [2023, 2024])
+    api.close()
+    assert len(api.fetcher.session.requested) == 2
+    assert len(api.f1_schedule) == 250
+    assert {race["date"][:2] for race in api.f1_schedule if race["season"] in ("2023", "2024")} == {"v2"}
+    assert {race["date"] for race in api.f1_schedule if race["season"] == "2022"} == {"v1"}
+    assert api.f1_schedule[0] == dict(ScheduleSession.races[0], date="v1")
+
+
+# ---------- Compressed raw format ----------
+
+@pytest.mark.parametrize("filename, headers", [
+    ("raw/laps/2024_laps.json", {"ContentType": "application/json"}),
+    ("raw/laps/2024_laps.ndjson", {"ContentType": "application/x-ndjson"}),
+    ("raw/laps/2024_laps.ndjson.gz", {"ContentType": "application/x-ndjson", "ContentEncoding": "gzip"}),
+    ("raw/laps/2024_laps.ndjson.zst", {"ContentType": "application/x-ndjson", "ContentEncoding": "zstd"}),
+])
+def test_raw_files_are_uploaded_with_their_encoding(filename: str, headers: Dict):
+    """Raw files are uploaded as they are, described by their Content-Type and Content-Encoding."""
+    assert upload_headers(filename) == headers
+
+
+def test_prep_reads_compressed_pages(tmp_path):
+    """data_prep builds the same table from a compressed newline-delimited file as from the JSON array."""
+    pages = [json.loads(Path(f"tests/ingestion_test_data/{c}.json").read_text()) for c in ["laps", "laps"]]
+    json_file = tmp_path / "2024_laps.json"
+    json_file.write_text(json.dumps(pages))
+    with PageWriter(str(tmp_path / "2024_laps.ndjson.gz")) as writer:
+        for page in pages:
+            writer.write(page)
+        writer.commit()
+    expected, _ = read_object_into_table(str(json_file))
+    compressed, _ = read_object_into_table(str(tmp_path / "2024_laps.ndjson.gz"))
+    assert compressed.equals(expected)
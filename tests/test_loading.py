@@ -0,0 +1,217 @@
+import json
+import re
+import shutil
+from pathlib import Path
+import polars as pl
+import pyarrow.parquet as pq
+import pytest
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+from utils.dataset import write_partitions
+from utils.flatten import normalized_schema
+from utils.loading import cluster_fields, ensure_table, file_to_load, load_into_bigquery, scan_tables
+
+SCHEMA = json.loads(Path("config/data_schema.json").read_text())
+
+
+class FakeJob:
+    """Stand-in for a finished BigQuery load or query job."""
+
+    def __init__(self, rows: int = 0, bytes_processed: int = 0):
+        self.output_rows = rows
+        self.total_bytes_processed = bytes_processed
+
+    def result(self):
+        return self
+
+
+class FakeBigQuery:
+    """
+    Local stand-in for the BigQuery client, keeping the rows of each table as Arrow tables.
+    Only the calls used by the loader are implemented; queries are limited to the
+    round-replacing script of the loader (table rebuilds are only recorded).
+    """
+
+    def __init__(self):
+        self.tables = {}  # table id -> rows
+        self.definitions = {}  # table id -> bigquery.Table (partitioning, clustering)
+        self.configs = {}
+        self.queries = []
+
+    def get_table(self, table_id):
+        if table_id not in self.definitions:
+            raise NotFound(table_id)
+        return self.definitions[table_id]
+
+    def create_table(self, table):
+        self.definitions[f"{table.project}.{table.dataset_id}.{table.table_id}"] = table
+
+    def delete_table(self, table_id, not_found_ok=False):
+        self.tables.pop(table_id, None)
+        self.definitions.pop(table_id, None)
+
+    def load_table_from_file(self, file_obj, destination, job_config=None):
+        table = pq.read_table(file_obj)
+        assert job_config.write_disposition == "WRITE_TRUNCATE"
+        self.tables[destination] = table
+        self.configs[destination] = job_config
+        return FakeJob(rows=table.num_rows)
+
+    def query(self, sql):
+        self.queries.append(sql)
+        if sql.startswith("CREATE OR REPLACE TABLE"):
+            return FakeJob()
+        target, staging = re.search(r"DELETE FROM `(.+?)`.*FROM `(.+?)`", sql, re.S).groups()
+        seasons = [int(season) for season in re.search(r"season IN \((.*?)\)", sql).group(1).split(", ")]
+        batch = pl.from_arrow(self.tables[staging])
+        current = self.tables.get(target)
+        scanned = 0
+        if current is not None:
+            current = pl.from_arrow(current)
+            scanned = current.filter(pl.col("season").is_in(seasons)).estimated_size()
+            current = current.join(batch.select("season", "round").unique(), on=["season", "round"], how="anti")
+        rows = batch if current is None else pl.concat([current, batch], how="diagonal_relaxed")
+        self.tables[target] = rows.to_arrow()
+        return FakeJob(bytes_processed=scanned + batch.estimated_size())
+
+
+# ---------- Fixtures ----------
+
+def results(seasons=(2024,), rounds=(1, 2)) -> pl.DataFrame:
+    """Typed wide results rows, as written by prep."""
+    return pl.DataFrame(
+        [
+            {"season": season, "round": race_round, "raceName": f"GP {race_round}", "Results_position": position}
+            for season in seasons
+            for race_round in rounds
+            for position in (1, 2)
+        ],
+        schema={"season": pl.Int64, "round": pl.Int64, "raceName": pl.String, "Results_position": pl.Int64},
+    )
+
+
+@pytest.fixture
+def prep_folder(tmp_path, monkeypatch) -> Path:
+    """Working directory holding typed prep partitions of the results table."""
+    monkeypatch.chdir(tmp_path)
+    write_partitions(results(), "results")
+    return Path("prep")
+
+
+# ---------- Tests ----------
+
+def test_tables_are_loaded_from_files_without_dataframes(prep_folder: Path, monkeypatch):
+    """Each table is sent as one Parquet file load job, typed, without collecting a DataFrame."""
+    monkeypatch.setattr(pl.LazyFrame, "collect", lambda *a, **kw: pytest.fail("a DataFrame was built"))
+    client = FakeBigQuery()
+
+    stats = load_into_bigquery(scan_tables(str(prep_folder), SCHEMA), "project", "f1", SCHEMA, client)
+
+    loaded = client.tables["project.f1.results"]
+    assert loaded.num_rows == 4 and loaded.column_names == ["season", "round", "raceName", "Results_position"]
+    assert str(loaded.schema.field("Results_position").type) == "int64"
+    assert client.configs["project.f1.results__staging"].source_format == "PARQUET"
+    assert stats["results"]["rows"] == 4 and stats["results"]["bytes"] > 0 and stats["results"]["seconds"] >= 0
+    assert not list(Path(".load").iterdir())
+
+
+def test_untyped_files_are_cast_before_loading(prep_folder: Path):
+    """Files written before prep typed its output are cast to the schema types in the load file."""
+    legacy = results(rounds=(3,)).with_columns(pl.all().cast(pl.String))
+    write_partitions(legacy, "results")
+    client = FakeBigQuery()
+
+    load_into_bigquery(scan_tables(str(prep_folder), SCHEMA), "project", "f1", SCHEMA, client)
+    loaded = pl.from_arrow(client.tables["project.f1.results"])
+    assert loaded.schema["round"] == pl.Int64 and loaded.height == 6
+
+
+def test_wide_tables_from_normalized_prep(tmp_path, monkeypatch):
+    """With wide tables, the race header is joined back onto the normalized race tables."""
+    monkeypatch.chdir(tmp_path)
+    wide = results()
+    write_partitions(wide.select("season", "round", "Results_position"), "results")
+    write_partitions(wide.select("season", "round", "raceName").unique(maintain_order=True), "races")
+    assert set(file_to_load("prep")) == {"results", "races"}
+
+    normalized = load_into_bigquery(
+        scan_tables("prep", normalized_schema(SCHEMA)), "project", "f1", normalized_schema(SCHEMA), FakeBigQuery()
+    )
+    assert set(normalized) == {"results", "races"}
+
+    client = FakeBigQuery()
+    load_into_bigquery(scan_tables("prep", SCHEMA, wide=True), "project", "f1", SCHEMA, client)
+    assert list(client.tables) == ["project.f1.results"]
+    assert pl.from_arrow(client.tables["project.f1.results"]).sort("round", "Results_position").equals(wide)
+
+
+def test_tables_are_partitioned_by_season_and_clustered():
+    """Tables are created with one partition per season, clustered by round and driver."""
+    client = FakeBigQuery()
+    schema = [bigquery.SchemaField(name, kind) for name, kind in SCHEMA["laps"].items()]
+    ensure_table(client, "project.f1.laps", schema)
+
+    table = client.get_table("project.f1.laps")
+    assert table.range_partitioning.field == "season" and table.range_partitioning.range_.interval == 1
+    assert table.clustering_fields == ["round", "Laps_Timings_driverId"]
+    assert cluster_fields(["season", "round", "Constructor_constructorId"]) == ["round", "Constructor_constructorId"]
+
+
+def test_incremental_load_replaces_only_the_batch_rounds(tmp_path, monkeypatch):
+    """A batch replaces the rounds it holds; other rounds and seasons are kept, and the cost follows the batch."""
+    monkeypatch.chdir(tmp_path)
+    client = FakeBigQuery()
+    write_partitions(results(seasons=(2023, 2024), rounds=tuple(range(1, 25))), "results")
+    history = load_into_bigquery(scan_tables("prep", SCHEMA), "project", "f1", SCHEMA, client)
+    shutil.rmtree("prep")
+
+    rerun = results(rounds=(24,)).with_columns(pl.col("Results_position") + 10)
+    write_partitions(pl.concat([rerun, results(seasons=(2024,), rounds=(25,))]), "results")
+    batch = load_into_bigquery(scan_tables("prep", SCHEMA), "project", "f1", SCHEMA, client)
+
+    loaded = pl.from_arrow(client.tables["project.f1.results"])
+    assert loaded.height == 2 * 24 * 2 + 2
+    assert loaded.filter(round=24, season=2024)["Results_position"].sort().to_list() == [11, 12]
+    assert loaded.filter(round=24, season=2023)["Results_position"].sort().to_list() == [1, 2]
+    assert "WHERE target.season IN (2024)" in client.queries[-1]
+    assert "project.f1.results__staging" not in client.tables
+    assert batch["results"]["rows"] == 4 and batch["results"]["bytes"] < history["results"]["bytes"]
+    assert batch["results"]["bytes_processed"] < history["results"]["bytes_processed"] * 2 / 3
+
+
+def test_truncate_mode_replaces_the_table(prep_folder: Path):
+    """The truncate mode (full reload) loads straight into the table, with its partitioning."""
+    client = FakeBigQuery()
+    load_into_bigquery(scan_tables(str(prep_folder), SCHEMA), "project", "f1", SCHEMA, client, write_mode="truncate")
+
+    assert not client.queries and client.tables["project.f1.results"].num_rows == 4
+    assert client.configs["project.f1.results"].range_partitioning.field == "season"
+
+
+def test_empty_batch_leaves_the_table_untouched(prep_folder: Path):
+    """A batch without rows runs no merge script (no empty season filter) and keeps the table."""
+    client = FakeBigQuery()
+    load_into_bigquery(scan_tables(str(prep_folder), SCHEMA), "project", "f1", SCHEMA, client)
+    queries = len(client.queries)
+
+    empty = {"results": results().clear().lazy()}
+    stats = load_into_bigquery(empty, "project", "f1", SCHEMA, client)
+
+    assert len(client.queries) == queries and stats["results"]["rows"] == 0
+    assert client.tables["project.f1.results"].num_rows == 4
+    assert "project.f1.results__staging" not in client.tables
+
+
+def test_unpartitioned_table_is_only_rebuilt_on_request(prep_folder: Path):
+    """A table of an older loader is not replaced (even by a truncate load) unless a rebuild is asked for."""
+    client = FakeBigQuery()
+    client.create_table(bigquery.Table("project.f1.results"))
+
+    stats = load_into_bigquery(scan_tables(str(prep_folder), SCHEMA), "project", "f1", SCHEMA, client, write_mode="truncate")
+    assert not stats and not client.queries and "project.f1.results" not in client.tables
+
+    stats = load_into_bigquery(
+        scan_tables(str(prep_folder), SCHEMA), "project", "f1", SCHEMA, client, write_mode="truncate", rebuild_tables=True
+    )
+    assert stats["results"]["rows"] == 4
+    assert len(client.queries) == 1 and client.queries[0].startswith("CREATE OR REPLACE TABLE `project.f1.results`")
@@ -0,0 +1,307 @@
+import json
+import os
+from pathlib import Path
+import polars as pl
+import pyarrow.parquet as pq
+import pytest
+import utils.prep
+from utils.flatten import FlattenPlanner, column_tree, normalized_schema, widen
+from utils.prep import (
+    SCHEMA_PATH,
+    data_loading_concurrency,
+    flatten_table,
+    get_flatten_planner,
+    prep_file,
+    read_object_into_table,
+    read_untyped_table,
+    recursive_unnest_explode,
+    table_category,
+    upload_prep_file,
+)
+from utils.raw_format import PageWriter
+from utils.storage import LocalStorage
+
+TEST_DATA = str(Path("tests/ingestion_test_data").resolve())
+
+# ---------- Fixtures ----------
+
+@pytest.fixture(scope="module")
+def planner() -> FlattenPlanner:
+    """Flattening planner built from the schema used by the loader."""
+    return FlattenPlanner.from_file(SCHEMA_PATH)
+
+
+@pytest.fixture
+def prep_dir(tmp_path, monkeypatch) -> Path:
+    """Working directory holding a copy of the schema, as in the pipeline."""
+    schema = Path(SCHEMA_PATH).read_text()
+    monkeypatch.chdir(tmp_path)
+    Path(SCHEMA_PATH).parent.mkdir(parents=True)
+    Path(SCHEMA_PATH).write_text(schema)
+    return tmp_path
+
+
+def load_page(category: str) -> dict:
+    """API page stored in the test data of a category."""
+    with open(f"{TEST_DATA}/{category}.json") as file:
+        return json.load(file)
+
+
+def races(category: str) -> pl.DataFrame:
+    """Nested table of the races stored in the test data of a category."""
+    return pl.DataFrame(load_page(category)["MRData"]["RaceTable"]["Races"])
+
+
+def season_page(category: str, season: int) -> dict:
+    """API page of the test data of a category, moved to another season."""
+    page = load_page(category)
+    for race in page["MRData"]["RaceTable"]["Races"]:
+        race["season"] = str(season)
+    return page
+
+
+def laps_pages(races: int, pages_per_race: int = 2) -> list:
+    """Laps pages of several races, each race spread over several pages (as the API pages them)."""
+    pages = []
+    for race_round in range(1, races + 1):
+        for _ in range(pages_per_race):
+            page = load_page("laps")
+            page["MRData"]["RaceTable"]["Races"][0]["round"] = str(race_round)
+            pages.append(page)
+    return pages
+
+
+def write_raw(filename: str, pages: list) -> str:
+    """Writes API pages to a raw file of the format given by its extension."""
+    if filename.endswith(".json"):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        Path(filename).write_text(json.dumps(pages))
+        return filename
+    with PageWriter(filename) as writer:
+        for page in pages:
+            writer.write(page)
+        writer.commit()
+    return filename
+
+
+# ---------- Tests ----------
+
+def test_column_tree():
+    """Flat column names are split into their nesting levels."""
+    assert column_tree(["season", "Circuit_Location_lat", "Circuit_url"]) == {
+        "season": {}, "Circuit": {"Location": {"lat": {}}, "url": {}}
+    }
+
+
+@pytest.mark.parametrize("category", ["laps", "pitstops", "qualifying", "results", "sprint"])
+def test_flatten_plan_matches_recursive_unnest(planner: FlattenPlanner, category: str):
+    """The planned flattening returns the schema columns with the same rows as the recursion."""
+    df = races(category)
+    flat = planner.flatten(df, category)
+    assert flat.columns == list(planner.schema[category])
+    assert flat.equals(recursive_unnest_explode(df).select(flat.columns))
+
+
+def test_nested_lists_and_missing_fields(planner: FlattenPlanner):
+    """Lists of lists are exploded level by level; schema fields absent from the data are null."""
+    df = pl.DataFrame([{
+        "season": "2024", "round": "3",
+        "DriverStandings": [
+            {"position": "1", "Driver": {"driverId": "max_verstappen"},
+             "Constructors": [{"constructorId": "red_bull"}, {"constructorId": "alphatauri"}]},
+            {"position": "2", "Driver": {"driverId": "leclerc"},
+             "Constructors": [{"constructorId": "ferrari"}]},
+        ],
+    }])
+    flat = planner.flatten(df, "driverstandings")
+    assert flat.columns == list(planner.schema["driverstandings"])
+    assert flat["DriverStandings_Constructors_constructorId"].to_list() == ["red_bull", "alphatauri", "ferrari"]
+    assert flat["DriverStandings_Driver_driverId"].to_list() == ["max_verstappen", "max_verstappen", "leclerc"]
+    assert flat["DriverStandings_Driver_code"].null_count() == 3
+
+
+def test_plans_are_cached_per_category(planner: FlattenPlanner):
+    """A category is compiled once for a given input schema."""
+    df = races("laps")
+    planner.flatten(df, "laps")
+    compiled = len(planner.plans)
+    planner.flatten(df, "laps")
+    assert len(planner.plans) == compiled
+
+
+def test_flatten_table_uses_the_file_category():
+    """The category comes from the raw folder; unknown categories fall back to the recursion."""
+    assert table_category("raw/laps/2024_laps.ndjson.gz") == "laps"
+    assert table_category("raw/f1_schedule.json") == "schedule"
+    df = races("pitstops")
+    assert flatten_table(df, "raw/other/2024_other.json").equals(recursive_unnest_explode(df))
+
+
+@pytest.mark.parametrize("raw_format", ["ndjson.gz", "json"])
+def test_lazy_prep_matches_eager_prep(prep_dir: Path, raw_format: str):
+    """The streaming lazy pipeline writes the same table as the eager one and uploads it."""
+    page = load_page("laps")
+    storage = LocalStorage("store")
+
+    outputs = {}
+    for lazy in (False, True):
+        raw = write_raw(f"raw/laps/2024_laps.{raw_format}", [page, page])
+        filenames, _ = prep_file(raw, lazy=lazy)
+        upload_prep_file(storage, filenames, raw)
+        assert not Path(raw).exists()
+        outputs[lazy] = pl.read_parquet("prep/category=laps/season=2024/round=1/part-0.parquet")
+        assert pl.read_parquet("store/prep/category=laps/season=2024/round=1/part-0.parquet").equals(outputs[lazy])
+
+    assert outputs[True].equals(outputs[False])
+    assert outputs[True].height == 60
+
+
+def test_prep_runs_in_process_pool_and_reports_failures(prep_dir: Path, monkeypatch):
+    """Files are prepared in worker processes; a broken file is reported, the others uploaded."""
+    monkeypatch.delenv("POLARS_MAX_THREADS", raising=False)
+    files = [
+        write_raw(f"raw/results/{season}_results.ndjson", [season_page("results", season)]) for season in (2023, 2024)
+    ]
+    Path("raw/results/2022_results.ndjson").write_text('{"MRData": truncated')
+    storage = LocalStorage("store")
+
+    summary = data_loading_concurrency(
+        storage, files + ["raw/results/2022_results.ndjson"], process_workers=2, upload_workers=2
+    )
+    assert (summary["files"], summary["failed"]) == (2, 1)
+    assert list(summary["failures"]) == ["raw/results/2022_results.ndjson"] and summary["rejections"] == {}
+    assert storage.list_objects("prep/") == [
+        f"prep/category=results/season={season}/round={race_round}/part-0.parquet"
+        for season in (2023, 2024)
+        for race_round in (1, 2)
+    ]
+    assert Path("raw/results/2022_results.ndjson").exists() and not Path(files[0]).exists()
+    assert "POLARS_MAX_THREADS" not in os.environ  # only set in the workers
+
+
+def test_upload_deletes_stale_round_parts(prep_dir: Path):
+    """Part files of a round left by an earlier prep are deleted when the round is uploaded again."""
+    storage = LocalStorage("store")
+    stale = "prep/category=laps/season=2024/round=1/part-1.parquet"
+    for key in (stale, "prep/category=laps/season=2024/round=2/part-1.parquet", "prep/category=laps/season=2024/part-0.parquet"):
+        storage.write_object(key, b"old")
+
+    raw = write_raw("raw/laps/2024_laps.ndjson", laps_pages(races=1))
+    filenames, _ = prep_file(raw)
+    upload_prep_file(storage, filenames, raw)
+    assert storage.list_objects("prep/") == [
+        "prep/category=laps/season=2024/part-0.parquet",
+        "prep/category=laps/season=2024/round=1/part-0.parquet",
+        "prep/category=laps/season=2024/round=2/part-1.parquet",
+    ]
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_parquet_encoding_options(prep_dir: Path, lazy: bool):
+    """Prep files are encoded once with the configured codec and row-group size."""
+    page = load_page("laps")
+    raw = write_raw("raw/laps/2024_laps.ndjson", [page, page])
+
+    filenames, _ = prep_file(
+        raw, lazy=lazy, parquet_options={"compression": "snappy", "compression_level": None, "row_group_size": 20}
+    )
+    assert filenames == ["prep/category=laps/season=2024/round=1/part-0.parquet"]
+    metadata = pq.ParquetFile(filenames[0]).metadata
+    assert metadata.num_rows == 60
+    assert metadata.row_group(0).column(0).compression == "SNAPPY"
+    assert metadata.num_row_groups >= 3
+
+
+def test_typed_decoding_matches_untyped_decoding(prep_dir: Path):
+    """Pages decoded with the explicit schema give the same flat table; empty pages add no rows."""
+    page = load_page("results")
+    empty = {"MRData": {"total": "0", "RaceTable": {"season": "2024", "Races": []}}}
+    raw = write_raw("raw/results/2024_results.ndjson.gz", [page, empty, page])
+
+    table, _ = read_object_into_table(raw)
+    assert table.schema["Results"] == get_flatten_planner().row_dtype("results").to_schema()["Results"]
+    assert flatten_table(table, raw).equals(flatten_table(read_untyped_table(raw), raw))
+
+
+def test_typed_decoding_of_standings(prep_dir: Path):
+    """Standings pages are decoded from StandingsTable.StandingsLists."""
+    page = {"MRData": {"total": "1", "StandingsTable": {"season": "2024", "StandingsLists": [{
+        "season": "2024", "round": "3",
+        "ConstructorStandings": [
+            {"position": "1", "points": "120", "Constructor": {"constructorId": "red_bull", "name": "Red Bull"}}
+        ],
+    }]}}}
+    raw = write_raw("raw/constructorstandings/2024_constructorstandings.json", [page])
+    flat = flatten_table(read_object_into_table(raw)[0], raw)
+    assert flat.select("round", "ConstructorStandings_Constructor_constructorId").rows() == [("3", "red_bull")]
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_normalized_prep_joins_back_to_wide_prep(prep_dir: Path, lazy: bool):
+    """Normalized prep writes a slim race table and one race header row; joined back, they give the wide table."""
+    page = load_page("laps")
+    raw = write_raw("raw/laps/2024_laps.ndjson", [page, page])
+    wide = pl.read_parquet(prep_file(raw, lazy=lazy)[0][0])
+    wide_bytes = Path("prep/category=laps/season=2024/round=1/part-0.parquet").stat().st_size
+
+    (laps, races), _ = prep_file(raw, lazy=lazy, normalize=True)
+    assert races == "prep/category=races/season=2024/round=1/part-0.parquet"
+    slim, header = pl.read_parquet(laps), pl.read_parquet(races)
+    assert slim.columns == list(normalized_schema(get_flatten_planner().schema)["laps"])
+    assert slim.schema["Laps_Timings_driverId"] == pl.String and header.height == 1
+    assert Path(laps).stat().st_size < wide_bytes / 2
+
+    assert widen(slim, header, wide.columns).equals(wide)
+
+
+def test_normalized_schema_keeps_other_tables():
+    """Only the race tables lose their header; schedule and standings are unchanged."""
+    schema = get_flatten_planner().schema
+    normalized = normalized_schema(schema)
+    assert list(normalized["races"])[:4] == ["season", "round", "url", "raceName"]
+    assert "Circuit_circuitId" not in normalized["results"] and "Results_Time_time" in normalized["results"]
+    assert normalized["schedule"] == schema["schedule"]
+    assert normalized["driverstandings"] == schema["driverstandings"]
+
+
+@pytest.mark.parametrize("normalize", [False, True])
+def test_chunked_prep_matches_eager_prep(prep_dir: Path, normalize: bool):
+    """Pages prepared chunk by chunk give the same round files as the whole file prepared at once."""
+    raw = write_raw("raw/laps/2024_laps.ndjson.gz", laps_pages(races=3))
+    expected = {filename: pl.read_parquet(filename) for filename in prep_file(raw, normalize=normalize)[0]}
+
+    filenames, _ = prep_file(raw, normalize=normalize, chunk_mb=0.001)  # one page per chunk
+    assert sorted(filenames) == sorted(expected)
+    for filename in filenames:
+        assert pl.read_parquet(filename).equals(expected[filename]), filename
+    assert not list(Path("prep").rglob("*.part"))
+
+
+def test_chunked_prep_memory_does_not_grow_with_the_file(prep_dir: Path, monkeypatch):
+    """The largest table held in memory is one chunk, whatever the number of races in the file."""
+    flatten_table = utils.prep.flatten_table
+    heights = []
+    monkeypatch.setattr(
+        utils.prep, "flatten_table", lambda **kw: heights.append(kw["df"].height) or flatten_table(**kw)
+    )
+    largest = {}
+    for races in (3, 9):
+        heights.clear()
+        raw = write_raw(f"raw/laps/{races}_laps.ndjson", laps_pages(races))
+        assert len(prep_file(raw, chunk_mb=0.01)[0]) == races
+        largest[races] = max(heights)
+    assert largest[3] == largest[9]
+
+
+def test_prep_casts_to_schema_types_and_counts_rejections(prep_dir: Path):
+    """Prep files are typed as in data_schema.json; values that cannot be cast are null and counted."""
+    page = load_page("results")
+    page["MRData"]["RaceTable"]["Races"][0]["Results"][0]["position"] = "DNF"
+    raw = write_raw("raw/results/2024_results.ndjson", [page])
+
+    filenames, rejections = prep_file(raw)
+    assert rejections == {"results": {"Results_position": 1}}
+    results = pl.read_parquet(filenames[0])
+    types = {column: results.schema[column] for column in ("season", "Circuit_Location_lat", "date", "Results_grid", "url")}
+    assert types == {"season": pl.Int64, "Circuit_Location_lat": pl.Float64, "date": pl.Date, "Results_grid": pl.Int64, "url": pl.String}
+    assert results["Results_position"].null_count() == 1
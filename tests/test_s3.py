@@ -0,0 +1,239 @@
+from utils.s3_client import S3Client
+from utils.s3_utils import upload_results, upload_file, read_object_into_json, connect_storage
+from utils.storage import LocalStorage, Storage
+from utils.raw_format import PageWriter, check_raw_file
+from time import monotonic
+import asyncio
+import hashlib
+import threading
+from pathlib import Path
+import boto3
+import pytest
+
+# ---------- Fixtures ----------
+
+@pytest.fixture
+def raw_folder(tmp_path, monkeypatch) -> Path:
+    """
+    Working directory holding a raw/ folder of 8 small landing files and a leftover partial file.
+    Object keys are relative paths, as in the pipeline.
+    """
+    monkeypatch.chdir(tmp_path)
+    for season in range(2017, 2025):
+        path = Path(f"raw/laps/{season}_laps.ndjson.gz")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(bytes(1024))
+    Path("raw/laps/2025_laps.ndjson.gz.part").write_bytes(b"partial")
+    return Path("raw")
+
+
+# ---------- Tests ----------
+
+def test_connection_pool_matches_upload_concurrency(monkeypatch):
+    """The boto3 connection pool is sized for every upload worker's multipart parts."""
+    captured = {}
+    monkeypatch.setattr(boto3, "client", lambda *args, **kwargs: captured.update(kwargs))
+    S3Client(bucket_name="bucket", upload_workers=16, multipart_concurrency=4).connect()
+    assert captured["config"].max_pool_connections == 64
+
+
+def test_uploads_run_concurrently(s3_client: S3Client, fake_s3, raw_folder: Path):
+    """Files are uploaded in parallel, with their encoding, and partial files are skipped."""
+    fake_s3.upload_delay = 0.1
+    start = monotonic()
+    summary = upload_results(s3_client, str(raw_folder), validate=False)
+    elapsed = monotonic() - start
+
+    assert elapsed < 0.5  # 8 uploads of 0.1s each, run on 8 workers
+    assert (summary["files"], summary["failed"], summary["bytes"]) == (8, 0, 8 * 1024)
+    keys = {key for _, key in fake_s3.calls}
+    assert "raw/laps/2024_laps.ndjson.gz" in keys and not any(k.endswith(".part") for k in keys)
+    assert fake_s3.headers["raw/laps/2024_laps.ndjson.gz"]["ContentEncoding"] == "gzip"
+
+
+def test_large_files_use_multipart_config(s3_client: S3Client, fake_s3, tmp_path, monkeypatch):
+    """Uploads go through the transfer manager with the configured multipart threshold."""
+    configs = []
+    upload_file = fake_s3.upload_file
+    monkeypatch.setattr(fake_s3, "upload_file", lambda **kw: configs.append(kw["Config"]) or upload_file(**kw))
+    path = tmp_path / "big.parquet"
+    path.write_bytes(bytes(2048))
+    assert s3_client.upload_file(str(path), "prep/big.parquet") == 2048
+    assert configs[0].multipart_threshold == 8 * 1024 * 1024
+
+
+def test_raw_files_are_uploaded_without_parsing(s3_client: S3Client, fake_s3, tmp_path, monkeypatch):
+    """A legacy .json file is streamed as it is (no json.loads/dumps round trip)."""
+    monkeypatch.chdir(tmp_path)
+    path = Path("raw/results/2024_results.json")
+    path.parent.mkdir(parents=True)
+    body = b'[{"MRData": {"total": "1"}},   {"MRData": {"total": "1"}}]'
+    path.write_bytes(body)
+    monkeypatch.setattr("json.loads", lambda *a, **kw: pytest.fail("the file was parsed"))
+
+    assert upload_file(s3_client, str(path), validate=True) == len(body)
+    assert (fake_s3.root / "f1-test-bucket" / path).read_bytes() == body
+    assert fake_s3.headers[str(path)]["ContentType"] == "application/json"
+
+
+def test_check_raw_file(tmp_path):
+    """The validity check catches truncated and badly framed files."""
+    good = tmp_path / "good.ndjson.gz"
+    with PageWriter(str(good)) as writer:
+        writer.write({"MRData": {"total": "1"}})
+        writer.commit()
+    truncated = tmp_path / "truncated.ndjson.gz"
+    truncated.write_bytes(good.read_bytes()[:-6])
+    array = tmp_path / "array.json"
+    array.write_text('[{"MRData": {}}]\n')
+    cut = tmp_path / "cut.json"
+    cut.write_text('[{"MRData": {}')
+
+    assert check_raw_file(str(good)) and check_raw_file(str(array))
+    assert not check_raw_file(str(truncated)) and not check_raw_file(str(cut))
+
+
+def test_invalid_files_are_not_uploaded(s3_client: S3Client, fake_s3, raw_folder: Path):
+    """Files failing the validity check are reported as failed and never reach S3."""
+    summary = upload_results(s3_client, str(raw_folder), validate=True)
+    assert (summary["files"], summary["failed"]) == (0, 8)  # zero bytes are not gzip
+    assert fake_s3.calls == []
+
+
+def test_unchanged_files_are_not_uploaded_again(s3_client: S3Client, fake_s3, raw_folder: Path):
+    """A second run only sends the files whose content changed, from a single listing."""
+    upload_results(s3_client, str(raw_folder), validate=False)
+    Path("raw/laps/2024_laps.ndjson.gz").write_bytes(bytes(2048))
+    fake_s3.calls.clear()
+
+    summary = upload_results(s3_client, str(raw_folder), validate=False)
+    assert (summary["files"], summary["skipped"], summary["bytes_saved"]) == (1, 7, 7 * 1024)
+    assert fake_s3.calls == [("upload_file", "raw/laps/2024_laps.ndjson.gz")]
+    assert s3_client.transfer_stats["skipped"] == 7
+
+
+def test_etag_listing_stays_in_the_uploaded_folder(tmp_path, monkeypatch):
+    """Unchanged files are detected from a listing of their folder only, not of sibling folders sharing its name."""
+    monkeypatch.chdir(tmp_path)
+    storage = LocalStorage("store")
+    storage.write_object("raw/laps_old/2023_laps.ndjson", b"old")
+    path = Path("raw/laps/2024_laps.ndjson")
+    path.parent.mkdir(parents=True)
+    path.write_text("{}\n")
+
+    prefixes = []
+    load_etags = storage.load_etags
+    monkeypatch.setattr(storage, "load_etags", lambda prefix: prefixes.append(prefix) or load_etags(prefix))
+
+    assert storage.upload_files([str(path)], skip_unchanged=True)["files"] == 1
+    assert storage.upload_files([str(path)], skip_unchanged=True)["skipped"] == 1
+    assert prefixes == ["raw/laps/", "raw/laps/"]
+    assert "raw/laps_old/2023_laps.ndjson" not in storage.remote_etags
+
+
+def test_write_object_skips_identical_content(s3_client: S3Client, fake_s3):
+    """write_object compares with the listed ETags and only PUTs changed content."""
+    s3_client.write_object("prep/results/2024_results.parquet", b"parquet")
+    s3_client.load_etags("prep/")
+    assert not s3_client.write_object("prep/results/2024_results.parquet", b"parquet", skip_unchanged=True)
+    assert s3_client.write_object("prep/results/2024_results.parquet", b"changed", skip_unchanged=True)
+    assert [name for name, _ in fake_s3.calls] == ["put_object", "put_object"]
+
+
+def test_multipart_etag(tmp_path):
+    """Files above the multipart threshold get the ETag S3 computes for multipart uploads."""
+    client = S3Client(bucket_name="bucket", multipart_threshold_mb=1, multipart_chunksize_mb=1)
+    path = tmp_path / "big.parquet"
+    data = bytes(range(256)) * 4096 * 3  # 3 MB -> 3 parts
+    path.write_bytes(data)
+    parts = b"".join(hashlib.md5(data[i:i + 1024 * 1024]).digest() for i in range(0, len(data), 1024 * 1024))
+    assert client.file_etag(str(path)) == f'"{hashlib.md5(parts).hexdigest()}-3"'
+
+    small = tmp_path / "small.json"
+    small.write_bytes(b"[]")
+    assert client.file_etag(str(small)) == S3Client.content_etag(b"[]")
+
+
+def test_gzip_raw_files_are_reproducible(tmp_path):
+    """Writing the same pages twice gives byte-identical gzip files (same ETag)."""
+    contents = []
+    for run in ("first", "second"):
+        path = tmp_path / run / "2024_laps.ndjson.gz"
+        with PageWriter(str(path)) as writer:
+            writer.write({"MRData": {"total": "1"}})
+            writer.commit()
+        contents.append(path.read_bytes())
+    assert contents[0] == contents[1]
+
+
+def test_read_cache_revalidates_with_etag(fake_s3, tmp_path):
+    """Cached objects are revalidated with If-None-Match and only downloaded again when changed."""
+    client = S3Client(bucket_name="f1-test-bucket", read_cache_directory=str(tmp_path / "cache"))
+    client.s3_client = fake_s3
+    client.write_object("raw/f1_schedule.json", b'[{"season": "2024"}]')
+
+    assert read_object_into_json(client, "raw/f1_schedule.json") == [{"season": "2024"}]
+    assert read_object_into_json(client, "raw/f1_schedule.json") == [{"season": "2024"}]
+    assert client.read_stats == {"downloaded": 1, "revalidated": 1}
+
+    client.write_object("raw/f1_schedule.json", b'[{"season": "2025"}]')
+    assert client.read_object("raw/f1_schedule.json") == b'[{"season": "2025"}]'
+    assert client.read_stats == {"downloaded": 2, "revalidated": 1}
+    assert client.read_object("raw/missing.json") is None
+
+
+def test_local_storage_backend(tmp_path, monkeypatch):
+    """The local backend runs the same upload, dedupe and bulk operations without a bucket."""
+    monkeypatch.chdir(tmp_path)
+    storage = connect_storage({}, {"storage": {"backend": "local", "local_root": "store"}})
+    assert isinstance(storage, LocalStorage)
+
+    path = Path("raw/results/2024_results.ndjson")
+    path.parent.mkdir(parents=True)
+    path.write_text('{"MRData": {"total": "1"}}\n')
+    assert upload_results(storage, "raw")["files"] == 1
+    assert upload_results(storage, "raw")["skipped"] == 1
+    assert Path("store/raw/results/2024_results.ndjson").read_text() == path.read_text()
+
+    written = storage.write_objects({"prep/a.parquet": b"a", "prep/b.parquet": b"b"})
+    assert written == {"prep/a.parquet": True, "prep/b.parquet": True}
+    assert storage.read_objects(["prep/a.parquet", "prep/missing"]) == {"prep/a.parquet": b"a", "prep/missing": None}
+    assert storage.list_objects_many(["prep/", "raw/"]) == {
+        "prep/": ["prep/a.parquet", "prep/b.parquet"],
+        "raw/": ["raw/results/2024_results.ndjson"],
+    }
+
+
+def test_bulk_reads_run_concurrently(s3_client: S3Client, fake_s3):
+    """Bulk operations of the S3 backend overlap their requests."""
+    s3_client.write_objects({f"raw/{i}.json": b"[]" for i in range(8)})
+    get_object = fake_s3.get_object
+    fake_s3.get_object = lambda **kw: threading.Event().wait(0.1) or get_object(**kw)
+    start = monotonic()
+    contents = s3_client.read_objects([f"raw/{i}.json" for i in range(8)])
+    assert monotonic() - start < 0.5
+    assert set(contents.values()) == {b"[]"}
+
+
+def test_incomplete_backend_cannot_be_instantiated():
+    """A backend missing one of the storage operations fails when it is created, not when called."""
+    class ReadOnly(Storage):
+        def read_object(self, object_key):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnly()
+
+
+def test_bulk_operations_inside_a_running_event_loop(tmp_path):
+    """The blocking bulk methods work when called from async code, and count concurrent reads exactly."""
+    storage = LocalStorage(str(tmp_path / "store"), max_workers=8)
+    keys = [f"raw/{i}.json" for i in range(64)]
+
+    async def read_from_async_code():
+        storage.write_objects({key: b"[]" for key in keys})
+        return storage.read_objects(keys)
+
+    contents = asyncio.run(read_from_async_code())
+    assert set(contents.values()) == {b"[]"}
+    assert storage.read_stats["downloaded"] == 64
@@ -0,0 +1,480 @@
+import logging
+import os
+import re
+from io import BytesIO
+from math import ceil
+from pathlib import Path
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils.flatten import FlattenPlanner, encode_ids
+from utils.storage import Storage
+
+# Parquet encoding of the prep files, overridden by the `prep.parquet` section of settings.yaml
+PARQUET_OPTIONS = {"compression": "zstd", "compression_level": 3, "row_group_size": None, "statistics": True}
+
+# Streaming collect: `streaming=True` was replaced by `engine="streaming"` (deprecated in Polars 1.25, removed in 2.0)
+STREAMING_COLLECT = (
+    {"streaming": True} if tuple(map(int, pl.__version__.split(".")[:2])) < (1, 25) else {"engine": "streaming"}
+)
+
+PARTITION_SEGMENT = re.compile(r"^(category|season|round)=(.+)$")
+
+
+def partition_key(category: str, season: str, race_round: str | None = None, part: int = 0, root: str = "prep") -> str:
+    """
+    Builds the key of a file of the partitioned prep dataset.
+
+    Args:
+        category (str): The table (e.g. "laps").
+        season (str): The season.
+        race_round (str, optional): The round; None for the compacted files of a whole season.
+        part (int): The index of the file in its partition.
+        root (str): The root folder of the dataset.
+
+    Returns:
+        str: "<root>/category=<c>/season=<s>/round=<r>/part-<n>.parquet", without the round
+        folder for compacted season files.
+    """
+    folder = f"{root}/category={category}/season={season}"
+    if race_round is not None:
+        folder += f"/round={race_round}"
+    return f"{folder}/part-{part}.parquet"
+
+
+def parse_partition(key: str) -> dict:
+    """
+    Reads the partition values of a dataset file from its key.
+
+    Args:
+        key (str): The key (or local path) of the file.
+
+    Returns:
+        dict: The "category", "season" and "round" values found in the key (round is
+        missing for compacted season files, everything is missing for legacy keys).
+    """
+    return dict(
+        match.groups() for match in map(PARTITION_SEGMENT.match, Path(key).parts) if match
+    )
+
+
+def encode_parquet(df: pl.DataFrame, parquet_options: dict = None) -> bytes:
+    """
+    Encodes a table as Parquet bytes.
+
+    Args:
+        df (pl.DataFrame): The table.
+        parquet_options (dict, optional): Codec, compression level, row-group size and statistics.
+
+    Returns:
+        bytes: The Parquet file.
+    """
+    buffer = BytesIO()
+    df.write_parquet(buffer, **{**PARQUET_OPTIONS, **(parquet_options or {})})
+    return buffer.getvalue()
+
+
+def round_partitions(df: pl.DataFrame) -> list:
+    """
+    Splits a table into its (season, round) partitions.
+
+    Args:
+        df (pl.DataFrame): The table (with "season" and "round" columns).
+
+    Returns:
+        list: (season, round, rows) tuples, sorted by season and round.
+    """
+    partitions = df.partition_by(["season", "round"], as_dict=True, maintain_order=True)
+    return sorted(
+        ((str(season), str(race_round), rows) for (season, race_round), rows in partitions.items()),
+        key=lambda partition: (int(partition[0]), int(partition[1])),
+    )
+
+
+def write_partitions(df: pl.DataFrame | pl.LazyFrame, category: str, root: str = "prep", parquet_options: dict = None) -> list:
+    """
+    Writes a table as local round partitions of the prep dataset.
+
+    Args:
+        df (pl.DataFrame or pl.LazyFrame): The flat table. A lazy table is first streamed to
+            a temporary file, then each partition is streamed out of it, so memory stays
+            bounded by a chunk.
+        category (str): The table name.
+        root (str): The local root folder of the dataset.
+        parquet_options (dict, optional): Codec, compression level, row-group size and statistics.
+
+    Returns:
+        list: The paths of the written files (one per round).
+    """
+    options = {**PARQUET_OPTIONS, **(parquet_options or {})}
+    filenames = []
+    if isinstance(df, pl.LazyFrame):
+        staging = Path(root) / f"category={category}" / f".staging-{os.getpid()}-{id(df)}.parquet"
+        staging.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            sink_parquet(df, staging, options)
+            keys = pl.scan_parquet(staging).select("season", "round").unique(maintain_order=True).collect()
+            for season, race_round in sorted(keys.rows(), key=lambda key: (int(key[0]), int(key[1]))):
+                rows = pl.scan_parquet(staging).filter(
+                    (pl.col("season") == season) & (pl.col("round") == race_round)
+                )
+                filenames.append(_write_file(rows, partition_key(category, season, race_round, root=root), options))
+        finally:
+            staging.unlink(missing_ok=True)
+        return filenames
+
+    for season, race_round, rows in round_partitions(df):
+        filenames.append(_write_file(rows, partition_key(category, season, race_round, root=root), options))
+    return filenames
+
+
+def sink_parquet(lf: pl.LazyFrame, filename: str | Path, options: dict) -> None:
+    """
+    Streams a lazy query to a Parquet file, collecting it when the streaming sink cannot run it.
+
+    The streaming engine of Polars 1.20 (the locked version) rejects some plans, among them
+    the scan -> explode -> unnest of the raw JSON pages ("not yet supported in standard
+    engine"); they are then collected with the streaming engine and written at once, so the
+    file is the same but memory is no longer bounded by a chunk. Other errors are raised.
+
+    Args:
+        lf (pl.LazyFrame): The query.
+        filename (str or Path): The path of the file.
+        options (dict): The Parquet options.
+    """
+    try:
+        lf.sink_parquet(filename, **options)
+    except pl.exceptions.InvalidOperationError:
+        Path(filename).unlink(missing_ok=True)
+        lf.collect(**STREAMING_COLLECT).write_parquet(filename, **options)
+
+
+def _write_file(rows: pl.DataFrame | pl.LazyFrame, filename: str, options: dict) -> str:
+    """
+    Writes a partition file atomically: several prep processes may write the same partition
+    (e.g. the race header of a round, identical in every race table).
+
+    Args:
+        rows (pl.DataFrame or pl.LazyFrame): The rows of the partition.
+        filename (str): The path of the file.
+        options (dict): The Parquet options.
+
+    Returns:
+        str: The path of the file.
+    """
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    temporary = f"{filename}.{os.getpid()}.part"
+    if isinstance(rows, pl.LazyFrame):
+        sink_parquet(rows, temporary, options)
+    else:
+        rows.write_parquet(temporary, **options)
+    os.replace(temporary, filename)
+    return filename
+
+
+class PartitionWriter:
+
+    def __init__(self, category: str, root: str = "prep", parquet_options: dict = None) -> None:
+        """
+        Initialize a writer appending chunks of a table to its local round partitions.
+
+        Each chunk is split by (season, round) and appended as row groups to the file of
+        its round: a file of any size is written while only one chunk is held in memory.
+        API pages come in round order, so the file of a round is closed as soon as a chunk
+        no longer holds it; should the round come back, its rows go to the next part file.
+        Files are written under a temporary name and moved to their final path once
+        closed; leaving the context on an error removes the files still open.
+
+        Args:
+            category (str): The table name.
+            root (str): The local root folder of the dataset.
+            parquet_options (dict, optional): Codec, compression level, row-group size and statistics.
+        """
+        self.category = category
+        self.root = root
+        self.options = {**PARQUET_OPTIONS, **(parquet_options or {})}
+        self.writers = {}
+        self.parts = {}
+        self.filenames = []
+
+    def __enter__(self) -> "PartitionWriter":
+        return self
+
+    def write(self, df: pl.DataFrame) -> None:
+        """
+        Appends a chunk of rows to the files of its rounds.
+
+        Args:
+            df (pl.DataFrame): The rows (with "season" and "round" columns).
+        """
+        partitions = round_partitions(df)
+        for key in set(self.writers) - {(season, race_round) for season, race_round, _ in partitions}:
+            self._close(key)
+        for season, race_round, rows in partitions:
+            table = rows.to_arrow()
+            if (season, race_round) not in self.writers:
+                part = self.parts.get((season, race_round), -1) + 1
+                filename = partition_key(self.category, season, race_round, part=part, root=self.root)
+                Path(filename).parent.mkdir(parents=True, exist_ok=True)
+                self.parts[(season, race_round)] = part
+                self.writers[(season, race_round)] = (filename, pq.ParquetWriter(
+                    f"{filename}.{os.getpid()}.part", table.schema, **self._arrow_options()
+                ))
+            writer = self.writers[(season, race_round)][1]
+            writer.write_table(table.cast(writer.schema), row_group_size=self.options["row_group_size"])
+
+    def _close(self, key: tuple) -> None:
+        filename, writer = self.writers.pop(key)
+        writer.close()
+        os.replace(writer.where, filename)
+        self.filenames.append(filename)
+
+    def _arrow_options(self) -> dict:
+        # the Polars Parquet options, in pyarrow terms
+        codec = self.options["compression"]
+        if codec == "uncompressed":
+            return {"compression": "none", "write_statistics": bool(self.options["statistics"])}
+        level = self.options["compression_level"] if pa.Codec.supports_compression_level(codec) else None
+        return {"compression": codec, "compression_level": level, "write_statistics": bool(self.options["statistics"])}
+
+    def close(self) -> list:
+        """
+        Closes the files still open.
+
+        Returns:
+            list: The paths of the written files (one per round, unless a round came back).
+        """
+        for key in list(self.writers):
+            self._close(key)
+        return self.filenames
+
+    def __exit__(self, *exc) -> bool:
+        if exc[0] is not None:
+            for _, writer in self.writers.values():
+                writer.close()
+                Path(writer.where).unlink(missing_ok=True)
+        return False
+
+
+class PartitionedDataset:
+
+    def __init__(
+        self,
+        storage: Storage,
+        root: str = "prep",
+        small_file_mb: float = 16,
+        target_file_mb: float = 128,
+        parquet_options: dict = None,
+        planner: FlattenPlanner = None,
+    ) -> None:
+        """
+        Initialize the partitioned prep dataset stored in a storage backend.
+
+        Files are laid out as `category=…/season=…/round=…/part-N.parquet`: prep rewrites the
+        rounds it processed, and readers prune by listing only the partitions they need.
+        The partition values are also kept as columns inside the files.
+
+        Most rounds are small (a few kB of results or standings), so `compact` merges the
+        round files of a season into right-sized season files
+        (`category=…/season=…/part-N.parquet`). A round rewritten after its season was
+        compacted overrides the compacted rows until the next compaction merges it back.
+
+        Args:
+            storage (Storage): The storage holding the dataset.
+            root (str): The root folder of the dataset.
+            small_file_mb (float): Round files whose mean size is below this are compacted.
+            target_file_mb (float): Approximate size of the compacted files.
+            parquet_options (dict, optional): Encoding of the compacted files.
+            planner (FlattenPlanner, optional): Casts the files written before prep typed
+                its output to the schema types, as they are read, compacted or migrated.
+        """
+        self.storage = storage
+        self.root = root
+        self.small_file_bytes = small_file_mb * 1024 * 1024
+        self.target_file_bytes = target_file_mb * 1024 * 1024
+        self.parquet_options = parquet_options
+        self.planner = planner
+
+    def _table(self, data: bytes, category: str) -> pl.DataFrame:
+        """
+        Decodes a dataset file, cast to the schema types of its category.
+
+        Args:
+            data (bytes): The Parquet file.
+            category (str): The table.
+
+        Returns:
+            pl.DataFrame: The rows.
+        """
+        table = pl.read_parquet(BytesIO(data))
+        if self.planner and category in self.planner.schema:
+            table = self.planner.cast(table, category)
+        return table
+
+    def files(self, category: str | None = None, seasons: list = None, rounds: list = None) -> list:
+        """
+        Lists the dataset files, pruned by category, season and round.
+
+        Args:
+            category (str, optional): The table; None for every table.
+            seasons (list, optional): The seasons to keep; None for all.
+            rounds (list, optional): The rounds to keep; None for all. Compacted season
+                files hold every round and are kept.
+
+        Returns:
+            list: The keys of the matching files.
+        """
+        prefix = f"{self.root}/category={category}/" if category else f"{self.root}/"
+        seasons = {str(season) for season in seasons} if seasons else None
+        rounds = {str(race_round) for race_round in rounds} if rounds else None
+        keys = []
+        for key in self.storage.list_objects(prefix):
+            partition = parse_partition(key)
+            if "season" not in partition or not key.endswith(".parquet"):
+                continue
+            if seasons and partition["season"] not in seasons:
+                continue
+            if rounds and "round" in partition and partition["round"] not in rounds:
+                continue
+            keys.append(key)
+        return keys
+
+    def read(self, category: str, seasons: list = None, rounds: list = None, categorical_ids: bool = False) -> pl.DataFrame:
+        """
+        Reads a table from the dataset, reading only the partitions needed.
+
+        Args:
+            category (str): The table.
+            seasons (list, optional): The seasons to read; None for all.
+            rounds (list, optional): The rounds to read; None for all.
+            categorical_ids (bool, optional): Cast the id columns to Categorical once the files
+                are merged (see `utils.flatten.encode_ids`). Defaults to False.
+
+        Returns:
+            pl.DataFrame: The rows, where round files override the compacted rows of their round.
+        """
+        keys = self.files(category, seasons, rounds)
+        contents = self.storage.read_objects(keys)
+        table = self._merge({key: self._table(contents[key], category) for key in keys}, rounds)
+        return encode_ids(table) if categorical_ids else table
+
+    @staticmethod
+    def _merge(tables: dict, rounds: list = None) -> pl.DataFrame:
+        """
+        Merges the files of a table, dropping the compacted rows superseded by round files.
+
+        Args:
+            tables (dict): The table of each file key.
+            rounds (list, optional): The rounds to keep; None for all.
+
+        Returns:
+            pl.DataFrame: The merged rows, sorted by season and round.
+        """
+        rewritten = [
+            f"{partition['season']}/{partition['round']}"
+            for partition in map(parse_partition, tables)
+            if "round" in partition
+        ]
+        frames = []
+        for key, table in tables.items():
+            if rewritten and "round" not in parse_partition(key):
+                table = table.filter(
+                    ~pl.concat_str("season", "round", separator="/").is_in(rewritten)
+                )
+            frames.append(table)
+        if not frames:
+            return pl.DataFrame()
+        merged = pl.concat(frames, how="diagonal_relaxed")
+        if rounds:
+            merged = merged.filter(pl.col("round").cast(pl.String).is_in([str(r) for r in rounds]))
+        return merged.sort(pl.col("season").cast(pl.Int64), pl.col("round").cast(pl.Int64), maintain_order=True)
+
+    def compact(self, category: str | None = None) -> dict:
+        """
+        Merges the small round files of each season into right-sized season files.
+
+        A season is compacted when the mean size of its round files is below
+        `small_file_mb`, or when it was already compacted and rounds were rewritten since.
+        New files are written before the merged ones are deleted.
+
+        Args:
+            category (str, optional): The table to compact; None for every table.
+
+        Returns:
+            dict: The number of seasons compacted, of files merged and of files written.
+        """
+        prefix = f"{self.root}/category={category}/" if category else f"{self.root}/"
+        sizes = self.storage.object_sizes(prefix)
+        seasons = {}
+        for key, size in sizes.items():
+            partition = parse_partition(key)
+            if "season" in partition and key.endswith(".parquet"):
+                seasons.setdefault((partition["category"], partition["season"]), {})[key] = size
+
+        summary = {"seasons": 0, "merged": 0, "written": 0}
+        for (table, season), files in sorted(seasons.items()):
+            round_files = [key for key in files if "round" in parse_partition(key)]
+            season_files = [key for key in files if key not in round_files]
+            if not round_files:
+                continue
+            mean_size = sum(files[key] for key in round_files) / len(round_files)
+            if mean_size >= self.small_file_bytes and not season_files:
+                continue
+
+            contents = self.storage.read_objects(list(files))
+            merged = self._merge({key: self._table(contents[key], table) for key in files})
+            parts = max(1, ceil(sum(files.values()) / self.target_file_bytes))
+            rows_per_part = ceil(merged.height / parts)
+            new_files = {
+                partition_key(table, season, part=part, root=self.root): encode_parquet(
+                    merged.slice(part * rows_per_part, rows_per_part), self.parquet_options
+                )
+                for part in range(parts)
+            }
+            self.storage.write_objects(new_files, skip_unchanged=True)
+            self.storage.delete_objects([key for key in files if key not in new_files])
+            summary["seasons"] += 1
+            summary["merged"] += len(files)
+            summary["written"] += len(new_files)
+        logging.info(
+            f"Compacted {summary['seasons']} seasons: {summary['merged']} files merged into {summary['written']}"
+        )
+        return summary
+
+    def migrate(self, delete: bool = False, dry_run: bool = False) -> dict:
+        """
+        Rewrites the files of the legacy layout (`prep/<category>/<season>_<category>.parquet`,
+        `prep/f1_schedule.parquet`) as round partitions.
+
+        Args:
+            delete (bool): Delete the legacy files once their partitions are written.
+            dry_run (bool): Only log what would be migrated.
+
+        Returns:
+            dict: The number of legacy files migrated and of round files written.
+        """
+        legacy = [
+            key for key in self.storage.list_objects(f"{self.root}/")
+            if key.endswith(".parquet") and not parse_partition(key)
+        ]
+        summary = {"migrated": 0, "written": 0}
+        for key in legacy:
+            category = "schedule" if "f1_schedule" in key else Path(key).parent.name
+            rows = self._table(self.storage.read_object(key), category)
+            new_files = {
+                partition_key(category, season, race_round, root=self.root): partition
+                for season, race_round, partition in round_partitions(rows)
+            }
+            logging.info(f"{key} -> {len(new_files)} round files of {category}")
+            if dry_run:
+                continue
+            self.storage.write_objects(
+                {new_key: encode_parquet(partition, self.parquet_options) for new_key, partition in new_files.items()},
+                skip_unchanged=True,
+            )
+            summary["migrated"] += 1
+            summary["written"] += len(new_files)
+        if delete and not dry_run:
+            self.storage.delete_objects(legacy)
+        logging.info(f"Migrated {summary['migrated']} legacy files into {summary['written']} round files")
+        return summary
@@ -0,0 +1,110 @@
+import json
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+
+class DiskCache:
+
+    def __init__(self, directory: str, max_size_mb: float) -> None:
+        """
+        Initialize a size-bounded on-disk key/value store with LRU eviction.
+
+        Each entry is stored as a data file (`<hash>.bin`) next to a metadata file
+        (`<hash>.json`). The modification time of the data file records the last
+        access, so the least recently used entries are evicted first once the
+        total size exceeds `max_size_mb`.
+
+        Args:
+            directory (str): Folder holding the cached entries.
+            max_size_mb (float): Maximum total size of the cached data (in MB).
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self.size = sum(path.stat().st_size for path in self.directory.glob("*.bin"))
+
+    def _paths(self, key: str) -> tuple:
+        """
+        Returns the data and metadata paths of a key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            tuple: The data file path and the metadata file path.
+        """
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.directory / f"{digest}.bin", self.directory / f"{digest}.json"
+
+    def get(self, key: str) -> tuple | None:
+        """
+        Reads an entry and marks it as recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            tuple: The cached bytes and their metadata, or None if the key is not cached.
+        """
+        data_path, meta_path = self._paths(key)
+        with self._lock:
+            try:
+                data = data_path.read_bytes()
+                metadata = json.loads(meta_path.read_text())
+            except (OSError, ValueError):
+                return None
+            os.utime(data_path)
+        return data, metadata
+
+    def put(self, key: str, data: bytes, metadata: dict) -> None:
+        """
+        Stores an entry, then evicts the least recently used entries if the cache is too large.
+
+        Args:
+            key (str): The cache key.
+            data (bytes): The content to cache.
+            metadata (dict): JSON-serializable metadata stored with the content.
+        """
+        data_path, meta_path = self._paths(key)
+        with self._lock:
+            previous_size = data_path.stat().st_size if data_path.exists() else 0
+            tmp_path = data_path.with_suffix(".tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, data_path)
+            meta_path.write_text(json.dumps(metadata))
+            self.size += len(data) - previous_size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def update_metadata(self, key: str, metadata: dict) -> None:
+        """
+        Replaces the metadata of an existing entry without rewriting its content.
+
+        Args:
+            key (str): The cache key.
+            metadata (dict): The new metadata.
+        """
+        data_path, meta_path = self._paths(key)
+        with self._lock:
+            if data_path.exists():
+                meta_path.write_text(json.dumps(metadata))
+                os.utime(data_path)
+
+    def _evict(self) -> None:
+        """
+        Deletes the least recently used entries until the cache fits within its size limit.
+        """
+        entries = sorted(
+            (path.stat().st_mtime, path.stat().st_size, path)
+            for path in self.directory.glob("*.bin")
+        )
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+            self.size -= size
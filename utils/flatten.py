@@ -0,0 +1,413 @@
+import json
+import polars as pl
+
+# Fields of the API pages holding arrays (every other nested field is an object)
+LIST_FIELDS = {
+    "Races", "Laps", "Timings", "PitStops", "Results", "SprintResults", "QualifyingResults",
+    "StandingsLists", "DriverStandings", "ConstructorStandings", "Constructors",
+}
+# Standings categories: their pages hold `StandingsTable.StandingsLists` instead of `RaceTable.Races`
+STANDINGS_FIELDS = {"DriverStandings", "ConstructorStandings"}
+
+# Race header: the race fields repeated on every row of the race tables (laps, pitstops, results...)
+RACE_HEADER = [
+    "season", "round", "url", "raceName", "Circuit_circuitId", "Circuit_url", "Circuit_circuitName",
+    "Circuit_Location_lat", "Circuit_Location_long", "Circuit_Location_locality", "Circuit_Location_country",
+    "date", "time",
+]
+RACE_KEY = ["season", "round"]
+# Table holding the race header once per (season, round) in normalized prep
+RACES_TABLE = "races"
+# Id columns of the normalized tables, cast to Categorical when read (see `encode_ids`)
+ID_SUFFIXES = ("driverId", "constructorId", "circuitId", "_status")
+# Polars types of the column types of data_schema.json (STRING columns are kept as they are)
+POLARS_TYPES = {"INTEGER": pl.Int64, "FLOAT": pl.Float64, "DATE": pl.Date}
+
+
+def normalized_schema(schema: dict) -> dict:
+    """
+    Splits the race header out of the race tables of a schema.
+
+    Race tables (tables holding the race header and rows of their own) keep the race key
+    and their own columns; the header columns go to a `races` table, with the types they
+    have in the race tables. Other tables (schedule, standings) are unchanged.
+
+    Args:
+        schema (dict): The column types of each table (the content of `data_schema.json`).
+
+    Returns:
+        dict: The normalized schema.
+    """
+    normalized, races = {}, {}
+    for category, columns in schema.items():
+        header = [column for column in columns if column in RACE_HEADER]
+        if "raceName" not in header or len(header) == len(columns):
+            normalized[category] = columns
+            continue
+        races.update({column: columns[column] for column in header if column not in races})
+        normalized[category] = {
+            column: dtype for column, dtype in columns.items() if column in RACE_KEY or column not in RACE_HEADER
+        }
+    if races:
+        normalized[RACES_TABLE] = {column: races[column] for column in RACE_HEADER if column in races}
+    return normalized
+
+
+def race_tables(schema: dict) -> list:
+    """
+    Lists the race tables of a schema, the tables whose header is split out by normalization.
+
+    Args:
+        schema (dict): The column types of each table.
+
+    Returns:
+        list: The table names.
+    """
+    normalized = normalized_schema(schema)
+    return [category for category in schema if list(normalized[category]) != list(schema[category])]
+
+
+def column_tree(columns: list) -> dict:
+    """
+    Turns flat column names into the tree of nested fields they come from.
+
+    Args:
+        columns (list): Flat column names (e.g. ["season", "Circuit_Location_lat"]).
+
+    Returns:
+        dict: Nested dictionaries keyed by field name, empty for leaves
+        (e.g. {"season": {}, "Circuit": {"Location": {"lat": {}}}}).
+
+    API field names are camelCase, so "_" only ever separates nesting levels.
+    """
+    tree = {}
+    for column in columns:
+        node = tree
+        for field in column.split("_"):
+            node = node.setdefault(field, {})
+    return tree
+
+
+def tree_dtype(tree: dict) -> pl.Struct:
+    """
+    Builds the Polars type of the objects described by a column tree.
+
+    Args:
+        tree (dict): The fields of the objects (see `column_tree`).
+
+    Returns:
+        pl.Struct: The struct type; leaves are strings (the API sends every value as a
+        string), fields in `LIST_FIELDS` are lists of structs.
+    """
+    fields = {}
+    for field, children in tree.items():
+        dtype = tree_dtype(children) if children else pl.String
+        fields[field] = pl.List(dtype) if field in LIST_FIELDS else dtype
+    return pl.Struct(fields)
+
+
+def leaf_columns(name: str, subtree: dict) -> list:
+    """
+    Lists the flat column names under a node of the column tree.
+
+    Args:
+        name (str): The flat name of the node.
+        subtree (dict): The node's children.
+
+    Returns:
+        list: The flat names of its leaves (the node itself if it is a leaf).
+    """
+    if not subtree:
+        return [name]
+    return [column for field, child in subtree.items() for column in leaf_columns(f"{name}_{field}", child)]
+
+
+def cast_expression(column: str, column_type: str) -> pl.Expr:
+    """
+    Builds the expression casting a column to its schema type, bad values becoming null.
+
+    Args:
+        column (str): The column name.
+        column_type (str): Its type in the schema ("INTEGER", "FLOAT" or "DATE").
+
+    Returns:
+        pl.Expr: The cast column.
+    """
+    if column_type == "DATE":
+        return pl.col(column).cast(pl.String).str.to_date("%Y-%m-%d", strict=False)
+    return pl.col(column).cast(POLARS_TYPES[column_type], strict=False)
+
+
+def encode_ids(table: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame | pl.LazyFrame:
+    """
+    Casts the id columns of a flat table to dictionary-encoded (Categorical) strings.
+
+    Prep files keep the ids as strings (Parquet dictionary-encodes them anyway): a file
+    written in several row groups would otherwise hold one dictionary per row group,
+    which Polars 1.20 reads back as a different mapping than the same rows written at once.
+    The ids are encoded when a table is read instead (see `PartitionedDataset.read`).
+
+    Args:
+        table (pl.DataFrame or pl.LazyFrame): The flat table.
+
+    Returns:
+        pl.DataFrame or pl.LazyFrame: The table, with each id held once in memory and
+        referenced by integer codes (the Arrow and pandas dictionary types).
+    """
+    columns = [column for column in table.collect_schema() if column.endswith(ID_SUFFIXES)]
+    return table.with_columns(pl.col(columns).cast(pl.Categorical))
+
+
+def widen(
+    table: pl.DataFrame | pl.LazyFrame, races: pl.DataFrame | pl.LazyFrame, columns: list
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    Joins the race header back onto a normalized race table (the shape of the non-normalized prep).
+
+    Args:
+        table (pl.DataFrame or pl.LazyFrame): The slim race table, keyed by season and round.
+        races (pl.DataFrame or pl.LazyFrame): The race header table (same kind as `table`).
+        columns (list): The columns of the wide table, in order (those missing from both tables are left out).
+
+    Returns:
+        pl.DataFrame or pl.LazyFrame: The wide table.
+    """
+    header = races.select([column for column in races.collect_schema() if column in columns])
+    wide = table.join(header.unique(RACE_KEY, keep="first"), on=RACE_KEY, how="left")
+    present = wide.collect_schema()
+    return wide.select([column for column in columns if column in present])
+
+
+class FlattenPlanner:
+
+    def __init__(self, schema: dict) -> None:
+        """
+        Initialize the planner flattening the raw tables into the columns of `data_schema.json`.
+
+        For each category, the output columns are known upfront from the schema, so the
+        nested input is flattened by a single lazy plan: one projection per nesting level
+        of lists (struct fields are read with `struct.field`, not unnested one level at a
+        time), each followed by an explode. Only the fields the schema needs are carried,
+        and fields absent from the input come out as null columns, so every file of a
+        category has the same columns, in the schema order.
+
+        Compiled plans are cached per category and input schema.
+
+        Args:
+            schema (dict): The column types of each table (the content of `data_schema.json`).
+        """
+        self.schema = schema
+        self.trees = {category: column_tree(list(columns)) for category, columns in schema.items()}
+        self.plans = {}
+
+    @classmethod
+    def from_file(cls, path: str = "config/data_schema.json") -> "FlattenPlanner":
+        """
+        Creates a planner from a schema file.
+
+        Args:
+            path (str): Path of the schema file.
+
+        Returns:
+            FlattenPlanner: The planner.
+        """
+        with open(path) as file:
+            return cls(json.load(file))
+
+    def row_dtype(self, category: str) -> pl.Struct:
+        """
+        Returns the explicit type of a race (or standings list) of a category.
+
+        Args:
+            category (str): The table name in the schema.
+
+        Returns:
+            pl.Struct: The fields needed by the schema, typed from the column tree.
+        """
+        return tree_dtype(self.trees[category])
+
+    def page_schema(self, category: str) -> pl.Schema:
+        """
+        Returns the explicit schema of an API page (`MRData` response) of a category.
+
+        Decoding with it lets Polars' JSON reader build the Arrow columns directly: no type
+        inference, no Python object tree, and fields the schema does not need are skipped.
+
+        Args:
+            category (str): The table name in the schema.
+
+        Returns:
+            pl.Schema: The page schema (`MRData.RaceTable.Races` or `MRData.StandingsTable.StandingsLists`).
+        """
+        table, rows = self.table_fields(category)
+        return pl.Schema(
+            {"MRData": pl.Struct({table: pl.Struct({rows: pl.List(self.row_dtype(category))})})}
+        )
+
+    def table_fields(self, category: str) -> tuple:
+        """
+        Returns where the rows of a category are in an API page.
+
+        Args:
+            category (str): The table name in the schema.
+
+        Returns:
+            tuple: The table and rows fields ("RaceTable", "Races") or ("StandingsTable", "StandingsLists").
+        """
+        if STANDINGS_FIELDS & set(self.trees[category]):
+            return "StandingsTable", "StandingsLists"
+        return "RaceTable", "Races"
+
+    def cast_expressions(self, category: str, input_schema: pl.Schema) -> dict:
+        """
+        Returns the expressions casting the columns of a table to their schema types.
+
+        Args:
+            category (str): The table name in the schema.
+            input_schema (pl.Schema): The schema of the flat table.
+
+        Returns:
+            dict: The cast expression of each column not typed yet (columns already of
+            their type, STRING columns and columns missing from the table are left out).
+        """
+        return {
+            column: cast_expression(column, column_type)
+            for column, column_type in self.schema[category].items()
+            if column_type in POLARS_TYPES
+            and column in input_schema
+            and input_schema[column] != POLARS_TYPES[column_type]
+        }
+
+    def cast(self, table: pl.DataFrame | pl.LazyFrame, category: str) -> pl.DataFrame | pl.LazyFrame:
+        """
+        Casts a flat table to the types of its category, in a single projection.
+
+        Args:
+            table (pl.DataFrame or pl.LazyFrame): The flat table.
+            category (str): The table name in the schema.
+
+        Returns:
+            pl.DataFrame or pl.LazyFrame: The typed table; values that cannot be cast are null.
+        """
+        return table.with_columns(**self.cast_expressions(category, table.collect_schema()))
+
+    def rejections(self, table: pl.DataFrame | pl.LazyFrame, category: str) -> dict:
+        """
+        Counts, per column, the values `cast` turns to null.
+
+        Args:
+            table (pl.DataFrame or pl.LazyFrame): The flat table, before `cast`. A lazy
+                table is computed once more for the counts.
+            category (str): The table name in the schema.
+
+        Returns:
+            dict: The number of rejected values of each column holding any.
+        """
+        expressions = [
+            (pl.col(column).is_not_null() & expression.is_null()).sum().alias(column)
+            for column, expression in self.cast_expressions(category, table.collect_schema()).items()
+        ]
+        if not expressions:
+            return {}
+        counts = table.lazy().select(expressions).collect().row(0, named=True)
+        return {column: count for column, count in counts.items() if count}
+
+    def plan(self, category: str, input_schema: pl.Schema) -> list:
+        """
+        Compiles (or returns the cached) flattening steps of a category for an input schema.
+
+        Args:
+            category (str): The table name in the schema (e.g. "laps").
+            input_schema (pl.Schema): The schema of the nested input table.
+
+        Returns:
+            list: The steps, as (projection expressions, columns to explode) tuples.
+        """
+        key = (category, tuple(input_schema.items()))
+        if key not in self.plans:
+            self.plans[key] = self._compile(self.trees[category], input_schema)
+        return self.plans[key]
+
+    def _compile(self, tree: dict, input_schema: pl.Schema) -> list:
+        # Nodes still to flatten: (flat name, expression, children, dtype)
+        nodes = [
+            (field, pl.col(field), children, input_schema.get(field))
+            for field, children in tree.items()
+        ]
+        flat, steps = [], []
+        while nodes:
+            expressions, lists = [], []
+            for name, expression, children, dtype in nodes:
+                self._expand(name, expression, children, dtype, expressions, lists)
+            flat += [expression.meta.output_name() for expression in expressions]
+            projection = [pl.col(column) for column in flat[: len(flat) - len(expressions)]]
+            projection += expressions + [expression.alias(name) for name, expression, _, _ in lists]
+            steps.append((projection, [name for name, _, _, _ in lists]))
+            nodes = [
+                (name, pl.col(name), children, dtype.inner)
+                for name, _, children, dtype in lists
+            ]
+        return steps
+
+    def _expand(
+        self, name: str, expression: pl.Expr, children: dict, dtype, expressions: list, lists: list
+    ) -> None:
+        """
+        Splits a node into leaf expressions (selected now) and list nodes (exploded next).
+
+        Args:
+            name (str): The flat name of the node.
+            expression (pl.Expr): The expression reading the node.
+            children (dict): The fields of the node needed by the schema.
+            dtype (pl.DataType): The type of the node in the input (None if it is missing).
+            expressions (list): Receives the leaf expressions.
+            lists (list): Receives the list nodes.
+        """
+        if dtype is None or (children and not isinstance(dtype, (pl.Struct, pl.List))):
+            # missing from the input: keep the column, as null
+            expressions += [pl.lit(None, dtype=pl.String).alias(column) for column in leaf_columns(name, children)]
+        elif isinstance(dtype, pl.List):
+            lists.append((name, expression, children, dtype))
+        elif isinstance(dtype, pl.Struct) and children:
+            fields = {field.name: field.dtype for field in dtype.fields}
+            for field, grandchildren in children.items():
+                self._expand(
+                    f"{name}_{field}",
+                    expression.struct.field(field) if field in fields else None,
+                    grandchildren,
+                    fields.get(field),
+                    expressions,
+                    lists,
+                )
+        else:
+            expressions.append(expression.alias(name))
+
+    def flatten_lazy(self, lazy: pl.LazyFrame, category: str) -> pl.LazyFrame:
+        """
+        Adds the flattening steps of a category to a lazy query.
+
+        Args:
+            lazy (pl.LazyFrame): The nested table (one row per race or standings list).
+            category (str): The table name in the schema.
+
+        Returns:
+            pl.LazyFrame: The query of the flat table, with the schema columns in the schema order.
+        """
+        for projection, explode in self.plan(category, lazy.collect_schema()):
+            lazy = lazy.select(projection)
+            if explode:
+                lazy = lazy.explode(explode)
+        return lazy.select(list(self.schema[category]))
+
+    def flatten(self, df: pl.DataFrame, category: str) -> pl.DataFrame:
+        """
+        Flattens a nested table into the columns of its category.
+
+        Args:
+            df (pl.DataFrame): The nested table (one row per race or standings list).
+            category (str): The table name in the schema.
+
+        Returns:
+            pl.DataFrame: The flat table, with the schema columns in the schema order.
+        """
+        return self.flatten_lazy(df.lazy(), category).collect()
@@ -1,8 +1,9 @@
 import logging
-from datetime import date, timedelta
+from datetime import date
 import json
 from data_ingestion.src.f1_api import F1API
-from utils.s3_client import S3Client
+from data_ingestion.src.manifest import IngestionManifest
+from utils.storage import Storage
 from utils.s3_utils import read_object_into_json
 
 def get_last_date(f1_schedule: list) -> str:
@@ -19,19 +20,24 @@ def get_last_date(f1_schedule: list) -> str:
     date = max([schedule["date"] for schedule in f1_schedule])
     return date
 
-def fetch_f1_schedule(s3_client: S3Client, config: dict, f1_api: F1API) -> None:
+def fetch_f1_schedule(
+    s3_client: Storage, config: dict, f1_api: F1API, full_refresh: bool = False
+) -> None:
     """
     Retrieves the F1 schedule from an S3 bucket or updates it if the stored schedule is outdated.
 
     Args:
-        s3_client (S3Client): An instance of the S3 client to interact with AWS S3.
+        s3_client (Storage): The storage holding the schedule (S3 bucket or local folder).
         config (dict): Configuration dictionary containing required settings (e.g., S3 bucket name).
         f1_api (F1API): An instance of the F1API class to fetch the latest schedule if needed.
+        full_refresh (bool): If True, refetches the whole history instead of the current and next season.
 
     Behavior:
         - Reads the F1 schedule from an S3 JSON file.
         - Checks if the last race date is outdated.
-        - If outdated, updates the schedule via the F1 API and writes the new data to S3.
+        - If outdated, refreshes the current and next season via the F1 API, merges them into
+          the stored schedule and writes the new data to S3.
+        - If there is no stored schedule (or on a full refresh), fetches the whole history.
         - Otherwise, uses the existing schedule.
     """
 
@@ -39,53 +45,73 @@ def fetch_f1_schedule(s3_client: S3Client, config: dict, f1_api: F1API) -> None:
 
     f1_schedule = read_object_into_json(
         s3_client=s3_client, object_key=s3_f1_schedule_file
-    )
-
-    last_schedule_date = get_last_date(f1_schedule)
-    today = date.today().strftime("%Y-%m-%d")
+    ) or []
 
-    if last_schedule_date <= today:
-        logging.info("Updating F1 schedule...")
-        f1_api.fetch_f1_seasons_schedule()
-        s3_client.write_object(
-            bucket_name=config["s3_bucket"],
-            object_key=s3_f1_schedule_file,
-            data=json.dumps(f1_api.f1_schedule),
-        )
-    else:
+    today = date.today()
+    if f1_schedule and not full_refresh and get_last_date(f1_schedule) > today.strftime("%Y-%m-%d"):
         logging.info("Using existing F1 schedule.")
         f1_api.f1_schedule = f1_schedule
+        return
+
+    if f1_schedule and not full_refresh:
+        logging.info("Updating F1 schedule (current and next season)...")
+        f1_api.refresh_f1_schedule(f1_schedule, [today.year, today.year + 1])
+    else:
+        logging.info("Fetching the full F1 schedule...")
+        f1_api.fetch_f1_seasons_schedule()
+
+    s3_client.load_etags(s3_f1_schedule_file)
+    s3_client.write_object(
+        object_key=s3_f1_schedule_file,
+        data=json.dumps(f1_api.f1_schedule),
+        skip_unchanged=True,
+    )
 
 
-def process_race_data(f1_api: F1API, LOOKBACK_DAYS: int, get_all: bool) -> None:
+def process_race_data(
+    f1_api: F1API, manifest: IngestionManifest, get_all: bool, dry_run: bool = False
+) -> None:
     """
-    Processes and fetches race data within a specified date range.
+    Plans and fetches the pending race data.
 
     Args:
         f1_api (F1API): An instance of the F1API class to fetch race results.
-        LOOKBACK_DAYS (int): The number of days to look back for race data.
-        get_all (bool): If True, processes all races; otherwise, filters races within the specified date range.
+        manifest (IngestionManifest): The ingestion manifest recording what has already been fetched.
+        get_all (bool): If True, refetches every past race; otherwise, only fetches the pending work.
+        dry_run (bool): If True, prints the request plan and its budget without fetching anything.
 
     Behavior:
-        - If get_all is False, filters races from the last LOOKBACK_DAYS.
-        - If get_all is True, processes all races in the schedule.
-        - Fetches the race results and handles any potential errors.
+        - If get_all is False, fetches the (season, round, category) triples that the manifest
+          does not hold yet or that were fetched before the end of their settle window.
+        - If get_all is True, processes all past races in the schedule.
+        - The request planner picks round- or season-scoped URLs and the page size per category.
+        - Records every fetch in the manifest; files whose content did not change are not written.
     """
 
+    categories = (f1_api.round_category or []) + (f1_api.season_category or [])
     if get_all == False:
-        today = date.today()
-        date_range_start = (today - timedelta(days=LOOKBACK_DAYS)).strftime("%Y-%m-%d")
-        date_range_end = today.strftime("%Y-%m-%d")
-
-        f1_api.pending_races = [
-            race
+        f1_api.pending_work = manifest.plan(f1_api.f1_schedule, categories)
+    else:
+        today = date.today().strftime("%Y-%m-%d")
+        f1_api.pending_work = [
+            {"season": race["season"], "round": race["round"], "category": category}
             for race in f1_api.f1_schedule
-            if date_range_start <= race["date"] <= date_range_end
+            if race["date"] <= today
+            for category in categories
         ]
-    else:
-        f1_api.pending_races = f1_api.f1_schedule
+    f1_api.manifest = manifest
+    if not dry_run:
+        manifest.start_run()
+
+    if not f1_api.pending_work:
+        logging.info("No pending race data, nothing to fetch.")
+        return
+
+    if dry_run:
+        f1_api.print_request_plan()
+        return
 
-    logging.info("Fetching race results...")
+    logging.info(f"Fetching race results ({len(f1_api.pending_work)} pending fetches)...")
     try: 
         f1_api.fetch_data()
     except Exception as e:
@@ -1,8 +1,17 @@
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
 from pathlib import Path
+from time import perf_counter
 import polars as pl
-import pandas as pd
-from pathlib import Path
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from utils.dataset import parse_partition, sink_parquet
+from utils.flatten import FlattenPlanner, RACES_TABLE, race_tables, widen
+
+# Seasons covered by the season partitions of the BigQuery tables (end excluded)
+SEASONS = (1950, 2101)
+# Suffix of the staging tables receiving a batch before it replaces its rounds
+STAGING_SUFFIX = "__staging"
 
 
 def list_file(folder: str) -> list:
@@ -22,168 +31,286 @@ def list_file(folder: str) -> list:
 
 def file_to_load(folder: str) -> dict:
     """
-    Organizes Parquet files into a dictionary by their parent folder name.
+    Organizes Parquet files into a dictionary by table.
+
+    The table of a file is its `category=<table>` partition folder (see `utils.dataset`),
+    or its parent folder name for files of the legacy `prep/<table>/` layout.
 
     Args:
         folder (str): Path to the folder.
 
     Returns:
-        dict: A dictionary where keys are folder names and values are lists of file paths.
+        dict: A dictionary where keys are table names and values are lists of file paths.
     """
-    parquet_files = list_file(folder)
-    foldernames = set([filename.parent.name for filename in parquet_files])
-
-    files_list = {
-        foldername: [
-            str(filename)
-            for filename in parquet_files
-            if filename.parent.name == foldername
-        ]
-        for foldername in foldernames
-    }
+    files_list = {}
+    for filename in sorted(list_file(folder)):
+        table = parse_partition(str(filename)).get("category", filename.parent.name)
+        files_list.setdefault(table, []).append(str(filename))
     return files_list
 
 
-def read_data_and_concat(files_to_concat: list) -> pl.DataFrame:
+def scan_files(files: list, table: str, planner: FlattenPlanner) -> pl.LazyFrame:
     """
-    Reads multiple Parquet files and concatenates them into a single Polars DataFrame.
+    Scans the Parquet files of a table lazily, as one table.
 
     Args:
-        files_to_concat (list): List of Parquet file paths.
+        files (list): List of Parquet file paths.
+        table (str): The table name.
+        planner (FlattenPlanner): Casts files written before prep typed its output.
 
     Returns:
-        pd.DataFrame: Concatenated Pandas DataFrame.
+        pl.LazyFrame: The rows of every file.
     """
-    dfs = [pl.read_parquet(file) for file in files_to_concat]
-    dfs = pl.concat(dfs, how="diagonal")
-    return dfs.to_pandas()
+    scans = [pl.scan_parquet(file) for file in files]
+    if table in planner.schema:
+        scans = [planner.cast(scan, table) for scan in scans]
+    return pl.concat(scans, how="diagonal_relaxed")
 
 
-def load_and_concat(folder: str) -> dict:
+def scan_tables(folder: str, schema_json: dict, wide: bool = False) -> dict:
     """
-    Loads and concatenates all Parquet files from a given folder, grouping them by table.
+    Scans the prep tables of a folder, grouping the files by table.
 
     Args:
         folder (str): Path to the folder containing the Parquet files.
+        schema_json (dict): The column types of each table (the normalized schema for
+            normalized prep files, unless `wide`).
+        wide (bool, optional): Join the race header of normalized prep files back onto
+            the race tables, `schema_json` being the wide schema; the `races` table is
+            then left out. Defaults to False.
 
     Returns:
-        dict: A dictionary where keys are table names and values are concatenated DataFrames.
+        dict: The lazy table of each table name; nothing is read yet.
     """
+    planner = FlattenPlanner(schema_json)
     files = file_to_load(folder)
-    return {table: read_data_and_concat(files[table]) for table in files.keys()}
+    if wide and RACES_TABLE in files:
+        races = scan_files(files.pop(RACES_TABLE), RACES_TABLE, planner)
+        return {
+            table: widen(scan_files(files[table], table, planner), races, list(schema_json[table]))
+            if table in race_tables(schema_json)
+            else scan_files(files[table], table, planner)
+            for table in files
+        }
+    return {table: scan_files(files[table], table, planner) for table in files}
+
+
+def write_table_file(table: pl.LazyFrame, columns: list, filename: str) -> int:
+    """
+    Streams a table into a single Parquet file, ready for a load job.
+
+    Args:
+        table (pl.LazyFrame): The table.
+        columns (list): The columns of the BigQuery table, in order (missing ones are left out).
+        filename (str): The path of the file.
+
+    Returns:
+        int: The size of the file (in bytes).
+    """
+    present = table.collect_schema()
+    sink_parquet(table.select([column for column in columns if column in present]), filename, {"compression": "zstd"})
+    return Path(filename).stat().st_size
 
 
-def convert_pandas_df(df: pd.DataFrame, schema_json: dict) -> pd.DataFrame:
+# === Load Data into BigQuery ===
+def cluster_fields(columns: list) -> list:
     """
-    Converts a Pandas DataFrame's columns to the specified schema.
+    Returns the clustering columns of a table: the round, then the driver (or constructor) id.
 
     Args:
-        df (pd.DataFrame): The DataFrame to be converted.
-        schema_json (dict): A dictionary mapping column names to target data types.
+        columns (list): The columns of the table.
 
     Returns:
-        pd.DataFrame: The DataFrame with the specified type conversions.
+        list: The clustering columns (at most 4, as BigQuery allows).
     """
-    for col, dtype in schema_json.items():
+    fields = ["round"] if "round" in columns else []
+    for suffix in ("driverId", "constructorId"):
+        ids = [column for column in columns if column.endswith(suffix)]
+        if ids:
+            fields.append(ids[0])
+            break
+    return fields[:4]
 
-        if col not in df.columns:
-            print(f"Warning: Column '{col}' is missing. Adding it with NULL values.")
-            df[col] = pd.NA  # Add column with NULL values
 
-        try:
-            if dtype == "INTEGER":
-                # Convert non-numeric values to NaN and then to Int64
-                df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
-            elif dtype == "FLOAT":
-                df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
-            elif dtype == "DATE":
-                df[col] = pd.to_datetime(df[col], format="%Y-%m-%d", errors="coerce")
-            elif dtype == "STRING":
-                df[col] = df[col].astype("string")
-        except Exception as e:
-            print(f"Error converting column {col} to {dtype}: {e}")
+def table_layout(columns: list) -> dict:
+    """
+    Returns the partitioning and clustering of a BigQuery table.
 
-    return df
+    Args:
+        columns (list): The columns of the table.
 
+    Returns:
+        dict: The `range_partitioning` (one partition per season) and `clustering_fields`.
+    """
+    return {
+        "range_partitioning": bigquery.RangePartitioning(
+            field="season", range_=bigquery.PartitionRange(start=SEASONS[0], end=SEASONS[1], interval=1)
+        ),
+        "clustering_fields": cluster_fields(columns),
+    }
 
-# === Load and Transform Data ===
-def load_and_transform_data(folder: str, schema_json: dict) -> dict:
+
+def ensure_table(bq_client: bigquery.Client, table_id: str, schema: list, rebuild: bool = False) -> None:
     """
-    Loads, concatenates, and transforms data according to the provided schema.
+    Creates a table partitioned by season and clustered, unless it exists with that layout.
+
+    A table created by earlier versions of the loader (not partitioned) is only rebuilt
+    with the partitioning and clustering, keeping its rows, when `rebuild` is set.
 
     Args:
-        folder (str): Path to the folder containing data.
-        schema_json (dict): Dictionary specifying column types for transformation.
+        bq_client (bigquery.Client): BigQuery client instance.
+        table_id (str): The table ("project.dataset.table").
+        schema (list): The schema fields of the table.
+        rebuild (bool, optional): Rebuild an existing table that is not partitioned by
+            season. Defaults to False.
 
-    Returns:
-        dict: A dictionary of transformed DataFrames.
+    Raises:
+        ValueError: If the table exists without the season partitioning and `rebuild` is not set.
     """
-    
-    datasets = load_and_concat(folder)  # Load data
+    layout = table_layout([field.name for field in schema])
+    try:
+        table = bq_client.get_table(table_id)
+    except NotFound:
+        table = bigquery.Table(table_id, schema=schema)
+        table.range_partitioning = layout["range_partitioning"]
+        table.clustering_fields = layout["clustering_fields"]
+        bq_client.create_table(table)
+        return
+    if table.range_partitioning is None or table.range_partitioning.field != "season":
+        if not rebuild:
+            raise ValueError(
+                f"{table_id} is not partitioned by season; set load.rebuild_tables to rebuild it (keeping its rows)"
+            )
+        print(f"Partitioning {table_id} by season (one-time rebuild)...")
+        bq_client.query(
+            f"CREATE OR REPLACE TABLE `{table_id}` "
+            f"PARTITION BY RANGE_BUCKET(season, GENERATE_ARRAY({SEASONS[0]}, {SEASONS[1]}, 1)) "
+            f"CLUSTER BY {', '.join(layout['clustering_fields'])} "
+            f"AS SELECT * FROM `{table_id}`"
+        ).result()
 
 
-    # if "schedule" in datasets.keys() : 
-    #     datasets["schedule"] = datasets.pop(folder)
+def replace_rounds_sql(table_id: str, staging_id: str, columns: list, seasons: list) -> str:
+    """
+    Builds the script replacing the rounds of a staging table in the target table.
 
-    transformed_datasets = {}
-    for table, df in datasets.items():
-        print(f"Processing table: {table}")
-        try:
-            converted_df = convert_pandas_df(df, schema_json[table])
-            transformed_datasets[table] = converted_df
-        except Exception as e:
-            print(f"Error transforming table {table}: {e}")
+    Args:
+        table_id (str): The target table.
+        staging_id (str): The staging table holding the new batch.
+        columns (list): The columns to insert.
+        seasons (list): The seasons of the batch: the literal filter prunes the DELETE
+            to their partitions.
 
-    return transformed_datasets
+    Returns:
+        str: The transaction deleting the (season, round) of the batch, then inserting it.
+
+    Raises:
+        ValueError: If the batch has no seasons (an empty batch has nothing to replace).
+    """
+    if not seasons:
+        raise ValueError(f"No seasons in the batch of {table_id}")
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    return (
+        "BEGIN TRANSACTION;\n"
+        f"DELETE FROM `{table_id}` AS target\n"
+        f"WHERE target.season IN ({', '.join(str(season) for season in seasons)})\n"
+        f"  AND EXISTS (SELECT 1 FROM `{staging_id}` AS batch "
+        "WHERE batch.season = target.season AND batch.round = target.round);\n"
+        f"INSERT INTO `{table_id}` ({column_list})\n"
+        f"SELECT {column_list} FROM `{staging_id}`;\n"
+        "COMMIT TRANSACTION;"
+    )
 
 
-# === Load Data into BigQuery ===
 def load_into_bigquery(
-    data: pd.DataFrame,
+    tables: dict,
     project: str,
     dataset: str,
     schema_json: dict,
     bq_client: bigquery.Client,
-) -> None:
+    staging_folder: str = ".load",
+    write_mode: str = "replace_rounds",
+    rebuild_tables: bool = False,
+) -> dict:
     
     """
-    Loads transformed data into BigQuery.
+    Loads the prep tables into BigQuery, without converting them to DataFrames.
 
     Args:
-        data (dict): A dictionary where keys are table names and values are Pandas DataFrames.
+        tables (dict): A dictionary where keys are table names and values are lazy tables (see `scan_tables`).
         project (str): Google Cloud project ID.
         dataset (str): BigQuery dataset name.
         schema_json (dict): Schema definition for each table.
         bq_client (bigquery.Client): BigQuery client instance.
+        staging_folder (str, optional): Folder holding the files sent to BigQuery. Defaults to ".load".
+        write_mode (str, optional): "replace_rounds" replaces only the (season, round) of the
+            batch; "truncate" replaces the whole table (full reload). Defaults to "replace_rounds".
+        rebuild_tables (bool, optional): Rebuild existing tables that are not partitioned by
+            season (see `ensure_table`); otherwise they are reported and left out. Defaults to False.
+
+    Returns:
+        dict: The rows, bytes sent, bytes processed by the merge and wall time (in seconds) of each loaded table.
 
     Behavior:
-        - Converts the schema dictionary into BigQuery schema fields.
-        - Loads the data into BigQuery with "WRITE_TRUNCATE" mode.
+        - Streams each table into a single Parquet file (typed by prep, so the Arrow
+          columns are written as they are) and sends it with a file load job: no pandas
+          conversion, and no re-encoding inside the client library.
+        - Tables are partitioned by season and clustered by round and driver (or constructor).
+        - With "replace_rounds", the batch is loaded into a staging table, then the rounds it
+          holds are deleted from the table and inserted again in one transaction: the cost
+          follows the size of the batch (and of its season partitions), not the history.
+          An empty batch leaves the table untouched.
         - Handles any errors during the upload process.
     """
-
-    for table, df in data.items():
+    Path(staging_folder).mkdir(parents=True, exist_ok=True)
+    stats = {}
+    for table, lazy in tables.items():
         table_id = f"{project}.{dataset}.{table}"
         schema = [
             bigquery.SchemaField(name, data_type)
             for name, data_type in schema_json[table].items()
         ]
 
-        job_config = bigquery.LoadJobConfig(
-            source_format=bigquery.SourceFormat.PARQUET,
-            schema=schema,
-            write_disposition="WRITE_TRUNCATE",
-        )
-
         print(f"Loading {table} into BigQuery...")
+        filename = Path(staging_folder) / f"{table}.parquet"
+        start = perf_counter()
         try:
-            load_job = bq_client.load_table_from_dataframe(
-                df, table_id, job_config=job_config
+            size = write_table_file(lazy, list(schema_json[table]), str(filename))
+            ensure_table(bq_client, table_id, schema, rebuild=rebuild_tables)
+            load_id = table_id if write_mode == "truncate" else f"{table_id}{STAGING_SUFFIX}"
+            job_config = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.PARQUET,
+                schema=schema,
+                write_disposition="WRITE_TRUNCATE",
+                **(table_layout(list(schema_json[table])) if write_mode == "truncate" else {}),
             )
+            with open(filename, "rb") as file:
+                load_job = bq_client.load_table_from_file(file, load_id, job_config=job_config)
             load_job.result()  # Wait for completion
-            print(f"Successfully loaded {table} into BigQuery ✅")
+            processed = 0
+            if write_mode != "truncate":
+                seasons = sorted(pc.unique(pq.read_table(filename, columns=["season"])["season"]).to_pylist())
+                columns = pq.read_schema(filename).names
+                if seasons:
+                    merge_job = bq_client.query(replace_rounds_sql(table_id, load_id, columns, seasons))
+                    merge_job.result()
+                    processed = merge_job.total_bytes_processed or 0
+                bq_client.delete_table(load_id, not_found_ok=True)
+            stats[table] = {
+                "rows": load_job.output_rows,
+                "bytes": size,
+                "bytes_processed": processed,
+                "seconds": round(perf_counter() - start, 3),
+            }
+            print(
+                f"Successfully loaded {table} into BigQuery ✅ "
+                f"({stats[table]['rows']} rows, {size / 1024 / 1024:.1f} MB in {stats[table]['seconds']}s)"
+            )
         except Exception as e:
             print(f"Error loading {table} into BigQuery ❌: {e}")
+        finally:
+            filename.unlink(missing_ok=True)
+    return stats
 
 
 def delete_local_files(folder: str) -> None:
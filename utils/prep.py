@@ -1,94 +1,468 @@
-import polars as pl
-import json
+import logging
+import multiprocessing
+import os
+from collections import Counter
 from io import BytesIO
+import polars as pl
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import cache
 from pathlib import Path
-from utils.s3_client import S3Client
+from utils.storage import Storage
+from utils.flatten import FlattenPlanner, RACE_KEY, RACES_TABLE, normalized_schema, race_tables
+from utils.dataset import PARQUET_OPTIONS, PartitionWriter, parse_partition, write_partitions
+from utils.raw_format import is_raw_file, raw_extension, read_page_chunks, read_pages
+
+SCHEMA_PATH = "config/data_schema.json"
 
 
 def file_to_prep(directory: str) -> list:
     """
-    Scans a directory recursively and returns a list of all JSON files.
+    Scans a directory recursively and returns a list of all raw files.
 
     Args:
         directory (str): Path to the directory.
 
     Returns:
-        list: List of file paths with a .json extension.
+        list: List of file paths with a raw format extension (.json, .ndjson, .ndjson.gz, .ndjson.zst).
     """
     path_ = list(Path(directory).rglob("*"))
-    return [str(filename) for filename in path_ if filename.suffix == ".json"]
+    return [str(filename) for filename in path_ if is_raw_file(filename)]
 
 
-def data_loading_concurrency(s3_client: S3Client, files: list) -> None:
+def data_loading_concurrency(
+    s3_client: Storage,
+    files: list,
+    lazy_categories: list = None,
+    process_workers: int = None,
+    upload_workers: int = 8,
+    parquet_options: dict = None,
+    normalize: bool = False,
+    chunked_categories: list = None,
+    chunk_mb: float = 64,
+) -> dict:
     """
-    Processes multiple JSON files concurrently and uploads them to S3 after transformation.
+    Processes multiple raw files in parallel and uploads them to S3 after transformation.
 
     Args:
-        s3_client (S3Client): An instance of the S3 client.
+        s3_client (Storage): The storage receiving the prep files (S3 bucket or local folder).
         files (list): List of file paths to process.
+        lazy_categories (list, optional): Categories prepared with the lazy, streaming
+            pipeline (see `prep_file`). Defaults to None (all eager).
+        process_workers (int, optional): Processes parsing, flattening and encoding the files.
+            Defaults to the number of CPU cores.
+        upload_workers (int, optional): Threads uploading the Parquet files. Defaults to 8.
+        parquet_options (dict, optional): Parquet codec, compression level, row-group size
+            and statistics. Defaults to `PARQUET_OPTIONS`.
+        normalize (bool, optional): Write the normalized tables (see `prep_file`). Defaults to False.
+        chunked_categories (list, optional): Categories prepared chunk by chunk, with a memory
+            ceiling (see `prep_file_chunked`). Defaults to None.
+        chunk_mb (float, optional): Raw JSON decoded per chunk (in MB). Defaults to 64.
 
     Returns:
-        str: Completion message.
+        dict: The number of files prepared and failed, the error of each failed file, and
+        the values rejected by the casts to the schema types, per table and column.
+
+    The CPU-bound work (JSON parsing, DataFrame construction, Parquet encoding) runs in a
+    process pool, out of reach of the GIL; uploads run in a thread pool as soon as a file
+    is ready. The largest files are scheduled first, so they do not end up as a long tail.
+    Workers are started with "spawn" (forking a process running Polars' thread pool can
+    deadlock) and share the cores: each one runs Polars on cores / processes threads, set
+    by the worker initializer (the environment of the calling process is left untouched).
     """
-    num_files = len(files)
+    files = sorted(files, key=lambda filename: Path(filename).stat().st_size, reverse=True)
+    process_workers = process_workers or os.cpu_count()
+    failures = {}
+    rejections = {}
 
-    with tqdm(total=num_files) as pbar:
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_file = [
-                executor.submit(prep_data_into_s3, s3_client, object_key)
+    with tqdm(total=len(files)) as pbar, ThreadPoolExecutor(max_workers=upload_workers) as uploads:
+        with ProcessPoolExecutor(
+            max_workers=process_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(max(1, os.cpu_count() // process_workers),),
+        ) as processes:
+            prep_futures = {
+                processes.submit(
+                    prep_file,
+                    object_key,
+                    lazy=table_category(object_key) in (lazy_categories or []),
+                    parquet_options=parquet_options,
+                    normalize=normalize,
+                    chunk_mb=chunk_mb if table_category(object_key) in (chunked_categories or []) else None,
+                ): object_key
                 for object_key in files
-            ]
-            for _ in as_completed(future_to_file):
-                pbar.update(1)
-    return "Completed !"
+            }
+            upload_futures = {}
+            for future in as_completed(prep_futures):
+                object_key = prep_futures[future]
+                try:
+                    new_filenames, rejected = future.result()
+                except Exception as e:
+                    failures[object_key] = repr(e)
+                    pbar.update(1)
+                    continue
+                for table, counts in rejected.items():
+                    rejections.setdefault(table, Counter()).update(counts)
+                upload_futures[
+                    uploads.submit(upload_prep_file, s3_client, new_filenames, object_key)
+                ] = object_key
 
+        for future in as_completed(upload_futures):
+            try:
+                future.result()
+            except Exception as e:
+                failures[upload_futures[future]] = repr(e)
+            pbar.update(1)
 
-def prep_data_into_s3(s3_client: S3Client, object_key: str) -> None:
+    for object_key, error in sorted(failures.items()):
+        logging.error(f"Failed to prepare {object_key}: {error}")
+    for table, counts in sorted(rejections.items()):
+        logging.warning(f"Values set to null in {table}: {dict(counts)}")
+    logging.info(f"Prepared {len(files) - len(failures)} files, {len(failures)} failed")
+    return {
+        "files": len(files) - len(failures),
+        "failed": len(failures),
+        "failures": failures,
+        "rejections": {table: dict(counts) for table, counts in rejections.items()},
+    }
+
+
+def init_worker(polars_threads: int) -> None:
     """
-    Reads, transforms, and uploads a JSON file to S3 in Parquet format.
+    Initializes a prep worker process, before it prepares any file.
 
     Args:
-        s3_client (S3Client): S3 client for uploading files.
-        object_key (str): File path of the JSON object.
+        polars_threads (int): Threads of the Polars pool of the worker (its share of the cores).
+            Polars builds its pool on first use, so the variable set here still applies;
+            a POLARS_MAX_THREADS set by the user is kept.
     """
-    try:
-        dt, filename = read_object_into_table(object_key)
-        new_filename = filename.replace("raw", "prep").replace("json", "parquet")
-        dt = recursive_unnest_explode(df=dt, parent_prefix="")
-        load_data_to_s3_as_parquet(
-            df=dt, s3_client=s3_client, filename=new_filename, old_filename=filename
-        )
-    except:
-        None
+    os.environ.setdefault("POLARS_MAX_THREADS", str(polars_threads))
+
+
+def prep_file(
+    object_key: str, lazy: bool = False, parquet_options: dict = None, normalize: bool = False, chunk_mb: float = None
+) -> tuple:
+    """
+    Reads, flattens and writes a raw file as local Parquet round partitions (runs in a worker process).
+
+    The rows of each (season, round) are written once to
+    `prep/category=<category>/season=<season>/round=<round>/part-0.parquet` (see
+    `utils.dataset`); the local files are both kept for the loading part and uploaded as they are.
+
+    Args:
+        object_key (str): File path of the raw object.
+        lazy (bool, optional): If True, the file is scanned, flattened and written as a
+            streaming lazy query (`sink_parquet`, peak memory bounded by a chunk) instead
+            of eager DataFrames; plans the streaming sink of the installed Polars rejects
+            are collected instead (see `utils.dataset.sink_parquet`). Defaults to False.
+        parquet_options (dict, optional): Parquet codec, compression level, row-group size
+            and statistics. Defaults to `PARQUET_OPTIONS`.
+        normalize (bool, optional): If True, the race tables (laps, pitstops, results...)
+            only keep the race key and their own columns, the race header is written once
+            per round to the `races` table (see `utils.flatten.normalized_schema`).
+            Defaults to False (wide tables).
+        chunk_mb (float, optional): If set, the file is prepared in chunks of this much raw
+            JSON (see `prep_file_chunked`), which bounds the memory of any file size.
+            Takes precedence over `lazy`. Defaults to None.
+
+    Returns:
+        tuple: The paths of the Parquet files, one per round (and table), and the values
+        rejected by the casts to the schema types, per table and column (see `type_table`).
+
+    Errors are raised, so the caller can report the failed file.
+    """
+    category = table_category(object_key)
+    normalize = normalize and category in race_tables(get_flatten_planner().schema)
+    if chunk_mb and category in get_flatten_planner().schema and category != "schedule":
+        return prep_file_chunked(object_key, chunk_mb, parquet_options=parquet_options, normalize=normalize)
+    if lazy:
+        races = scan_object_into_table(object_key)
+    else:
+        table = read_object_into_table(object_key)
+        if table is None:
+            raise ValueError(f"{object_key} holds no data")
+        races = table[0]
+
+    tables = {category: flatten_table(df=races, filename=object_key, normalized=normalize)}
+    if normalize:
+        tables[RACES_TABLE] = race_header(races)
+    filenames, rejections = [], {}
+    for name, table in tables.items():
+        table, rejections[name] = type_table(table, name, normalized=normalize)
+        filenames += write_partitions(table, name, parquet_options=parquet_options)
+    return filenames, {name: counts for name, counts in rejections.items() if counts}
+
+
+def type_table(
+    table: pl.DataFrame | pl.LazyFrame, name: str, normalized: bool = False
+) -> tuple:
+    """
+    Casts a flat table to the types of `data_schema.json` in one vectorized projection.
+
+    Values that cannot be cast (e.g. a non-numeric position) become null and are counted.
+
+    Args:
+        table (pl.DataFrame or pl.LazyFrame): The flat table (every value a string).
+        name (str): The table name.
+        normalized (bool, optional): The table is a normalized one. Defaults to False.
+
+    Returns:
+        tuple: The typed table (eager or lazy like the input; tables missing from the
+        schema are returned as they are) and the number of rejected values per column.
+    """
+    planner = get_flatten_planner(normalized)
+    if name not in planner.schema:
+        return table, {}
+    rejections = planner.rejections(table, name)
+    table = planner.cast(table, name)
+    return table, rejections
+
+
+def prep_file_chunked(
+    object_key: str, chunk_mb: float, parquet_options: dict = None, normalize: bool = False
+) -> tuple:
+    """
+    Prepares a raw file chunk by chunk, with a memory ceiling independent of the file size.
+
+    Pages are read in chunks of `chunk_mb` MB of JSON, and each chunk is decoded,
+    flattened (the Races -> Laps -> Timings explodes only ever see one chunk) and
+    appended as row groups to the files of its rounds (`utils.dataset.PartitionWriter`).
+    The output holds the same rows, in the same order, as `prep_file` without chunks.
+
+    Args:
+        object_key (str): File path of the raw object.
+        chunk_mb (float): Raw JSON decoded at once (in MB). Peak memory is a small multiple
+            of it, plus the exploded rows of a chunk.
+        parquet_options (dict, optional): Parquet codec, compression level, row-group size
+            and statistics. Defaults to `PARQUET_OPTIONS`.
+        normalize (bool, optional): If True, writes the normalized tables. Defaults to False.
+
+    Returns:
+        tuple: The paths of the Parquet files, one per round (and table), and the rejected
+        values per table and column.
+    """
+    category = table_category(object_key)
+    schema = get_flatten_planner().page_schema(category)
+    races_seen = set()
+    rejections = {category: Counter(), RACES_TABLE: Counter()}
+    with PartitionWriter(category, parquet_options=parquet_options) as writer, \
+            PartitionWriter(RACES_TABLE, parquet_options=parquet_options) as header_writer:
+        for chunk in read_page_chunks(object_key, int(chunk_mb * 1024 * 1024)):
+            races = page_rows(pl.read_ndjson(BytesIO(chunk), schema=schema).lazy(), category).collect()
+            flat, rejected = type_table(
+                flatten_table(df=races, filename=object_key, normalized=normalize), category, normalized=normalize
+            )
+            writer.write(flat)
+            rejections[category].update(rejected)
+            if not normalize:
+                continue
+            # a race spans several chunks: its header is written once
+            header = race_header(races).filter(
+                ~pl.concat_str(RACE_KEY, separator="/").is_in(list(races_seen))
+            )
+            races_seen.update(f"{season}/{race_round}" for season, race_round in header.select(RACE_KEY).rows())
+            header, rejected = type_table(header, RACES_TABLE, normalized=True)
+            header_writer.write(header)
+            rejections[RACES_TABLE].update(rejected)
+        filenames = writer.close() + header_writer.close()
+    if not filenames:
+        raise ValueError(f"{object_key} holds no data")
+    return filenames, {name: dict(counts) for name, counts in rejections.items() if counts}
+
+
+def race_header(races: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    """
+    Flattens the race header of a nested race table, once per (season, round).
+
+    Args:
+        races (pl.DataFrame or pl.LazyFrame): The nested table (one row per race).
+
+    Returns:
+        pl.DataFrame: The `races` table. Only the top-level race fields are read, nothing is exploded.
+    """
+    header = get_flatten_planner(normalized=True).flatten_lazy(races.lazy(), RACES_TABLE)
+    return header.unique(RACE_KEY, keep="first", maintain_order=True).collect()
+
+
+def upload_prep_file(s3_client: Storage, filenames: list, old_filename: str) -> int:
+    """
+    Uploads the Parquet files of a raw file to S3, then deletes the raw file.
+
+    Other part files found in the round folders written (left by an earlier prep of the
+    same rounds, e.g. one that split a round over more parts) are deleted, so that
+    reads and compaction do not merge their rows again. Each season is listed once.
+
+    Args:
+        s3_client (Storage): The storage receiving the Parquet files.
+        filenames (list): The Parquet files (kept locally for the loading part).
+        old_filename (str): Original raw filename (deleted after a successful upload).
+
+    Returns:
+        int: The number of files uploaded (files whose object already held the same content are skipped).
+    """
+    written = sum(s3_client.sync_file(filename) for filename in filenames)
+    rounds = {str(Path(filename).parent) for filename in filenames if "round" in parse_partition(filename)}
+    stale = [
+        key
+        for season in sorted({str(Path(folder).parent) for folder in rounds})
+        for key in s3_client.list_objects(f"{season}/")
+        if str(Path(key).parent) in rounds and key not in filenames
+    ]
+    if stale:
+        s3_client.delete_objects(stale)
+    Path(old_filename).unlink()
+    return written
 
 
 def read_object_into_table(object_key: str) -> tuple:
     """
-    Reads a JSON file into a Polars DataFrame, processing F1 race data.
+    Reads a raw file (JSON or newline-delimited JSON) into a Polars DataFrame, processing F1 race data.
 
     Args:
-        object_key (str): Path to the JSON file.
+        object_key (str): Path to the raw file.
 
     Returns:
-        tuple: A Polars DataFrame and the object key (filename).
+        tuple: A Polars DataFrame (one row per race or standings list) and the object key
+        (filename), or None if the file holds no rows.
+
+    Categories of the schema are decoded with their explicit types (see `scan_object_into_table`).
     """
-    with open(object_key, "r") as file:
-        data = json.load(file)
-    # dt = pl.concat([pl.DataFrame(dt["MRData"]["RaceTable"]["Races"]) for dt in data])
+    dt = scan_object_into_table(object_key).collect()
+    if dt.height:
+        return dt, object_key
+
+
+def read_untyped_table(object_key: str) -> pl.DataFrame:
+    """
+    Reads a raw file page by page into Python objects, letting Polars infer the types.
+
+    Args:
+        object_key (str): Path to the raw file.
+
+    Returns:
+        pl.DataFrame: One row per race (or standings list). Used for the categories
+        missing from the schema.
+    """
+    data = list(read_pages(object_key))
     if "f1_schedule" in object_key:
-        dt = pl.DataFrame(data)
+        return pl.DataFrame(data)
+    dataframes = [
+        pl.DataFrame(dt["MRData"]["RaceTable"]["Races"] if "RaceTable" in dt["MRData"].keys()
+                     else dt["MRData"]["StandingsTable"]["StandingsLists"]) for dt in data
+    ]
+    return pl.concat(dataframes, how="diagonal_relaxed")
+
+
+@cache
+def get_flatten_planner(normalized: bool = False) -> FlattenPlanner:
+    """
+    Returns the flattening planner of the tables in `data_schema.json` (loaded once).
+
+    Args:
+        normalized (bool, optional): Plan the normalized tables (see `normalized_schema`).
+            Raw files are always decoded with the wide planner. Defaults to False.
+
+    Returns:
+        FlattenPlanner: The planner, shared by every file so compiled plans are reused.
+    """
+    if normalized:
+        return FlattenPlanner(normalized_schema(get_flatten_planner().schema))
+    return FlattenPlanner.from_file(SCHEMA_PATH)
+
+
+def table_category(filename: str) -> str:
+    """
+    Returns the table (schema category) of a raw file.
+
+    Args:
+        filename (str): Path of the raw file (e.g. "raw/laps/2024_laps.ndjson.gz").
+
+    Returns:
+        str: The table name (e.g. "laps"; "schedule" for the F1 schedule).
+    """
+    if "f1_schedule" in filename:
+        return "schedule"
+    return Path(filename).parent.name
+
+
+def flatten_table(
+    df: pl.DataFrame | pl.LazyFrame, filename: str, normalized: bool = False
+) -> pl.DataFrame | pl.LazyFrame:
+    """
+    Flattens a nested table into the columns of its schema category.
+
+    Args:
+        df (pl.DataFrame or pl.LazyFrame): The nested table read (or scanned) from a raw file.
+        filename (str): Path of the raw file (gives its category).
+        normalized (bool, optional): Flatten into the columns of the normalized table
+            (without the race header). Defaults to False.
+
+    Returns:
+        pl.DataFrame or pl.LazyFrame: The flat table, eager or lazy like the input.
+        Categories missing from the schema fall back to `recursive_unnest_explode`.
+    """
+    planner = get_flatten_planner(normalized)
+    category = table_category(filename)
+    if isinstance(df, pl.LazyFrame):
+        if category in planner.schema:
+            return planner.flatten_lazy(df, category)
+        return recursive_unnest_explode(df=df.collect(), parent_prefix="").lazy()
+    if category in planner.schema:
+        return planner.flatten(df, category)
+    return recursive_unnest_explode(df=df, parent_prefix="")
+
+
+def scan_object_into_table(object_key: str) -> pl.LazyFrame:
+    """
+    Scans a raw file lazily into a table of races (or standings lists).
+
+    Args:
+        object_key (str): Path to the raw file.
+
+    Returns:
+        pl.LazyFrame: One row per race (or standings list).
+
+    Pages of the schema categories are decoded by Polars' native JSON reader with the
+    explicit page schema of their category (`FlattenPlanner.page_schema`): the Arrow
+    columns are built straight from the bytes, without type inference nor Python objects,
+    and fields the schema does not need are skipped. Newline-delimited files (compressed
+    or not) are scanned; ".json" arrays cannot be split and are read at once.
+    Other categories fall back to `read_untyped_table`.
+    """
+    planner = get_flatten_planner()
+    category = table_category(object_key)
+    if category not in planner.schema:
+        return read_untyped_table(object_key).lazy()
+    if category == "schedule":  # the schedule file holds the races themselves
+        return pl.read_json(object_key, schema=planner.row_dtype(category).to_schema()).lazy()
+
+    schema = planner.page_schema(category)
+    if raw_extension(object_key) == ".json":
+        pages = pl.read_json(object_key, schema=schema).lazy()
     else:
-        dataframes = [
-            pl.DataFrame(dt["MRData"]["RaceTable"]["Races"] if "RaceTable" in dt["MRData"].keys() 
-                         else dt["MRData"]["StandingsTable"]["StandingsLists"]) for dt in data
-                         ]
-        
-
-        dt = pl.concat(dataframes, how = "diagonal_relaxed")
-    if dt.shape != (0, 0):
-        return dt, object_key
+        pages = pl.scan_ndjson(object_key, schema=schema)
+    return page_rows(pages, category)
+
+
+def page_rows(pages: pl.LazyFrame, category: str) -> pl.LazyFrame:
+    """
+    Turns decoded API pages into a table of races (or standings lists).
+
+    Args:
+        pages (pl.LazyFrame): The pages, decoded with the page schema of their category.
+        category (str): The table name in the schema.
+
+    Returns:
+        pl.LazyFrame: One row per race (or standings list); empty pages add no rows.
+    """
+    table, rows = get_flatten_planner().table_fields(category)
+    return (
+        pages.select(pl.col("MRData").struct.field(table).struct.field(rows).alias(rows))
+        .filter(pl.col(rows).list.len() > 0)
+        .explode(rows)
+        .unnest(rows)
+    )
 
 
 def recursive_unnest_explode(df: pl.DataFrame, parent_prefix: str = "") -> pl.DataFrame:
@@ -125,35 +499,3 @@ def recursive_unnest_explode(df: pl.DataFrame, parent_prefix: str = "") -> pl.Da
         df = recursive_unnest_explode(df, parent_prefix=parent_prefix)
 
     return df
-
-
-def load_data_to_s3_as_parquet(
-    df: pl.DataFrame, s3_client: S3Client, filename: str, old_filename: str
-) -> None:
-    """
-    Writes a Polars DataFrame to S3 as a Parquet file with Gzip compression.
-
-    Args:
-        df (pl.DataFrame): The DataFrame to upload.
-        s3_client (S3Client): S3 client for handling file upload.
-        filename (str): New filename (Parquet format).
-        old_filename (str): Original JSON filename (to be deleted post-upload).
-
-    Behavior:
-        - Saves a local copy of the Parquet file before uploading.
-        - Uses Gzip compression for efficient storage.
-        - Deletes the original JSON file after a successful upload.
-    """
-    try:
-        buffer = BytesIO()
-        df.write_parquet(file=buffer, compression="gzip")
-        folder = "/".join(filename.split("/")[:-1])
-        Path(folder).mkdir(parents=True, exist_ok=True)
-        df.write_parquet(
-            filename, compression="gzip"
-        )  # get a copy in local for the loading part in the database
-        s3_client.write_object(object_key= filename, data=buffer.getvalue())
-        #print(f"Successfully uploaded {filename} to {s3_client.bucket_name}.")
-        Path(old_filename).unlink()
-    except Exception as e:
-        print(f"Error uploading Polars DataFrame to S3: {e}")
@@ -0,0 +1,253 @@
+import gzip
+import io
+import json
+import os
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+
+# Raw landing formats, detected from the file extension:
+# - ".json": a single JSON array holding every API page (original format)
+# - ".ndjson": one API page per line
+# - ".ndjson.gz": gzip-compressed ".ndjson"
+# - ".ndjson.zst": zstd-compressed ".ndjson" (requires the `zstandard` package)
+RAW_EXTENSIONS = (".ndjson.gz", ".ndjson.zst", ".ndjson", ".json")
+
+# HTTP Content-Encoding of the compressed formats, set on the uploaded objects
+CONTENT_ENCODINGS = {".gz": "gzip", ".zst": "zstd"}
+
+
+def raw_extension(path: str) -> str | None:
+    """
+    Returns the raw format extension of a file.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        str: The matching extension (e.g. ".ndjson.gz"), or None if the file is not a raw file.
+    """
+    return next((ext for ext in RAW_EXTENSIONS if str(path).endswith(ext)), None)
+
+
+def is_raw_file(path: str) -> bool:
+    """
+    Checks whether a file is a raw landing file.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        bool: True if the file has one of the raw format extensions.
+    """
+    return raw_extension(path) is not None
+
+
+def strip_raw_extension(path: str) -> str:
+    """
+    Removes the raw format extension of a file path.
+
+    Args:
+        path (str): The file path (e.g. "raw/laps/2024_laps.ndjson.gz").
+
+    Returns:
+        str: The path without its extension (e.g. "raw/laps/2024_laps").
+    """
+    return str(path)[: -len(raw_extension(path))]
+
+
+def open_raw(path: str, mode: str = "rt", compression: str | None = None):
+    """
+    Opens a raw file, (de)compressing it transparently based on its extension.
+
+    Args:
+        path (str): The file path.
+        mode (str): The file mode ("rt", "wt", "rb", ...).
+        compression (str, optional): Extension deciding the compression (".gz", ".zst"),
+            when it differs from the one of `path`. Defaults to the extension of `path`.
+
+    Returns:
+        file object: The opened file.
+    """
+    compression = compression or Path(path).suffix
+    if compression == ".gz":
+        if "w" in mode:
+            # a fixed header timestamp keeps identical content byte-identical across runs,
+            # so unchanged files have the same ETag and are not uploaded again
+            file = gzip.GzipFile(path, mode.replace("t", ""), mtime=0)
+            return io.TextIOWrapper(file, encoding="utf-8") if "t" in mode else file
+        return gzip.open(path, mode)
+    if compression == ".zst":
+        if zstandard is None:
+            raise ImportError("The zstd raw format requires the `zstandard` package (pip install zstandard)")
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+
+def upload_headers(path: str) -> dict:
+    """
+    Returns the S3 headers describing a raw file, so it can be uploaded as it is.
+
+    Args:
+        path (str): The file path.
+
+    Returns:
+        dict: The ContentType (and ContentEncoding of compressed files) of the object.
+    """
+    extension = raw_extension(path)
+    if extension == ".json":
+        return {"ContentType": "application/json"}
+    headers = {"ContentType": "application/x-ndjson"}
+    encoding = CONTENT_ENCODINGS.get(Path(path).suffix)
+    if encoding:
+        headers["ContentEncoding"] = encoding
+    return headers
+
+
+def read_pages(path: str):
+    """
+    Iterates over the API pages stored in a raw file, whatever its format.
+
+    Args:
+        path (str): The file path.
+
+    Yields:
+        dict: Each API page (an `MRData` response).
+    """
+    with open_raw(path, "rt") as file:
+        if raw_extension(path) == ".json":
+            yield from json.load(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def read_page_chunks(path: str, chunk_bytes: int):
+    """
+    Iterates over the API pages of a raw file in chunks of newline-delimited JSON.
+
+    Pages are read line by line from newline-delimited files (compressed or not), so
+    only one chunk is held in memory. ".json" arrays cannot be split before they are
+    parsed: they are loaded at once, then served in chunks.
+
+    Args:
+        path (str): The file path.
+        chunk_bytes (int): Size of the chunks; a chunk holds whole pages, and at least one.
+
+    Yields:
+        bytes: The pages of a chunk, one per line.
+    """
+    chunk, size = [], 0
+    for line in _page_lines(path):
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b"\n".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b"\n".join(chunk)
+
+
+def _page_lines(path: str):
+    if raw_extension(path) == ".json":
+        for page in read_pages(path):
+            yield json.dumps(page).encode()
+        return
+    with open_raw(path, "rb") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def check_raw_file(path: str, chunk_size: int = 1024 * 1024) -> bool:
+    """
+    Lightweight validity check of a raw file, without building the JSON object tree.
+
+    - ".json" files must start with "[" and end with "]" (only the first and last
+      chunks are read).
+    - Newline-delimited files must hold one "{...}" object per line; compressed files
+      are decompressed as a stream, which also verifies their checksum and detects
+      truncated archives.
+
+    Args:
+        path (str): The file path.
+        chunk_size (int): Size of the chunks read from disk.
+
+    Returns:
+        bool: True if the file looks complete and well framed.
+    """
+    try:
+        if raw_extension(path) == ".json":
+            with open(path, "rb") as file:
+                head = file.read(chunk_size).lstrip()
+                file.seek(max(0, Path(path).stat().st_size - chunk_size))
+                tail = file.read().rstrip()
+            return head[:1] == b"[" and tail[-1:] == b"]"
+
+        lines = 0
+        with open_raw(path, "rb") as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                if line[:1] != b"{" or line[-1:] != b"}":
+                    return False
+                lines += 1
+        return lines > 0
+    except (OSError, EOFError, ValueError):
+        return False
+
+
+class PageWriter:
+
+    def __init__(self, filename: str) -> None:
+        """
+        Initialize a streaming writer appending API pages to a newline-delimited raw file.
+
+        Pages are written to `<filename>.part` as soon as they arrive; the file is
+        atomically renamed to `filename` on `commit()`, so a partial file never
+        reaches data prep. Leaving the context without committing removes it.
+
+        Args:
+            filename (str): The final path of the raw file (".ndjson", ".ndjson.gz" or ".ndjson.zst").
+        """
+        self.filename = filename
+        self.part_filename = f"{filename}.part"
+        self.pages = 0
+        self.file = None
+
+    def __enter__(self) -> "PageWriter":
+        Path(self.filename).parent.mkdir(parents=True, exist_ok=True)
+        # the compression follows the final extension, not the ".part" one
+        self.file = open_raw(self.part_filename, "wt", compression=Path(self.filename).suffix)
+        return self
+
+    def write(self, page: dict) -> None:
+        """
+        Appends a page to the file.
+
+        Args:
+            page (dict): The API page to write.
+        """
+        self.file.write(json.dumps(page))
+        self.file.write("\n")
+        self.pages += 1
+
+    def commit(self) -> None:
+        """
+        Closes the file and moves it to its final path.
+        """
+        self.file.close()
+        os.replace(self.part_filename, self.filename)
+
+    def __exit__(self, *exc) -> bool:
+        if not self.file.closed:
+            self.file.close()
+            Path(self.part_filename).unlink(missing_ok=True)
+        return False
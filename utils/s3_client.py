@@ -1,9 +1,14 @@
 import boto3
-from botocore.exceptions import NoCredentialsError, PartialCredentialsError
+import hashlib
+from pathlib import Path
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError, NoCredentialsError, PartialCredentialsError
 from botocore.config import Config
+from utils.disk_cache import DiskCache
+from utils.storage import Storage
 
 
-class S3Client:
+class S3Client(Storage):
 
     def __init__(
         self,
@@ -11,21 +16,50 @@ class S3Client:
         aws_secret_access_key: str = None,
         region_name: str = None,
         bucket_name: str = None,
+        upload_workers: int = 8,
+        multipart_threshold_mb: int = 8,
+        multipart_chunksize_mb: int = 8,
+        multipart_concurrency: int = 4,
+        read_cache_directory: str = None,
+        read_cache_max_mb: float = 256,
     ) -> None: 
         """
         Initialize the S3 client with AWS credentials and target bucket name.
 
+        S3Client is the S3 backend of `Storage`: the bulk operations (`upload_files`,
+        `read_objects`, `write_objects`...) run on `upload_workers` threads.
+
         Args:
             aws_access_key_id (str, optional): AWS access key ID. Defaults to None.
             aws_secret_access_key (str, optional): AWS secret access key. Defaults to None.
             region_name (str, optional): AWS region name. Defaults to None.
             bucket_name (str, optional): Name of the S3 bucket to interact with. Defaults to None.
+            upload_workers (int, optional): Files uploaded concurrently by `upload_files`. Defaults to 8.
+            multipart_threshold_mb (int, optional): Size above which files are sent as multipart uploads. Defaults to 8.
+            multipart_chunksize_mb (int, optional): Size of each part of a multipart upload. Defaults to 8.
+            multipart_concurrency (int, optional): Parts of a file uploaded concurrently. Defaults to 4.
+            read_cache_directory (str, optional): Folder of the local read-through cache of
+                `read_object`. Defaults to None (no cache).
+            read_cache_max_mb (float, optional): Size of the read cache before LRU eviction. Defaults to 256.
         """
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
         self.region_name = region_name
         self.s3_client = None
         self.bucket_name = bucket_name
+        self.upload_workers = upload_workers
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold_mb * 1024 * 1024,
+            multipart_chunksize=multipart_chunksize_mb * 1024 * 1024,
+            max_concurrency=multipart_concurrency,
+        )
+        # every upload worker can have `multipart_concurrency` parts in flight
+        self.max_pool_connections = max(10, upload_workers * multipart_concurrency)
+        super().__init__(max_workers=upload_workers)
+        self.read_cache = DiskCache(read_cache_directory, read_cache_max_mb) if read_cache_directory else None
+
+    def __str__(self) -> str:
+        return f"bucket {self.bucket_name}"
 
     def connect(self) -> None:
         """
@@ -40,6 +74,7 @@ class S3Client:
                 aws_access_key_id=self.aws_access_key_id,
                 aws_secret_access_key=self.aws_secret_access_key,
                 region_name=self.region_name,
+                config=Config(max_pool_connections=self.max_pool_connections),
             )
             print("Connected to S3 successfully.")
         except (NoCredentialsError, PartialCredentialsError) as e:
@@ -56,41 +91,177 @@ class S3Client:
         Returns:
             bytes: The content of the object as bytes.
         
+        With a read cache, the object is requested with the ETag of the cached copy
+        (If-None-Match): an unchanged object answers 304 without a body and the cached
+        copy is returned, otherwise the new content replaces it.
         If there is an error reading the object, prints the error and returns None.
         """
         try:
-            response = self.s3_client.get_object(
-                Bucket=self.bucket_name, Key=object_key
-            )
-            return response["Body"].read()
+            cache_key = f"{self.bucket_name}/{object_key}"
+            cached = self.read_cache.get(cache_key) if self.read_cache else None
+            conditional = {"IfNoneMatch": cached[1]["etag"]} if cached else {}
+            try:
+                response = self.s3_client.get_object(
+                    Bucket=self.bucket_name, Key=object_key, **conditional
+                )
+            except ClientError as e:
+                if cached and e.response["Error"]["Code"] in ("304", "NotModified"):
+                    self._count_read("revalidated")
+                    return cached[0]
+                raise
+            body = response["Body"].read()
+            self._count_read("downloaded")
+            if self.read_cache:
+                self.read_cache.put(cache_key, body, {"etag": response["ETag"]})
+            return body
         except Exception as e:
             print(
                 f"Error reading object {object_key} from bucket {self.bucket_name}: {e}"
             )
             return None
 
-    def write_object(self, object_key: str, data: bytes | str) -> None:
+    def write_object(
+        self, object_key: str, data: bytes | str, skip_unchanged: bool = False, **headers
+    ) -> bool:
         """
         Uploads an object to an S3 bucket.
 
         Args:
             object_key (str): The key (path) where the object will be stored in S3.
             data (bytes or str): Data to be uploaded to S3. Can be in bytes or string format.
-        
+            skip_unchanged (bool, optional): If True, the object is not sent when its ETag matches
+                the one loaded by `load_etags`. Defaults to False.
+            **headers: Extra `put_object` arguments (e.g. ContentType, ContentEncoding).
+
+        Returns:
+            bool: True if the object was written, False if it was unchanged or the upload failed.
+
         If the data is a string, it is encoded as UTF-8 before uploading. 
         If an error occurs during upload, it is printed to the console.
         """
         try:
             if isinstance(data, str):
                 data = data.encode("utf-8")
+            etag = self.content_etag(data) if skip_unchanged else None
+            if skip_unchanged and self.is_unchanged(object_key, etag):
+                self._count(written=False, size=len(data))
+                return False
             self.s3_client.put_object(
-                Bucket=self.bucket_name, Key=object_key, Body=data
+                Bucket=self.bucket_name, Key=object_key, Body=data, **headers
             )
+            self._count(written=True, size=len(data), object_key=object_key, etag=etag)
             # print(f"Successfully uploaded {object_key} to {self.bucket_name}.")
+            return True
         except Exception as e:
             print(
                 f"Error writing object {object_key} to bucket {self.bucket_name}: {e}"
             )
+            return False
+
+    def upload_file(self, filename: str, object_key: str = None, **headers) -> int:
+        """
+        Uploads a local file to the S3 bucket, streaming it from disk.
+
+        Files larger than the multipart threshold are sent as multipart uploads,
+        with several parts in flight.
+
+        Args:
+            filename (str): Path of the local file.
+            object_key (str, optional): Key of the object in S3. Defaults to the file path.
+            **headers: Extra upload arguments (e.g. ContentType, ContentEncoding).
+
+        Returns:
+            int: The number of bytes uploaded.
+        """
+        self.s3_client.upload_file(
+            Filename=filename,
+            Bucket=self.bucket_name,
+            Key=object_key or filename,
+            ExtraArgs=headers or None,
+            Config=self.transfer_config,
+        )
+        return Path(filename).stat().st_size
+
+    def file_etag(self, filename: str) -> str:
+        """
+        Computes the ETag S3 will give to a local file uploaded with `upload_file`.
+
+        Files below the multipart threshold get the MD5 of their content; larger files get
+        the multipart ETag: the MD5 of the concatenated part digests, followed by the number
+        of parts. The file is read in chunks, never loaded whole.
+
+        Args:
+            filename (str): Path of the local file.
+
+        Returns:
+            str: The quoted ETag.
+        """
+        size = Path(filename).stat().st_size
+        chunksize = self.transfer_config.multipart_chunksize
+        with open(filename, "rb") as file:
+            if size < self.transfer_config.multipart_threshold:
+                digest = hashlib.md5()
+                for chunk in iter(lambda: file.read(chunksize), b""):
+                    digest.update(chunk)
+                return f'"{digest.hexdigest()}"'
+            parts = [hashlib.md5(chunk).digest() for chunk in iter(lambda: file.read(chunksize), b"")]
+        return f'"{hashlib.md5(b"".join(parts)).hexdigest()}-{len(parts)}"'
+
+    def load_etags(self, prefix: str) -> dict:
+        """
+        Loads the ETags of every object under a prefix, in bulk with the `list_objects_v2`
+        paginator (one request per 1000 objects instead of one HEAD per object).
+
+        Args:
+            prefix (str): Prefix of the object keys.
+
+        Returns:
+            dict: The ETag of each object key (also merged into `remote_etags`).
+        """
+        etags = {}
+        try:
+            paginator = self.s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+                etags.update({obj["Key"]: obj["ETag"] for obj in page.get("Contents", [])})
+        except Exception as e:
+            print(f"Error listing objects in bucket {self.bucket_name}: {e}")
+        self.remote_etags.update(etags)
+        return etags
+
+    def object_sizes(self, prefix: str) -> dict:
+        """
+        Lists the objects under a prefix with their size, using the `list_objects_v2` paginator.
+
+        Args:
+            prefix (str): Prefix of the object keys.
+
+        Returns:
+            dict: The size (in bytes) of each object key.
+        """
+        sizes = {}
+        try:
+            paginator = self.s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+                sizes.update({obj["Key"]: obj["Size"] for obj in page.get("Contents", [])})
+        except Exception as e:
+            print(f"Error listing objects in bucket {self.bucket_name}: {e}")
+        return sizes
+
+    def delete_objects(self, object_keys: list) -> None:
+        """
+        Deletes objects from the S3 bucket, 1000 keys per request.
+
+        Args:
+            object_keys (list): The keys of the objects.
+        """
+        for start in range(0, len(object_keys), 1000):
+            batch = object_keys[start:start + 1000]
+            self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+            for key in batch:
+                self.remote_etags.pop(key, None)
 
     def list_objects(self, prefix: str) -> None:
         """
@@ -1,17 +1,18 @@
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor
 from utils.s3_client import S3Client
+from utils.storage import Storage, LocalStorage
 from utils.config import get_all_file_paths
-from pathlib import Path
+from utils.raw_format import raw_extension, upload_headers, check_raw_file
 
 
-def connect_s3(config: dict) -> S3Client:
+def connect_s3(config: dict, settings: dict = None) -> S3Client:
     """
     Establish a connection to AWS S3 using the provided configuration.
 
     Args:
         config (dict): Configuration dictionary containing AWS credentials, region, and bucket name.
+        settings (dict, optional): The `s3` section of settings.yaml (upload workers, multipart sizes).
 
     Returns:
         S3Client: The established S3 client object.
@@ -24,73 +25,108 @@ def connect_s3(config: dict) -> S3Client:
         aws_secret_access_key=config["AWS_SECRET_KEY"],
         region_name=config["aws_region"],
         bucket_name=config["s3_bucket"],
+        **(settings or {}),
     )
     s3_client.connect()
     return s3_client
 
 
-def read_object_into_json(s3_client: S3Client, object_key: str) -> None:
+def connect_storage(config: dict, settings: dict) -> Storage:
+    """
+    Connect to the storage backend selected in settings.yaml.
+
+    Args:
+        config (dict): Configuration dictionary containing AWS credentials, region, and bucket name
+            (only used by the S3 backend).
+        settings (dict): The parsed settings.yaml (`storage` and `s3` sections).
+
+    Returns:
+        Storage: The connected S3 client, or the local storage when `storage.backend` is "local".
+    """
+    storage_settings = settings.get("storage", {})
+    if storage_settings.get("backend", "s3") == "local":
+        storage = LocalStorage(
+            root=storage_settings.get("local_root", ".storage"),
+            max_workers=settings.get("s3", {}).get("upload_workers", 8),
+        )
+        storage.connect()
+        return storage
+    return connect_s3(config, settings.get("s3"))
+
+
+def read_object_into_json(s3_client: Storage, object_key: str) -> None:
     """
     Read an object from S3 and load it into a JSON object.
 
     Args:
-        s3_client (S3Client): The connected S3 client instance.
+        s3_client (Storage): The connected storage (S3 bucket or local folder).
         object_key (str): The key (path) of the object in the S3 bucket.
 
     Returns:
-        dict: The parsed JSON object.
+        dict: The parsed JSON object (None if the object could not be read).
 
-    This function reads an object from S3 using the `read_object()` method of the S3Client,
+    This function reads an object using the `read_object()` method of the storage,
     and then converts the byte data into a Python dictionary by using `json.loads()`.
     """
     
     obj = s3_client.read_object(object_key)
-    return json.loads(obj)
+    return json.loads(obj) if obj is not None else None
 
 
-def upload_file(s3_client: S3Client, filename: str) -> None:
+def upload_file(s3_client: Storage, filename: str, validate: bool = False) -> int:
     """
-    Upload a file to S3 after reading it and converting its contents to JSON.
+    Upload a raw file to S3, streaming its bytes straight from disk.
 
     Args:
-        s3_client (S3Client): The connected S3 client instance.
-        filename (str): The local file to be uploaded.
+        s3_client (Storage): The connected storage (S3 bucket or local folder).
+        filename (str): The local file to be uploaded (also used as the object key).
+        validate (bool): If True, checks the file framing first (see `check_raw_file`).
 
-    This function creates the necessary directories for the file path, reads the file,
-    converts its contents to JSON, and uploads it to S3 using the `write_object()` method of
-    the `S3Client`. 
-    """
-    folder = "/".join(filename.split("/")[:-1])
-    Path(folder).mkdir(parents=True, exist_ok=True)
+    Returns:
+        int: The number of bytes uploaded (0 if the file failed the validity check).
 
-    with open(filename, "r") as file:
-        data = json.dumps(json.load(file))
+    The file is neither parsed nor loaded in memory: it is sent as it is with the
+    Content-Type/Content-Encoding of its raw format, through `Storage.upload_file`
+    (the transfer manager of the `S3Client`).
+    """
+    if validate and not check_raw_file(filename):
+        logging.error(f"{filename} is not a valid raw file, skipping upload.")
+        return 0
 
-    # logging.info(f"Uploading {filename} to S3...")
-    s3_client.write_object(object_key=filename, data=data)
+    return s3_client.upload_file(filename, **upload_headers(filename))
 
 
-def upload_results(s3_client: S3Client, foldername: str) -> None:
+def upload_results(
+    s3_client: Storage, foldername: str, validate: bool = True, skip_unchanged: bool = True
+) -> dict:
     """
-    Upload all files from a specified folder to S3 using parallel processing.
+    Upload all raw files from a specified folder to S3 concurrently.
 
     Args:
-        s3_client (S3Client): The connected S3 client instance.
+        s3_client (Storage): The connected storage (S3 bucket or local folder).
         foldername (str): The local folder containing the files to be uploaded.
+        validate (bool): If True, files failing the lightweight validity check are not uploaded.
+        skip_unchanged (bool): If True, files whose content already is in the bucket are not uploaded.
 
-    This function retrieves all file paths in the given folder, then uses a `ThreadPoolExecutor`
-    to upload the files concurrently (up to 3 files at a time). Once all files are uploaded,
-    a success message is logged.
-    """
+    Returns:
+        dict: The upload summary (files, skipped, failed, bytes, bytes_saved, seconds, mb_per_second,
+        and the list of failed files).
 
-    filelist = get_all_file_paths(foldername)
+    This function retrieves all raw file paths in the given folder (temporary `.part` files
+    are skipped), then uploads them concurrently with `Storage.upload_files`, each streamed
+    from disk with the Content-Type/Content-Encoding of its raw format.
+    """
 
-    try:
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            uploaded_file = [
-                executor.submit(upload_file(s3_client, filename))
-                for filename in filelist
-            ]
-        logging.info("Files uploaded in S3!")
-    except:
+    filelist = [filename for filename in get_all_file_paths(foldername) if raw_extension(filename)]
+    if not filelist:
         logging.info("no list to upload")
+        return {}
+
+    summary = s3_client.upload_files(
+        filelist,
+        headers_for=upload_headers,
+        check=check_raw_file if validate else None,
+        skip_unchanged=skip_unchanged,
+    )
+    logging.info("Files uploaded in S3!")
+    return summary
@@ -0,0 +1,529 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class Storage(ABC):
+
+    def __init__(self, max_workers: int = 8) -> None:
+        """
+        Base class of the storage backends (S3 bucket, local filesystem).
+
+        Backends implement the single-object operations (`read_object`, `write_object`,
+        `upload_file`, `list_objects`, `object_sizes`, `delete_objects`, `load_etags`,
+        `file_etag`), abstract here: a backend missing one cannot be instantiated. The
+        bulk operations are built on top of them and run up to `max_workers` operations
+        at a time, in worker threads driven by asyncio.
+
+        Args:
+            max_workers (int, optional): Operations run concurrently by the bulk methods. Defaults to 8.
+        """
+        self.max_workers = max_workers
+        # ETags of the stored objects, filled by `load_etags` for skip-if-unchanged writes
+        self.remote_etags = {}
+        self.transfer_stats = {"written": 0, "skipped": 0, "bytes_written": 0, "bytes_saved": 0}
+        self.read_stats = {"downloaded": 0, "revalidated": 0}
+        self._stats_lock = threading.Lock()
+
+    def connect(self) -> None:
+        """
+        Opens the connection to the storage (nothing to do by default).
+        """
+
+    @abstractmethod
+    def read_object(self, object_key: str) -> bytes | None:
+        """
+        Reads an object.
+
+        Args:
+            object_key (str): The key (path) of the object.
+
+        Returns:
+            bytes: The content of the object, or None if it could not be read.
+        """
+
+    @abstractmethod
+    def write_object(
+        self, object_key: str, data: bytes | str, skip_unchanged: bool = False, **headers
+    ) -> bool:
+        """
+        Writes an object.
+
+        Args:
+            object_key (str): The key (path) of the object.
+            data (bytes or str): The content of the object (strings are encoded as UTF-8).
+            skip_unchanged (bool, optional): If True, the object is not written when its ETag
+                matches the one loaded by `load_etags`. Defaults to False.
+            **headers: Extra arguments of the backend (e.g. ContentType, ContentEncoding).
+
+        Returns:
+            bool: True if the object was written.
+        """
+
+    @abstractmethod
+    def upload_file(self, filename: str, object_key: str = None, **headers) -> int:
+        """
+        Copies a local file into the storage.
+
+        Args:
+            filename (str): Path of the local file.
+            object_key (str, optional): Key of the object. Defaults to the file path.
+            **headers: Extra arguments of the backend (e.g. ContentType, ContentEncoding).
+
+        Returns:
+            int: The number of bytes written.
+        """
+
+    @abstractmethod
+    def list_objects(self, prefix: str) -> list:
+        """
+        Lists the keys of the objects under a prefix.
+
+        Args:
+            prefix (str): Prefix of the object keys.
+
+        Returns:
+            list: The matching object keys.
+        """
+
+    @abstractmethod
+    def object_sizes(self, prefix: str) -> dict:
+        """
+        Lists the objects under a prefix with their size.
+
+        Args:
+            prefix (str): Prefix of the object keys.
+
+        Returns:
+            dict: The size (in bytes) of each object key.
+        """
+
+    @abstractmethod
+    def delete_objects(self, object_keys: list) -> None:
+        """
+        Deletes objects (missing objects are ignored).
+
+        Args:
+            object_keys (list): The keys of the objects.
+        """
+
+    @abstractmethod
+    def load_etags(self, prefix: str) -> dict:
+        """
+        Loads the ETags of every object under a prefix into `remote_etags`.
+
+        Args:
+            prefix (str): Prefix of the object keys.
+
+        Returns:
+            dict: The ETag of each object key.
+        """
+
+    @abstractmethod
+    def file_etag(self, filename: str) -> str:
+        """
+        Computes the ETag a local file will have once written with `upload_file`.
+
+        Args:
+            filename (str): Path of the local file.
+
+        Returns:
+            str: The quoted ETag.
+        """
+
+    @staticmethod
+    def content_etag(data: bytes) -> str:
+        """
+        Computes the ETag S3 gives to an object uploaded in a single PUT.
+
+        Args:
+            data (bytes): The content of the object.
+
+        Returns:
+            str: The quoted MD5 of the content, as returned by S3.
+        """
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def sync_file(
+        self, filename: str, object_key: str = None, skip_unchanged: bool = True, **headers
+    ) -> bool:
+        """
+        Uploads a local file unless the stored object already holds the same content.
+
+        Args:
+            filename (str): Path of the local file.
+            object_key (str, optional): Key of the object. Defaults to the file path.
+            skip_unchanged (bool, optional): If False, the file is always uploaded. Defaults to True.
+            **headers: Extra arguments of the backend (e.g. ContentType, ContentEncoding).
+
+        Returns:
+            bool: True if the file was uploaded, False if it was unchanged.
+        """
+        object_key = object_key or filename
+        etag = self.file_etag(filename) if skip_unchanged else None
+        if skip_unchanged and self.is_unchanged(object_key, etag):
+            self._count(written=False, size=Path(filename).stat().st_size)
+            return False
+        size = self.upload_file(filename, object_key, **headers)
+        self._count(written=True, size=size, object_key=object_key, etag=etag)
+        return True
+
+    def is_unchanged(self, object_key: str, etag: str) -> bool:
+        """
+        Checks whether an object already holds a given content.
+
+        Objects encrypted with SSE-KMS have ETags that are not content digests: they never
+        match, so such objects are always written.
+
+        Args:
+            object_key (str): The key of the object.
+            etag (str): The ETag of the content to write.
+
+        Returns:
+            bool: True if the ETag loaded for the object matches.
+        """
+        return self.remote_etags.get(object_key) == etag
+
+    def _count(self, written: bool, size: int, object_key: str = None, etag: str = None) -> None:
+        """
+        Updates the transfer statistics of the run (and the known ETag of a written object).
+
+        Args:
+            written (bool): Whether the object was sent or skipped as unchanged.
+            size (int): The size of the object.
+            object_key (str, optional): The key of a written object.
+            etag (str, optional): The ETag of a written object, when it was computed.
+        """
+        with self._stats_lock:
+            if written:
+                self.transfer_stats["written"] += 1
+                self.transfer_stats["bytes_written"] += size
+                if etag:
+                    self.remote_etags[object_key] = etag
+            else:
+                self.transfer_stats["skipped"] += 1
+                self.transfer_stats["bytes_saved"] += size
+
+    def _count_read(self, kind: str) -> None:
+        """
+        Updates the read statistics of the run (reads run concurrently in worker threads).
+
+        Args:
+            kind (str): "downloaded" or "revalidated".
+        """
+        with self._stats_lock:
+            self.read_stats[kind] += 1
+
+    def transfer_summary(self) -> str:
+        """
+        Summarizes the objects written, skipped as unchanged and read during the run.
+
+        Returns:
+            str: The printable summary.
+        """
+        stats = self.transfer_stats
+        return (
+            f"{self} writes: {stats['written']} objects written ({stats['bytes_written'] / 1024 / 1024:.1f} MB), "
+            f"{stats['skipped']} unchanged skipped ({stats['bytes_saved'] / 1024 / 1024:.1f} MB saved); "
+            f"{self} reads: {self.read_stats['downloaded']} downloaded, "
+            f"{self.read_stats['revalidated']} served from the local cache"
+        )
+
+    def upload_files(
+        self,
+        filenames: list,
+        headers_for=None,
+        check=None,
+        skip_unchanged: bool = False,
+        max_workers: int = None,
+    ) -> dict:
+        """
+        Uploads local files concurrently to the storage (the object keys are the file paths).
+
+        Args:
+            filenames (list): Paths of the local files.
+            headers_for (callable, optional): Function returning the extra upload arguments of a file.
+            check (callable, optional): Function validating a file before its upload; files
+                failing the check are counted as failed and not uploaded.
+            skip_unchanged (bool, optional): If True, the ETags of the bucket are listed once
+                and files whose local ETag matches are not uploaded. Defaults to False.
+            max_workers (int, optional): Files uploaded concurrently. Defaults to `max_workers`.
+
+        Returns:
+            dict: A summary with the number of files uploaded, skipped as unchanged and failed,
+            the bytes sent and saved, the wall time and the throughput, and the failed files.
+
+        Failed uploads are printed and counted, they do not stop the other uploads.
+        """
+        def upload(filename: str) -> tuple:
+            if check is not None and not check(filename):
+                raise ValueError("file failed the validity check")
+            written = self.sync_file(
+                filename, skip_unchanged=skip_unchanged, **(headers_for(filename) if headers_for else {})
+            )
+            return written, Path(filename).stat().st_size
+
+        start = monotonic()
+        if skip_unchanged and filenames:
+            # list the common folder of the files only (not `raw/laps_old/` for `raw/laps/...`)
+            folder = os.path.commonpath([os.path.dirname(filename) for filename in filenames])
+            self.load_etags(f"{folder}/" if folder else "")
+        uploaded, skipped, total_bytes, bytes_saved = 0, 0, 0, 0
+        failures = []
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            futures = {executor.submit(upload, filename): filename for filename in filenames}
+            for future in as_completed(futures):
+                try:
+                    written, size = future.result()
+                    if written:
+                        uploaded += 1
+                        total_bytes += size
+                    else:
+                        skipped += 1
+                        bytes_saved += size
+                except Exception as e:
+                    failures.append(futures[future])
+                    print(f"Error uploading {futures[future]} to {self}: {e}")
+        failed = len(failures)
+
+        seconds = monotonic() - start
+        summary = {
+            "files": uploaded,
+            "skipped": skipped,
+            "failed": failed,
+            "bytes": total_bytes,
+            "bytes_saved": bytes_saved,
+            "seconds": round(seconds, 3),
+            "mb_per_second": round(total_bytes / 1024 / 1024 / seconds, 2) if seconds else 0.0,
+            "failures": sorted(failures),
+        }
+        logging.info(
+            f"Uploaded {uploaded} files ({total_bytes / 1024 / 1024:.1f} MB) in {seconds:.1f}s "
+            f"({summary['mb_per_second']} MB/s), {skipped} unchanged skipped "
+            f"({bytes_saved / 1024 / 1024:.1f} MB saved), {failed} failed"
+        )
+        return summary
+
+    @staticmethod
+    def _run(coroutine):
+        """
+        Runs a coroutine to completion from blocking code.
+
+        `asyncio.run` cannot be called from a thread already running an event loop (e.g.
+        a blocking call made from the async fetch path): the coroutine then runs on its
+        own loop in a helper thread, and the caller blocks until it is done.
+
+        Args:
+            coroutine: The coroutine.
+
+        Returns:
+            The result of the coroutine.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coroutine).result()
+
+    async def _run_all(self, function, items: list) -> list:
+        """
+        Runs a blocking operation on every item, `max_workers` at a time, in worker threads.
+
+        Args:
+            function (callable): The operation, called with each item.
+            items (list): The items.
+
+        Returns:
+            list: The results, in the order of the items.
+        """
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def run(item):
+            async with semaphore:
+                return await asyncio.to_thread(function, item)
+
+        return await asyncio.gather(*(run(item) for item in items))
+
+    async def read_objects_async(self, object_keys: list) -> dict:
+        """
+        Reads several objects concurrently.
+
+        Args:
+            object_keys (list): The keys of the objects.
+
+        Returns:
+            dict: The content of each object (None for objects that could not be read).
+        """
+        contents = await self._run_all(self.read_object, list(object_keys))
+        return dict(zip(object_keys, contents))
+
+    async def write_objects_async(self, objects: dict, skip_unchanged: bool = False, **headers) -> dict:
+        """
+        Writes several objects concurrently.
+
+        Args:
+            objects (dict): The content of each object key.
+            skip_unchanged (bool, optional): If True, unchanged objects are not written. Defaults to False.
+            **headers: Extra arguments of the backend, applied to every object.
+
+        Returns:
+            dict: Whether each object was written.
+        """
+        keys = list(objects)
+        written = await self._run_all(
+            lambda key: self.write_object(key, objects[key], skip_unchanged=skip_unchanged, **headers),
+            keys,
+        )
+        return dict(zip(keys, written))
+
+    async def list_objects_async(self, prefixes: list) -> dict:
+        """
+        Lists several prefixes concurrently.
+
+        Args:
+            prefixes (list): The prefixes of the object keys.
+
+        Returns:
+            dict: The object keys under each prefix.
+        """
+        keys = await self._run_all(self.list_objects, list(prefixes))
+        return dict(zip(prefixes, keys))
+
+    def read_objects(self, object_keys: list) -> dict:
+        """
+        Reads several objects concurrently (blocking version of `read_objects_async`).
+
+        Args:
+            object_keys (list): The keys of the objects.
+
+        Returns:
+            dict: The content of each object (None for objects that could not be read).
+        """
+        return self._run(self.read_objects_async(object_keys))
+
+    def write_objects(self, objects: dict, skip_unchanged: bool = False, **headers) -> dict:
+        """
+        Writes several objects concurrently (blocking version of `write_objects_async`).
+
+        Args:
+            objects (dict): The content of each object key.
+            skip_unchanged (bool, optional): If True, unchanged objects are not written. Defaults to False.
+            **headers: Extra arguments of the backend, applied to every object.
+
+        Returns:
+            dict: Whether each object was written.
+        """
+        return self._run(self.write_objects_async(objects, skip_unchanged=skip_unchanged, **headers))
+
+    def list_objects_many(self, prefixes: list) -> dict:
+        """
+        Lists several prefixes concurrently (blocking version of `list_objects_async`).
+
+        Args:
+            prefixes (list): The prefixes of the object keys.
+
+        Returns:
+            dict: The object keys under each prefix.
+        """
+        return self._run(self.list_objects_async(prefixes))
+
+
+class LocalStorage(Storage):
+
+    def __init__(self, root: str = ".storage", max_workers: int = 8) -> None:
+        """
+        Storage backend keeping the objects as files under a local folder, so the whole
+        pipeline can run (and be benchmarked) on one machine without a bucket.
+
+        Object keys are paths relative to `root`; ETags are the quoted MD5 of the files.
+        Backend headers (ContentType, ContentEncoding...) are accepted and ignored.
+
+        Args:
+            root (str, optional): Folder holding the objects. Defaults to ".storage".
+            max_workers (int, optional): Operations run concurrently by the bulk methods. Defaults to 8.
+        """
+        super().__init__(max_workers=max_workers)
+        self.root = Path(root)
+
+    def __str__(self) -> str:
+        return f"local storage {self.root}"
+
+    def connect(self) -> None:
+        """
+        Creates the root folder.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, object_key: str) -> Path:
+        return self.root / object_key
+
+    def read_object(self, object_key: str) -> bytes | None:
+        try:
+            data = self._path(object_key).read_bytes()
+        except OSError as e:
+            print(f"Error reading object {object_key} from {self}: {e}")
+            return None
+        self._count_read("downloaded")
+        return data
+
+    def write_object(
+        self, object_key: str, data: bytes | str, skip_unchanged: bool = False, **headers
+    ) -> bool:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        etag = self.content_etag(data) if skip_unchanged else None
+        if skip_unchanged and self.is_unchanged(object_key, etag):
+            self._count(written=False, size=len(data))
+            return False
+        try:
+            path = self._path(object_key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing object {object_key} to {self}: {e}")
+            return False
+        self._count(written=True, size=len(data), object_key=object_key, etag=etag)
+        return True
+
+    def upload_file(self, filename: str, object_key: str = None, **headers) -> int:
+        path = self._path(object_key or filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(filename, path)
+        return path.stat().st_size
+
+    def list_objects(self, prefix: str) -> list:
+        return sorted(
+            str(path.relative_to(self.root))
+            for path in self.root.rglob("*")
+            if path.is_file() and str(path.relative_to(self.root)).startswith(prefix)
+        )
+
+    def object_sizes(self, prefix: str) -> dict:
+        return {key: self._path(key).stat().st_size for key in self.list_objects(prefix)}
+
+    def delete_objects(self, object_keys: list) -> None:
+        for key in object_keys:
+            self._path(key).unlink(missing_ok=True)
+            self.remote_etags.pop(key, None)
+
+    def load_etags(self, prefix: str) -> dict:
+        etags = {key: self.file_etag(self._path(key)) for key in self.list_objects(prefix)}
+        self.remote_etags.update(etags)
+        return etags
+
+    def file_etag(self, filename: str) -> str:
+        digest = hashlib.md5()
+        with open(filename, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return f'"{digest.hexdigest()}"'